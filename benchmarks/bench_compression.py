@@ -0,0 +1,115 @@
+"""Bytes on the wire vs. CPU cost of each compression codec and level.
+
+Payloads:
+
+  text       --size MiB of random lines using the words of peer*/shared_files/*.txt
+  file_list  the JSON body of a REGISTER/HEARTBEAT carrying --files entries
+  zip        the text payload zipped (already compressed: should be skipped)
+  random     incompressible bytes
+
+For every payload, codec and level the benchmark reports the compressed size,
+the ratio, compress/decompress throughput, and the time to move the payload
+over a link of --mbps (compress + transfer + decompress, not overlapped). The
+"raw" row is the uncompressed transfer, and "skip" tells whether
+compression.looks_compressed() would have sent the payload as it is.
+
+Usage: python benchmarks/bench_compression.py [--size 8] [--files 5000] [--mbps 100,1000]
+"""
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "edge", "src"))
+
+from compression import compressor, decompress, looks_compressed  # noqa: E402
+
+LEVELS = {"zlib": [1, 6, 9], "bz2": [1, 9], "lzma": [0, 1, 6]}
+
+
+def text_payload(size):
+    """Lines of words drawn at random from the vocabulary of the shared .txt files."""
+    paths = sorted(glob.glob(os.path.join(ROOT, "peer*", "shared_files", "*.txt")))
+    words = b" ".join(open(path, "rb").read() for path in paths).split() or [b"lorem", b"ipsum", b"dolor"]
+    rng = random.Random(0)
+    out, total = [], 0
+    while total < size:
+        line = b" ".join(rng.choice(words) for _ in range(rng.randint(4, 16))) + b"\n"
+        out.append(line)
+        total += len(line)
+    return b"".join(out)[:size]
+
+
+def file_list_payload(count):
+    files = [{"name": f"arquivo_{i:06d}.txt", "checksum": hashlib.sha256(str(i).encode()).hexdigest()}
+             for i in range(count)]
+    return json.dumps({"type": "HEARTBEAT", "data": {"peer_id": "peer1", "files": files}}).encode()
+
+
+def zip_payload(text):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("data.txt", text)
+    return buf.getvalue()
+
+
+def timed(func, *args, min_time=0.2):
+    runs, start = 0, time.perf_counter()
+    while True:
+        result = func(*args)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return result, elapsed / runs
+
+
+def compress_with(codec, level, data):
+    c = compressor(codec, level)
+    return c.compress(data) + c.flush()
+
+
+def bench(name, data, links):
+    mb = len(data) / 1e6
+    skip = looks_compressed(data[:64 * 1024])
+    print(f"\n{name}: {len(data):,} bytes, skip={skip}")
+    header = f"  {'codec':<8}{'wire bytes':>14}{'ratio':>8}{'comp MB/s':>11}{'decomp MB/s':>13}"
+    header += "".join(f"{f'@{m}Mbps ms':>14}" for m in links)
+    print(header)
+    print(f"  {'raw':<8}{len(data):>14,}{1.0:>8.2f}{'-':>11}{'-':>13}"
+          + "".join(f"{len(data) * 8 / (m * 1e6) * 1000:>14.1f}" for m in links))
+    for codec, levels in LEVELS.items():
+        for level in levels:
+            packed, t_comp = timed(compress_with, codec, level, data)
+            restored, t_decomp = timed(decompress, packed, codec)
+            assert restored == data
+            row = f"  {f'{codec}-{level}':<8}{len(packed):>14,}{len(data) / len(packed):>8.2f}"
+            row += f"{mb / t_comp:>11.1f}{mb / t_decomp:>13.1f}"
+            row += "".join(f"{(t_comp + len(packed) * 8 / (m * 1e6) + t_decomp) * 1000:>14.1f}" for m in links)
+            print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=float, default=8, help="MiB of text/zip/random payload")
+    parser.add_argument("--files", type=int, default=5000, help="entries in the file list payload")
+    parser.add_argument("--mbps", default="100,1000", help="link speeds for the transfer-time columns")
+    args = parser.parse_args()
+    links = [int(m) for m in args.mbps.split(",") if m]
+    size = int(args.size * 1024 * 1024)
+
+    text = text_payload(size)
+    bench("text", text, links)
+    bench("file_list", file_list_payload(args.files), links)
+    bench("zip", zip_payload(text), links)
+    bench("random", os.urandom(size), links)
+
+
+if __name__ == "__main__":
+    main()
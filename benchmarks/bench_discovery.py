@@ -0,0 +1,145 @@
+"""Peer startup: how long peer1's discovery takes to find the edge.
+
+The edge runs in a child process on fixed free ports (TCP and the UDP
+discovery port); discovery is peer1's discover_edge() with its own cache file.
+
+  cold       no cached edge; the edge is up and answers the broadcast
+  warm       the edge is in the cache from an earlier start
+  cold-late  no cache; the edge starts --delay seconds after discovery
+  warm-late  cached edge that starts --delay seconds after discovery (an edge
+             restart while peers come back up)
+
+For the -late cases the time is counted from the moment the edge listens,
+so it is the delay discovery adds on top of the edge's own startup. Every
+case runs --runs times; the median and the worst run are reported.
+
+Usage: python benchmarks/bench_discovery.py [--runs 5] [--delay 1.5]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PEER_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "peer1", "src")
+EDGE_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "edge", "src")
+SERVE = "--serve" in sys.argv
+sys.path.insert(0, EDGE_SRC if SERVE else PEER_SRC)
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("0.0.0.0", 0))
+        return s.getsockname()[1]
+
+
+def serve(workdir, port, discovery_port, ready_file):
+    import builtins
+    import edge_node
+
+    builtins.print = lambda *a, **k: None
+    node = edge_node.EdgeNode(host="0.0.0.0", port=port, discovery_port=discovery_port, metrics_port=None,
+                              tasks_dir=os.path.join(workdir, "tasks"), results_dir=os.path.join(workdir, "results"),
+                              dead_letter_dir=os.path.join(workdir, "dead_letter"),
+                              result_cache_dir=os.path.join(workdir, "result_cache"), state_dir=None)
+
+    async def main():
+        task = asyncio.ensure_future(node.serve())
+        while node.edge_id is None:
+            await asyncio.sleep(0.001)
+        with open(ready_file, "w") as f:
+            f.write(repr(time.time()))
+        await task
+
+    asyncio.run(main())
+
+
+def start_edge(workdir, port, discovery_port):
+    ready_file = os.path.join(workdir, "ready")
+    if os.path.exists(ready_file):
+        os.remove(ready_file)
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", "--workdir", workdir, "--port", str(port),
+                             "--discovery-port", str(discovery_port), "--ready-file", ready_file],
+                            stdout=subprocess.DEVNULL)
+    return proc, ready_file
+
+
+def ready_time(ready_file, timeout=10):
+    deadline = time.time() + timeout
+    while not os.path.exists(ready_file) or not open(ready_file).read():
+        if time.time() > deadline:
+            raise RuntimeError("edge did not start")
+        time.sleep(0.01)
+    return float(open(ready_file).read())
+
+
+def run_case(case, workdir, delay):
+    import builtins
+    from discovery import discover_edge, save_cached_edges
+
+    port, discovery_port = free_port(), free_port(socket.SOCK_DGRAM)
+    cache = os.path.join(workdir, "edge_cache.json")
+    if os.path.exists(cache):
+        os.remove(cache)
+    if case.startswith("warm"):
+        save_cached_edges([f"127.0.0.1:{port}"], cache)
+    late = case.endswith("late")
+    proc = None
+    if not late:
+        proc, ready_file = start_edge(workdir, port, discovery_port)
+        ready_time(ready_file)
+    try:
+        quiet, builtins.print = builtins.print, lambda *a, **k: None
+        holder = []
+        try:
+            if late:
+                # Edge comes up while discovery is already retrying
+                threading.Timer(delay, lambda: holder.append(start_edge(workdir, port, discovery_port))).start()
+            start = time.time()
+            host, found_port, _, source = discover_edge("bench", 0, discovery_port, cache)
+            found = time.time()
+        finally:
+            builtins.print = quiet
+        if late:
+            proc, ready_file = holder[0]
+            start = ready_time(ready_file)
+        if found_port != port:
+            raise RuntimeError(f"found the wrong edge: {host}:{found_port}")
+        return max(0.0, found - start), source
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=1.5, help="seconds before the edge starts in the -late cases")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--discovery-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--ready-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.workdir, args.port, args.discovery_port, args.ready_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        for case in ("cold", "warm", "cold-late", "warm-late"):
+            times, sources = [], set()
+            for _ in range(args.runs):
+                elapsed, source = run_case(case, workdir, args.delay)
+                times.append(elapsed)
+                sources.add(source)
+            print(f"  {case:<10} median={statistics.median(times) * 1000:8.1f}ms  "
+                  f"max={max(times) * 1000:8.1f}ms  found by {'/'.join(sorted(sources))}")
+
+
+if __name__ == "__main__":
+    main()
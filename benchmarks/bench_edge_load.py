@@ -0,0 +1,206 @@
+"""Concurrent-peer load test: asyncio EdgeNode vs. the old threaded edge.
+
+Starts the edge in a child process on loopback, then simulates N peers that
+each REGISTER and send K HEARTBEATs. The asyncio edge is driven over one
+persistent session per peer; the threaded edge reproduces the previous
+run_tcp (listen(5), one thread per accepted socket, one socket per message).
+
+Reports completed/failed requests, throughput, p50/p99 latency and the edge's
+peak RSS.
+
+Usage: python benchmarks/bench_edge_load.py --server asyncio --peers 10000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+EDGE_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "edge", "src")
+sys.path.insert(0, EDGE_SRC)
+
+from connection import read_message, write_message, send_json, receive_json  # noqa: E402
+from protocol import build_message, parse_message  # noqa: E402
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve_threaded(port_file):
+    """The pre-asyncio edge: thread per connection, one message per connection."""
+    registry = {}
+
+    def handle_peer(conn):
+        try:
+            msg_type, data = parse_message(receive_json(conn))
+            if msg_type == "REGISTER":
+                registry[data["peer_id"]] = {"host": data["host"], "port": data["port"], "last_seen": time.time()}
+                send_json(conn, build_message("REGISTERED", {}))
+            elif msg_type == "HEARTBEAT":
+                registry[data["peer_id"]]["last_seen"] = time.time()
+                send_json(conn, build_message("ALIVE", {}))
+        except Exception:
+            pass
+        finally:
+            conn.close()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 0))
+    server.listen(5)
+    with open(port_file, "w") as f:
+        f.write(str(server.getsockname()[1]))
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=handle_peer, args=(conn,), daemon=True).start()
+
+
+def serve_asyncio(port_file):
+    import builtins
+    from edge_node import EdgeNode
+
+    builtins.print = lambda *a, **k: None  # keep per-message logging out of the measurement
+    workdir = os.path.dirname(port_file)
+    node = EdgeNode(host="127.0.0.1", port=0, discovery_port=None, metrics_port=None,
+                    tasks_dir=os.path.join(workdir, "tasks"), results_dir=os.path.join(workdir, "results"),
+                    dead_letter_dir=os.path.join(workdir, "dead_letter"),
+                    result_cache_dir=os.path.join(workdir, "result_cache"),
+                    state_dir=os.path.join(workdir, "edge_state"))
+
+    async def main():
+        task = asyncio.ensure_future(node.serve())
+        while node.port == 0:
+            await asyncio.sleep(0.01)
+        with open(port_file, "w") as f:
+            f.write(str(node.port))
+        await task
+
+    asyncio.run(main())
+
+
+def start_server(kind, workdir):
+    port_file = os.path.join(workdir, "port")
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", kind, "--port-file", port_file],
+                            stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while not os.path.exists(port_file) or not open(port_file).read():
+        if time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("edge did not start")
+        time.sleep(0.05)
+    return proc, int(open(port_file).read())
+
+
+def peak_rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def peer_session(port, peer_id, heartbeats, interval, latencies, errors, start_gate):
+    """One simulated peer on a persistent session."""
+    await start_gate.wait()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        errors.append("connect")
+        return
+    try:
+        messages = [("REGISTER", {"peer_id": peer_id, "host": "127.0.0.1", "port": 1})]
+        messages += [("HEARTBEAT", {"peer_id": peer_id})] * heartbeats
+        for i, (msg_type, data) in enumerate(messages):
+            t0 = time.perf_counter()
+            await write_message(writer, build_message(msg_type, data, i))
+            await read_message(reader)
+            latencies.append(time.perf_counter() - t0)
+            if interval:
+                await asyncio.sleep(interval)
+    except Exception as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def peer_connect_per_message(port, peer_id, heartbeats, interval, latencies, errors, start_gate):
+    """One simulated peer using a new connection per message (old client)."""
+    await start_gate.wait()
+    messages = [("REGISTER", {"peer_id": peer_id, "host": "127.0.0.1", "port": 1})]
+    messages += [("HEARTBEAT", {"peer_id": peer_id})] * heartbeats
+    for msg_type, data in messages:
+        t0 = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await write_message(writer, build_message(msg_type, data))
+            await read_message(reader)
+            writer.close()
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - t0)
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def drive(kind, port, peers, heartbeats, interval):
+    latencies, errors = [], []
+    gate = asyncio.Event()
+    peer = peer_session if kind == "asyncio" else peer_connect_per_message
+    tasks = [asyncio.ensure_future(peer(port, f"peer-{i}", heartbeats, interval, latencies, errors, gate))
+             for i in range(peers)]
+    t0 = time.perf_counter()
+    gate.set()
+    await asyncio.gather(*tasks)
+    return latencies, errors, time.perf_counter() - t0
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["asyncio", "threaded"], default="asyncio")
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--heartbeats", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between a peer's messages")
+    parser.add_argument("--serve", choices=["asyncio", "threaded"], help=argparse.SUPPRESS)
+    parser.add_argument("--port-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if args.serve == "threaded":
+        return serve_threaded(args.port_file)
+    if args.serve == "asyncio":
+        return serve_asyncio(args.port_file)
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, port = start_server(args.server, workdir)
+        try:
+            latencies, errors, elapsed = asyncio.run(
+                drive(args.server, port, args.peers, args.heartbeats, args.interval))
+            rss = peak_rss_kb(proc.pid)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    print(f"server={args.server} peers={args.peers} heartbeats/peer={args.heartbeats}")
+    print(f"  ok={len(latencies)} failed={len(errors)} ({', '.join(sorted(set(errors))) or '-'})")
+    print(f"  elapsed={elapsed:.2f}s throughput={len(latencies) / elapsed:.0f} req/s")
+    print(f"  p50={percentile(latencies, 50) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms")
+    print(f"  edge peak RSS={rss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""FileIndex lookup and search latency at a large number of indexed files.
+
+Builds an index of --files synthetic names spread over --peers peers, then
+times FIND_FILE-style lookups and paginated prefix/substring searches.
+
+Usage: python benchmarks/bench_file_index.py [--files 1000000] [--peers 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "edge", "src"))
+
+from file_index import FileIndex  # noqa: E402
+
+WORDS = ["animes", "noticias", "relatorio", "foto", "video", "musica", "backup", "dados",
+         "projeto", "aula", "slides", "teste", "log", "config", "notas", "livro"]
+EXTS = [".txt", ".pdf", ".zip", ".mp4", ".jpg", ".csv"]
+
+
+def synthetic_name(rng, i):
+    return f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i:07d}{rng.choice(EXTS)}"
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99) - 1] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--peers", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    index = FileIndex()
+    names = []
+    t0 = time.perf_counter()
+    for i in range(args.files):
+        name = synthetic_name(rng, i)
+        names.append(name)
+        index.add(f"peer-{i % args.peers}", name, f"{i:064x}")
+    print(f"indexed {len(index)} files in {time.perf_counter() - t0:.1f}s")
+
+    cases = [
+        ("find by name", lambda: index.find(rng.choice(names))),
+        ("find by checksum", lambda: index.find_checksum(f"{rng.randrange(args.files):064x}")),
+        ("prefix 'noticias_foto_00012'", lambda: index.search("noticias_foto_00012", "prefix")),
+        ("substring '0012345'", lambda: index.search("0012345")),
+        ("substring 'foto_0099' page 2", lambda: index.search("foto_0099", offset=50)),
+        ("prefix 'ani' (broad)", lambda: index.search("ani", "prefix")),
+        ("substring '.mp4' (broad)", lambda: index.search(".mp4")),
+    ]
+    print(f"{'query':<34} {'p50 (us)':>10} {'p99 (us)':>10}")
+    for label, fn in cases:
+        repeat = args.repeat if "broad" not in label else max(5, args.repeat // 20)
+        p50, p99 = timed(fn, repeat)
+        print(f"{label:<34} {p50:>10.1f} {p99:>10.1f}")
+
+    t0 = time.perf_counter()
+    index.remove_peer("peer-0")
+    print(f"remove_peer ({args.files // args.peers} files): {(time.perf_counter() - t0) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
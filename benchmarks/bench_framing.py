@@ -0,0 +1,119 @@
+"""Message throughput vs. size: framed connection.py vs. the legacy receive loop.
+
+The legacy receiver is the old peer1 implementation, which re-runs json.loads on
+the whole buffer after every BUFFER_SIZE chunk. The old edge/peer2 receiver (a
+single recv) cannot read messages larger than BUFFER_SIZE at all, so it is only
+reported for the sizes it can handle.
+
+Usage: python benchmarks/bench_framing.py [--sizes 1024,65536,...] [--seconds 1.0]
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "edge", "src"))
+
+from config import BUFFER_SIZE, ENCODING  # noqa: E402
+from connection import send_json, receive_json, send_message, receive_message  # noqa: E402
+
+
+def legacy_send_json(conn, data):
+    conn.sendall(json.dumps(data).encode(ENCODING))
+
+
+def legacy_receive_json(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(BUFFER_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        try:
+            return json.loads(b''.join(chunks).decode(ENCODING))
+        except json.JSONDecodeError:
+            continue
+    raise ConnectionError("Connection closed before receiving complete message")
+
+
+def legacy_single_recv(conn):
+    return json.loads(conn.recv(BUFFER_SIZE).decode(ENCODING))
+
+
+def make_payload(size):
+    # Mirrors TASK_PACKAGE: raw bytes base64-encoded inside a JSON string.
+    raw = os.urandom(size * 3 // 4)
+    return {"type": "TASK_PACKAGE", "data": {"task_name": "t.zip",
+                                              "task_data": base64.b64encode(raw).decode(ENCODING)}}
+
+
+def run_one_per_connection(sender, receiver, payload, seconds):
+    """One message per socket pair, as the legacy code requires."""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        a, b = socket.socketpair()
+        t = threading.Thread(target=lambda: (sender(a, payload), a.shutdown(socket.SHUT_WR)))
+        t.start()
+        receiver(b)
+        t.join()
+        a.close()
+        b.close()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def run_streamed(payload, seconds, attachment=b""):
+    """Many framed messages back to back over one connection."""
+    a, b = socket.socketpair()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            while not stop.is_set():
+                send_message(a, payload, attachment)
+        except OSError:
+            pass
+
+    t = threading.Thread(target=pump, daemon=True)
+    t.start()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        receive_message(b)
+        count += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    b.close()
+    a.close()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1024,16384,262144,1048576,4194304")
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'legacy-1recv':>14} {'legacy-loop':>14} {'framed':>14} "
+          f"{'framed-stream':>14} {'raw-attach':>14}  (msg/s)")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        payload = make_payload(size)
+        encoded = len(json.dumps(payload))
+        single = "fails"
+        if encoded <= BUFFER_SIZE:
+            single = f"{run_one_per_connection(legacy_send_json, legacy_single_recv, payload, args.seconds):.0f}"
+        loop = run_one_per_connection(legacy_send_json, legacy_receive_json, payload, args.seconds)
+        framed = run_one_per_connection(send_json, receive_json, payload, args.seconds)
+        stream = run_streamed(payload, args.seconds)
+        raw = run_streamed({"type": "TASK_PACKAGE", "data": {"task_name": "t.zip"}}, args.seconds,
+                           os.urandom(size * 3 // 4))
+        print(f"{encoded:>10} {single:>14} {loop:>14.0f} {framed:>14.0f} {stream:>14.0f} {raw:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Hot-path cost of the metrics subsystem.
+
+Two measurements:
+
+  micro  ns per Counter.inc / Histogram.observe, and per request for the full
+         set of updates _serve_request makes (2 clock reads, 3 counters, 1
+         histogram observation)
+  edge   HEARTBEAT throughput of an EdgeNode in a child process, driven over
+         loopback by --peers sessions, with the metrics live ("on") and with
+         every edge_node metric replaced by a no-op ("off"). Runs alternate
+         --rounds times; the best round of each is reported.
+
+Usage: python benchmarks/bench_metrics.py [--ops 1000000] [--peers 50] [--heartbeats 400]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+EDGE_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "edge", "src")
+sys.path.insert(0, EDGE_SRC)
+
+import metrics  # noqa: E402
+from connection import read_message, write_message  # noqa: E402
+from protocol import build_message  # noqa: E402
+
+
+class _Noop:
+    def inc(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+
+def micro(ops):
+    registry = metrics.Registry()
+    counter = registry.counter("c", "c", ("type",))
+    histogram = registry.histogram("h", "h", ("type",))
+
+    def per_op(func):
+        start = time.perf_counter()
+        func()
+        return (time.perf_counter() - start) / ops * 1e9
+
+    def loop():
+        for _ in range(ops):
+            pass
+
+    def inc():
+        for _ in range(ops):
+            counter.inc("HEARTBEAT")
+
+    def observe():
+        for _ in range(ops):
+            histogram.observe(0.0003, "HEARTBEAT")
+
+    def request():
+        for _ in range(ops):
+            start = time.perf_counter()
+            counter.inc("peer-1", value=120)
+            counter.inc("peer-1", value=80)
+            counter.inc("HEARTBEAT")
+            histogram.observe(time.perf_counter() - start, "HEARTBEAT")
+
+    base = per_op(loop)
+    print(f"micro ({ops:,} ops, loop overhead subtracted):")
+    print(f"  Counter.inc        {per_op(inc) - base:7.1f} ns")
+    print(f"  Histogram.observe  {per_op(observe) - base:7.1f} ns")
+    print(f"  per request        {per_op(request) - base:7.1f} ns")
+
+
+def serve(port_file, enabled):
+    import builtins
+    import edge_node
+
+    builtins.print = lambda *a, **k: None  # keep per-message logging out of the measurement
+    if not enabled:
+        for name in ("REQUESTS", "REQUEST_ERRORS", "REQUEST_SECONDS", "BYTES_RECEIVED", "BYTES_SENT"):
+            setattr(edge_node, name, _Noop())
+    workdir = os.path.dirname(port_file)
+    node = edge_node.EdgeNode(host="127.0.0.1", port=0, discovery_port=None, metrics_port=None,
+                              tasks_dir=os.path.join(workdir, "tasks"), results_dir=os.path.join(workdir, "results"),
+                              dead_letter_dir=os.path.join(workdir, "dead_letter"),
+                              result_cache_dir=os.path.join(workdir, "result_cache"), state_dir=None)
+
+    async def main():
+        task = asyncio.ensure_future(node.serve())
+        while node.port == 0:
+            await asyncio.sleep(0.01)
+        with open(port_file, "w") as f:
+            f.write(str(node.port))
+        await task
+
+    asyncio.run(main())
+
+
+def start_edge(mode, workdir):
+    port_file = os.path.join(workdir, f"port-{mode}")
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", mode, "--port-file", port_file],
+                            stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while not os.path.exists(port_file) or not open(port_file).read():
+        if time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("edge did not start")
+        time.sleep(0.05)
+    return proc, int(open(port_file).read())
+
+
+async def peer(port, peer_id, heartbeats, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        await write_message(writer, build_message("REGISTER", {"peer_id": peer_id, "host": "127.0.0.1", "port": 1}, 0))
+        await read_message(reader)
+        for i in range(heartbeats):
+            t0 = time.perf_counter()
+            await write_message(writer, build_message("HEARTBEAT", {"peer_id": peer_id}, i + 1))
+            await read_message(reader)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        writer.close()
+
+
+async def drive(port, peers, heartbeats):
+    latencies = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(peer(port, f"peer-{i}", heartbeats, latencies) for i in range(peers)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def edge(peers, heartbeats, rounds):
+    best = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(rounds):
+            for mode in ("off", "on"):
+                proc, port = start_edge(mode, workdir)
+                try:
+                    result = asyncio.run(drive(port, peers, heartbeats))
+                finally:
+                    proc.kill()
+                    proc.wait()
+                    os.remove(os.path.join(workdir, f"port-{mode}"))
+                if mode not in best or result[0] > best[mode][0]:
+                    best[mode] = result
+    print(f"edge ({peers} sessions x {heartbeats} HEARTBEATs, best of {rounds}):")
+    for mode in ("off", "on"):
+        rate, p50, p99 = best[mode]
+        print(f"  metrics {mode:<3}  {rate:8.0f} req/s  p50={p50 * 1000:.3f}ms  p99={p99 * 1000:.3f}ms")
+    print(f"  overhead: {(1 - best['on'][0] / best['off'][0]) * 100:+.1f}% throughput")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=1_000_000)
+    parser.add_argument("--peers", type=int, default=50)
+    parser.add_argument("--heartbeats", type=int, default=400)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--serve", choices=["on", "off"], help=argparse.SUPPRESS)
+    parser.add_argument("--port-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port_file, args.serve == "on")
+    micro(args.ops)
+    edge(args.peers, args.heartbeats, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+"""Loopback load suite: what the edge and a peer's file server sustain on one box.
+
+Starts an EdgeNode and a peer2 file server in child processes on 127.0.0.1
+(no network access needed), then runs these scenarios in order:
+
+  register  --peers peers REGISTER with --files synthetic file names each (drawn
+            from a catalog shared between peers), then send --heartbeats
+            HEARTBEATs, one persistent session per peer
+  heartbeat --peers more peers REGISTER, then --udp-beats UDP heartbeats each
+            from --clients sockets; the beats carry a file list version the
+            edge does not have, so every one is answered (NAK) and timed
+  find      --lookups FIND_FILE requests from --clients sessions over the index
+            built by "register" (about 10% of the names are misses)
+  download  --downloads whole-file GET_FILEs per size in --sizes from the file
+            server, --clients threads with one connection each
+  tasks     --tasks task packages of --task-kb KiB dropped into TASKS_DIR, run
+            by --workers simulated peers (REQUEST_TASK, zip a result,
+            SUBMIT_RESULT); latency is from the file landing to the result
+            being accepted
+
+Each scenario reports completed/failed operations, throughput, p50/p99 latency
+and the RSS of the process under test. Results are saved as JSON (--output);
+--compare OLD.json prints the change against an earlier run.
+
+Usage: python benchmarks/bench_suite.py [--scenarios register,heartbeat,find,download,tasks] [--peers 1000]
+       python benchmarks/bench_suite.py --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# The file server child runs peer2's code; everything else uses the edge's modules
+SERVE_FILES = "--serve-files" in sys.argv
+sys.path.insert(0, os.path.join(ROOT, "peer2" if SERVE_FILES else "edge", "src"))
+
+import connection  # noqa: E402
+from protocol import build_message, pack_heartbeat  # noqa: E402
+
+SCENARIOS = ("register", "heartbeat", "find", "download", "tasks")
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def silence():
+    import builtins
+    builtins.print = lambda *a, **k: None  # keep per-message logging out of the measurement
+
+
+def serve_edge(workdir, port_file):
+    from edge_node import EdgeNode
+
+    silence()
+    node = EdgeNode(host="127.0.0.1", port=0, discovery_port=0, metrics_port=None,
+                    tasks_dir=os.path.join(workdir, "tasks"), results_dir=os.path.join(workdir, "results"),
+                    dead_letter_dir=os.path.join(workdir, "dead_letter"),
+                    result_cache_dir=os.path.join(workdir, "result_cache"),
+                    state_dir=os.path.join(workdir, "edge_state"))
+
+    async def main():
+        task = asyncio.ensure_future(node.serve())
+        while node.port == 0:
+            await asyncio.sleep(0.01)
+        with open(port_file, "w") as f:
+            f.write(str(node.port))
+        await task
+
+    asyncio.run(main())
+
+
+def serve_files(workdir, port):
+    """peer2's own serve()/handle_request over <workdir>/shared."""
+    import config
+
+    silence()
+    config.SHARED_FILES_DIR = os.path.join(workdir, "shared")
+    config.CHECKSUM_CACHE_PATH = os.path.join(workdir, "checksum_cache.json")
+    config.PEER_PORT = port
+    import regular_node
+    regular_node.serve()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_children(workdir):
+    port_file = os.path.join(workdir, "edge.port")
+    edge = subprocess.Popen([sys.executable, __file__, "--serve-edge", "--workdir", workdir,
+                             "--port-file", port_file], stdout=subprocess.DEVNULL)
+    file_port = free_port()
+    files = subprocess.Popen([sys.executable, __file__, "--serve-files", "--workdir", workdir,
+                              "--port", str(file_port)], stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while not os.path.exists(port_file) or not open(port_file).read():
+        if time.time() > deadline:
+            raise RuntimeError("edge did not start")
+        time.sleep(0.05)
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", file_port), timeout=1).close()
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError("file server did not start")
+            time.sleep(0.05)
+    return edge, int(open(port_file).read()), files, file_port
+
+
+def rss_mib(pid):
+    """(current, peak) resident set size of `pid` in MiB."""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                values[line[:5]] = int(line.split()[1]) / 1024
+    return round(values.get("VmRSS", 0), 1), round(values.get("VmHWM", 0), 1)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(latencies, errors, elapsed, pid, **extra):
+    rss, peak = rss_mib(pid)
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    result = {
+        "ok": len(latencies),
+        "failed": len(errors),
+        "errors": sorted(set(errors)),
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": None if p50 is None else round(p50 * 1000, 3),
+        "p99_ms": None if p99 is None else round(p99 * 1000, 3),
+        "rss_mib": rss,
+        "peak_rss_mib": peak,
+    }
+    result.update(extra)
+    return result
+
+
+def catalog_name(i):
+    return f"file-{i:07d}.dat"
+
+
+def file_entry(i):
+    return {"name": catalog_name(i), "checksum": hashlib.sha256(catalog_name(i).encode()).hexdigest()}
+
+
+class Session:
+    """One persistent asyncio connection to the edge, one request at a time."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 1
+
+    @classmethod
+    async def open(cls, port):
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def request(self, msg_type, data, attachment=b""):
+        self.next_id += 1
+        await connection.write_message(self.writer, build_message(msg_type, data, self.next_id), attachment)
+        msg, attachment = await connection.read_message(self.reader)
+        return msg.get("type"), msg.get("data"), attachment
+
+    def close(self):
+        self.writer.close()
+
+
+async def timed_requests(port, count, clients, make_request):
+    """Run `count` operations over `clients` sessions; make_request(session, i) performs one."""
+    latencies, errors = [], []
+
+    async def client(c):
+        try:
+            session = await Session.open(port)
+        except OSError:
+            errors.append("connect")
+            return
+        try:
+            for i in range(c, count, clients):
+                t0 = time.perf_counter()
+                try:
+                    await make_request(session, i)
+                except Exception as e:
+                    errors.append(type(e).__name__)
+                    if isinstance(e, (OSError, asyncio.IncompleteReadError)):
+                        return
+                    continue
+                latencies.append(time.perf_counter() - t0)
+        finally:
+            session.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    return latencies, errors, time.perf_counter() - t0
+
+
+async def run_register(args):
+    rng = random.Random(0)
+    listings = [[file_entry(i) for i in rng.sample(range(args.catalog), min(args.files, args.catalog))]
+                for _ in range(args.peers)]
+    latencies, errors = [], []
+
+    async def peer(p):
+        peer_id = f"bench-{p}"
+        try:
+            session = await Session.open(args.edge_port)
+        except OSError:
+            errors.append("connect")
+            return
+        try:
+            messages = [("REGISTER", {"peer_id": peer_id, "host": "127.0.0.1", "port": args.file_port,
+                                      "files": listings[p], "version": 1})]
+            messages += [("HEARTBEAT", {"peer_id": peer_id, "version": 1})] * args.heartbeats
+            for msg_type, data in messages:
+                t0 = time.perf_counter()
+                reply, _, _ = await session.request(msg_type, data)
+                if reply not in ("REGISTERED", "ALIVE"):
+                    errors.append(reply)
+                    continue
+                latencies.append(time.perf_counter() - t0)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            errors.append(type(e).__name__)
+        finally:
+            session.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(peer(p) for p in range(args.peers)))
+    return summarize(latencies, errors, time.perf_counter() - t0, args.edge_pid,
+                     peers=args.peers, files_per_peer=args.files, heartbeats_per_peer=args.heartbeats)
+
+
+class _BeatReplies(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.waiter = None
+
+    def datagram_received(self, data, addr):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(data)
+
+
+async def run_heartbeat(args):
+    offers = {}
+
+    async def register(session, p):
+        reply, data, _ = await session.request("REGISTER", {"peer_id": f"udp-{p}", "host": "127.0.0.1",
+                                                            "port": args.file_port})
+        if reply != "REGISTERED" or "heartbeat" not in data:
+            raise RuntimeError(f"REGISTERED without a heartbeat offer: {reply}")
+        offers[p] = data["heartbeat"]
+
+    _, errors, _ = await timed_requests(args.edge_port, args.peers, args.clients, register)
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    async def client(c):
+        peers = [p for p in range(c, args.peers, args.clients) if p in offers]
+        if not peers:
+            return
+        transport, replies = await loop.create_datagram_endpoint(
+            _BeatReplies, remote_addr=("127.0.0.1", offers[peers[0]]["port"]))
+        try:
+            for seq in range(1, args.udp_beats + 1):
+                for p in peers:
+                    replies.waiter = loop.create_future()
+                    t0 = time.perf_counter()
+                    transport.sendto(pack_heartbeat(bytes.fromhex(offers[p]["token"]), seq, 1, 0))
+                    try:
+                        reply = await asyncio.wait_for(replies.waiter, 1.0)
+                    except asyncio.TimeoutError:
+                        errors.append("timeout")
+                        continue
+                    if reply != b"HNS":
+                        errors.append(repr(reply))
+                        continue
+                    latencies.append(time.perf_counter() - t0)
+        finally:
+            transport.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(args.clients)))
+    return summarize(latencies, errors, time.perf_counter() - t0, args.edge_pid,
+                     peers=args.peers, beats_per_peer=args.udp_beats)
+
+
+async def run_find(args):
+    rng = random.Random(1)
+    # Names past the catalog are never registered
+    names = [catalog_name(rng.randrange(int(args.catalog * 1.1))) for _ in range(args.lookups)]
+    outcomes = {"FILE_FOUND": 0, "FILE_NOT_FOUND": 0}
+
+    async def lookup(session, i):
+        reply, data, _ = await session.request("FIND_FILE", {"filename": names[i]})
+        if reply not in outcomes:
+            raise ValueError(reply)
+        outcomes[reply] += 1
+
+    latencies, errors, elapsed = await timed_requests(args.edge_port, args.lookups, args.clients, lookup)
+    return summarize(latencies, errors, elapsed, args.edge_pid, clients=args.clients,
+                     found=outcomes["FILE_FOUND"], not_found=outcomes["FILE_NOT_FOUND"])
+
+
+def run_download(args):
+    shared = os.path.join(args.workdir, "shared")
+    results = {}
+    for size_kb in args.sizes:
+        name = f"download-{size_kb}k.bin"
+        size = size_kb * 1024
+        with open(os.path.join(shared, name), "wb") as f:
+            f.write(os.urandom(size))
+        latencies, errors = [], []
+        lock = threading.Lock()
+        # Connect first: peer2 listens with a backlog of 5, and SYN retries would swamp the timings
+        socks = []
+        for _ in range(args.clients):
+            try:
+                socks.append(socket.create_connection(("127.0.0.1", args.file_port), timeout=30))
+            except OSError:
+                errors.append("connect")
+
+        def client(c):
+            sock = socks[c]
+            try:
+                for _ in range(c, args.downloads, len(socks)):
+                    received = [0]
+                    t0 = time.perf_counter()
+                    try:
+                        connection.send_json(sock, build_message("GET_FILE", {"filename": name}))
+                        msg, _ = connection.receive_message(sock, sink=lambda chunk: received.__setitem__(
+                            0, received[0] + len(chunk)))
+                    except OSError as e:
+                        with lock:
+                            errors.append(type(e).__name__)
+                        return
+                    elapsed = time.perf_counter() - t0
+                    with lock:
+                        if msg.get("type") == "FILE_DATA" and received[0] == size:
+                            latencies.append(elapsed)
+                        else:
+                            errors.append(msg.get("type") or "short")
+            finally:
+                sock.close()
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            list(pool.map(client, range(len(socks))))
+        elapsed = time.perf_counter() - t0
+        results[f"{size_kb}k"] = summarize(latencies, errors, elapsed, args.files_pid, clients=len(socks),
+                                           mb_per_s=round(len(latencies) * size / elapsed / 1e6, 1))
+    return results
+
+
+def task_package(i, size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("main.py", f"print('task {i}')\n")
+        z.writestr("input.bin", random.Random(i).randbytes(size))
+    return buf.getvalue()
+
+
+def execute(package):
+    """Stand-in for running the task: a small result zip derived from the package."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("output.txt", hashlib.sha256(package).hexdigest())
+    return buf.getvalue()
+
+
+async def run_tasks(args):
+    tasks_dir = os.path.join(args.workdir, "tasks")
+    packages = [task_package(i, args.task_kb * 1024) for i in range(args.tasks)]
+    submitted = {}
+    latencies, errors = [], []
+    remaining = [args.tasks]
+    done = asyncio.Event()
+
+    async def worker(w):
+        peer_id = f"bench-worker-{w}"
+        session = await Session.open(args.edge_port)
+        try:
+            await session.request("REGISTER", {"peer_id": peer_id, "host": "127.0.0.1", "port": 1, "slots": 1})
+            while not done.is_set():
+                reply, data, attachment = await session.request(
+                    "REQUEST_TASK", {"peer_id": peer_id, "max_tasks": 1, "wait": 1})
+                if reply != "TASK_PACKAGE":
+                    continue
+                offset = 0
+                for task in data["tasks"]:
+                    package = attachment[offset:offset + task["size"]]
+                    offset += task["size"]
+                    reply, _, _ = await session.request("SUBMIT_RESULT", {
+                        "peer_id": peer_id, "task_id": task["task_id"], "result_name": f"results_{task['task_id']}"
+                    }, execute(package))
+                    if reply == "OK":
+                        latencies.append(time.perf_counter() - submitted[task["task_id"]])
+                    else:
+                        errors.append(reply)
+                    remaining[0] -= 1
+                    if remaining[0] <= 0:
+                        done.set()
+        except (OSError, asyncio.IncompleteReadError) as e:
+            errors.append(type(e).__name__)
+        finally:
+            session.close()
+
+    workers = [asyncio.ensure_future(worker(w)) for w in range(args.workers)]
+    await asyncio.sleep(0.2)  # workers are long-polling before the first task lands
+    t0 = time.perf_counter()
+    for i, package in enumerate(packages):
+        task_id = f"bench-task-{i:06d}.zip"
+        tmp_path = os.path.join(tasks_dir, "." + task_id)
+        with open(tmp_path, "wb") as f:
+            f.write(package)
+        submitted[task_id] = time.perf_counter()
+        os.replace(tmp_path, os.path.join(tasks_dir, task_id))
+        await asyncio.sleep(0)
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        errors.extend(["timeout"] * remaining[0])
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await asyncio.gather(*workers)
+    return summarize(latencies, errors, elapsed, args.edge_pid, workers=args.workers, task_kb=args.task_kb)
+
+
+def show(name, result):
+    if result["p50_ms"] is None:
+        print(f"  {name:<16} ok=0 failed={result['failed']} ({', '.join(result['errors'])})")
+        return
+    line = (f"  {name:<16} ok={result['ok']:<7} failed={result['failed']:<4} {result['throughput']:>9.1f}/s"
+            f"  p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms  rss={result['rss_mib']}MiB"
+            f" (peak {result['peak_rss_mib']}MiB)")
+    if "mb_per_s" in result:
+        line += f"  {result['mb_per_s']} MB/s"
+    print(line)
+
+
+def flatten(scenarios):
+    for name, result in scenarios.items():
+        if "ok" in result:
+            yield name, result
+        else:
+            for sub, sub_result in result.items():
+                yield f"{name}/{sub}", sub_result
+
+
+def compare(old, new):
+    print(f"\nvs. {old['meta'].get('time')} ({old['meta'].get('commit') or 'unknown commit'}):")
+    previous = dict(flatten(old["scenarios"]))
+    for name, result in flatten(new["scenarios"]):
+        before = previous.get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ("throughput", "p50_ms", "p99_ms", "peak_rss_mib"):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {(result[key] / before[key] - 1) * 100:+.1f}%")
+        print(f"  {name:<16} " + "  ".join(changes))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=100, help="files per peer")
+    parser.add_argument("--catalog", type=int, default=20000, help="distinct file names shared between peers")
+    parser.add_argument("--heartbeats", type=int, default=3, help="HEARTBEATs per peer")
+    parser.add_argument("--udp-beats", type=int, default=20, help="UDP heartbeats per peer")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=16,
+                        help="concurrent sessions for heartbeat, find and download")
+    parser.add_argument("--sizes", default="64,1024,16384", help="KiB, comma separated")
+    parser.add_argument("--downloads", type=int, default=64, help="downloads per size")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--task-kb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the tasks scenario")
+    parser.add_argument("--output", help="JSON results path (default: bench_suite-<time>.json)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--serve-edge", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serve-files", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--port-file", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if args.serve_edge:
+        return serve_edge(args.workdir, args.port_file)
+    if args.serve_files:
+        return serve_files(args.workdir, args.port)
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    run = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("serve_edge", "serve_files", "workdir",
+                                                                     "port_file", "port", "output", "compare")},
+        },
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        os.makedirs(os.path.join(workdir, "shared"))
+        os.makedirs(os.path.join(workdir, "tasks"))
+        edge, args.edge_port, files, args.file_port = start_children(workdir)
+        args.edge_pid, args.files_pid = edge.pid, files.pid
+        try:
+            print(f"edge on :{args.edge_port}, file server on :{args.file_port}")
+            for name in SCENARIOS:
+                if name not in scenarios:
+                    continue
+                if name == "download":
+                    result = run_download(args)
+                else:
+                    result = asyncio.run({"register": run_register, "heartbeat": run_heartbeat, "find": run_find,
+                                          "tasks": run_tasks}[name](args))
+                run["scenarios"][name] = result
+                for label, flat in flatten({name: result}):
+                    show(label, flat)
+        finally:
+            for proc in (edge, files):
+                proc.kill()
+                proc.wait()
+
+    output = args.output or f"bench_suite-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"results saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Per-task overhead: cold `python main.py` (Popen) vs. the peer's WarmPool.
+
+Every task is a main.py that imports --imports and prints one line, run in
+its own directory with stdout/stderr captured to files, exactly as
+Peer.process_task does. Three modes are timed back to back:
+
+  cold       subprocess.Popen([sys.executable, main.py]) per task
+  warm       WarmPool without preloading (saves interpreter startup)
+  preloaded  WarmPool with --imports preloaded in the workers
+
+Usage: python benchmarks/bench_warm_pool.py [--tasks 200] [--imports json,decimal,...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "peer1", "src"))
+
+from warm_pool import WarmPool  # noqa: E402
+
+DEFAULT_IMPORTS = "json,decimal,asyncio,email.mime.multipart,http.client,xml.dom.minidom,logging.handlers"
+
+
+def make_tasks(root, count, imports):
+    tasks = []
+    for i in range(count):
+        task_dir = os.path.join(root, f"task{i}")
+        os.makedirs(task_dir)
+        script = os.path.join(task_dir, "main.py")
+        with open(script, "w") as f:
+            f.write("".join(f"import {name}\n" for name in imports))
+            f.write(f"print('task {i} done')\n")
+        tasks.append((task_dir, script))
+    return tasks
+
+
+def run_cold(task_dir, script, stdout_path, stderr_path):
+    with open(stdout_path, "w") as out, open(stderr_path, "w") as err:
+        return subprocess.Popen([sys.executable, script], stdout=out, stderr=err, cwd=task_dir).wait()
+
+
+def measure(run, tasks):
+    times = []
+    for task_dir, script in tasks:
+        stdout_path = os.path.join(task_dir, "stdout.txt")
+        t0 = time.perf_counter()
+        code = run(task_dir, script, stdout_path, os.path.join(task_dir, "stderr.txt"))
+        times.append(time.perf_counter() - t0)
+        with open(stdout_path) as f:
+            if code != 0 or "done" not in f.read():
+                raise RuntimeError(f"task in {task_dir} failed (exit {code})")
+    return sorted(times)
+
+
+def report(label, times):
+    mean = sum(times) / len(times)
+    p50 = times[len(times) // 2]
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"  {label:<10} mean={mean * 1000:7.2f}ms p50={p50 * 1000:7.2f}ms p99={p99 * 1000:7.2f}ms")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--imports", default=DEFAULT_IMPORTS)
+    args = parser.parse_args()
+    imports = [name for name in args.imports.split(",") if name]
+
+    print(f"tasks={args.tasks} imports={','.join(imports) or '-'}")
+    with tempfile.TemporaryDirectory() as root:
+        cold = report("cold", measure(run_cold, make_tasks(os.path.join(root, "cold"), args.tasks, imports)))
+
+        pool = WarmPool(1, max_tasks=args.tasks + 1)
+        try:
+            warm = report("warm", measure(pool.run, make_tasks(os.path.join(root, "warm"), args.tasks, imports)))
+        finally:
+            pool.close()
+
+        pool = WarmPool(1, preload=imports, max_tasks=args.tasks + 1)
+        try:
+            preloaded = report("preloaded", measure(pool.run, make_tasks(os.path.join(root, "pre"), args.tasks, imports)))
+        finally:
+            pool.close()
+
+    print(f"  speedup: warm {cold / warm:.1f}x, preloaded {cold / preloaded:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import hashlib
+import shutil
+import threading
+import uuid
+import zipfile
+
+BLOB_READ_SIZE = 1024 * 1024
+
+
+def _safe_member(name):
+    """Normalized relative path of a zip member, or None if it would escape the task dir."""
+    path = os.path.normpath(name.replace("\\", "/"))
+    if os.path.isabs(path) or path == ".." or path.startswith("../") or path == ".":
+        return None
+    return path
+
+
+class BlobStore:
+    """Content-addressed store of task package contents on the edge.
+
+    ingest() splits a task zip into one blob per file, named by the SHA-256 of
+    its uncompressed contents, and returns the task's manifest:
+    {"files": [[path, sha256, size], ...], "dirs": [path, ...]}. Tasks that
+    share code or data share blobs, so peers only fetch what they lack.
+    Blobs are reference counted per task and deleted with the last task that
+    uses them. ingest() and release() block (run them on an executor).
+    """
+
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        self.manifests = {}  # task_id -> manifest
+        self._refs = {}  # sha256 -> number of tasks using it
+        self._claims = {}  # sha256 -> ingests in progress that wrote or found it
+        self._lock = threading.Lock()
+
+    def path(self, sha):
+        return os.path.join(self.blob_dir, sha)
+
+    def clear(self):
+        """Drop blobs left over by a previous run; they are rebuilt on demand."""
+        shutil.rmtree(self.blob_dir, ignore_errors=True)
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def _store_member(self, archive, info):
+        """Write one member as a blob and claim it, so release() leaves it alone until ingest() is done."""
+        tmp_path = os.path.join(self.blob_dir, f".{uuid.uuid4().hex}.tmp")
+        sha = hashlib.sha256()
+        try:
+            with archive.open(info) as src, open(tmp_path, "wb") as dst:
+                while True:
+                    chunk = src.read(BLOB_READ_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    dst.write(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._claims[digest] = self._claims.get(digest, 0) + 1
+                if not os.path.exists(self.path(digest)):
+                    os.replace(tmp_path, self.path(digest))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return digest
+
+    def _unclaim(self, digests):
+        """Drop an ingest's claims and delete the blobs nothing else uses (call with the lock held)."""
+        for sha in digests:
+            self._claims[sha] -= 1
+            if not self._claims[sha]:
+                del self._claims[sha]
+                if sha not in self._refs:
+                    self._remove(sha)
+
+    def _remove(self, sha):
+        try:
+            os.remove(self.path(sha))
+        except FileNotFoundError:
+            pass
+
+    def ingest(self, task_id, zip_path):
+        """Return the manifest of `task_id`, splitting its zip into blobs on first use.
+
+        Raises ValueError or zipfile.BadZipFile for a bad package, leaving no
+        blobs of it behind. The unzip runs without the store's lock.
+        """
+        with self._lock:
+            manifest = self.manifests.get(task_id)
+        if manifest is not None:
+            return manifest
+        os.makedirs(self.blob_dir, exist_ok=True)
+        files, dirs, claimed = [], [], []
+        try:
+            with zipfile.ZipFile(zip_path) as archive:
+                members = archive.infolist()
+                paths = [_safe_member(info.filename) for info in members]
+                for info, path in zip(members, paths):
+                    if path is None:
+                        raise ValueError(f"Unsafe path in task package: {info.filename}")
+                for info, path in zip(members, paths):
+                    if info.is_dir():
+                        dirs.append(path)
+                    else:
+                        claimed.append(self._store_member(archive, info))
+                        files.append([path, claimed[-1], info.file_size])
+        except BaseException:
+            with self._lock:
+                self._unclaim(claimed)
+            raise
+        with self._lock:
+            manifest = self.manifests.get(task_id)
+            if manifest is None:  # not ingested concurrently meanwhile
+                manifest = self.manifests[task_id] = {"files": files, "dirs": dirs}
+                for sha in {entry[1] for entry in files}:
+                    self._refs[sha] = self._refs.get(sha, 0) + 1
+            self._unclaim(claimed)
+        return manifest
+
+    def release(self, task_id):
+        """Forget a finished task and delete the blobs no other task uses."""
+        with self._lock:
+            manifest = self.manifests.pop(task_id, None)
+            if manifest is None:
+                return
+            for sha in {entry[1] for entry in manifest["files"]}:
+                self._refs[sha] -= 1
+                if not self._refs[sha]:
+                    del self._refs[sha]
+                    if sha not in self._claims:
+                        self._remove(sha)
@@ -0,0 +1,171 @@
+import os
+import bz2
+import lzma
+import zlib
+import tempfile
+from config import COMPRESSION, COMPRESSION_LEVELS, COMPRESSION_MIN_SIZE
+
+# Codec IDs as carried in the frame header flags (0 = not compressed)
+CODEC_IDS = {"zlib": 1, "bz2": 2, "lzma": 3}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+CHUNK_SIZE = 1024 * 1024
+SNIFF_SIZE = 64 * 1024
+# A zlib level 1 pass over the sample must save at least this much
+MIN_SAVING = 0.1
+
+COMPRESSED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".zst", ".7z", ".rar", ".jar", ".whl", ".apk",
+    ".docx", ".xlsx", ".pptx", ".odt", ".epub",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".ogg", ".flac", ".aac", ".m4a", ".opus",
+    ".mp4", ".m4v", ".mkv", ".webm", ".avi", ".mov",
+}
+MAGIC_PREFIXES = (
+    b"PK\x03\x04", b"PK\x05\x06", b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00", b"\x28\xb5\x2f\xfd",
+    b"7z\xbc\xaf\x27\x1c", b"Rar!", b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"ID3", b"OggS",
+    b"fLaC", b"\x1a\x45\xdf\xa3",
+)
+
+
+def negotiate(offered, preferred=COMPRESSION):
+    """First codec of `preferred` that the other side also offered, or None."""
+    offered = set(offered or ())
+    for name in preferred:
+        if name in offered and name in CODEC_IDS:
+            return name
+    return None
+
+
+def compressor(codec, level=None):
+    """Streaming compressor for `codec` at `level` (default: COMPRESSION_LEVELS)."""
+    if level is None:
+        level = COMPRESSION_LEVELS.get(codec)
+    if codec == "zlib":
+        return zlib.compressobj(1 if level is None else level)
+    if codec == "bz2":
+        return bz2.BZ2Compressor(1 if level is None else level)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=0 if level is None else level)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompressor(codec):
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "bz2":
+        return bz2.BZ2Decompressor()
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def compress(data, codec):
+    c = compressor(codec)
+    return c.compress(data) + c.flush()
+
+
+class StreamDecompressor:
+    """Decompress a stream chunk by chunk, passing at most CHUNK_SIZE bytes at a time to `sink`.
+
+    `limit` caps the decompressed total (protection against compression bombs).
+    """
+
+    def __init__(self, codec, sink, limit=None):
+        self.codec = codec
+        self.sink = sink
+        self.limit = limit
+        self.total = 0
+        self._d = decompressor(codec)
+
+    def _emit(self, out):
+        if out:
+            self.total += len(out)
+            if self.limit is not None and self.total > self.limit:
+                raise ValueError(f"Decompressed data exceeds {self.limit} bytes")
+            self.sink(out)
+
+    def __call__(self, chunk):
+        d = self._d
+        if self.codec == "zlib":
+            data = bytes(chunk)
+            while data:
+                self._emit(d.decompress(data, CHUNK_SIZE))
+                data = d.unconsumed_tail
+        else:
+            if d.eof:
+                return
+            self._emit(d.decompress(bytes(chunk), CHUNK_SIZE))
+            while not d.eof and not d.needs_input:
+                self._emit(d.decompress(b"", CHUNK_SIZE))
+
+
+def decompress(data, codec, limit=None):
+    parts = []
+    StreamDecompressor(codec, parts.append, limit)(data)
+    return b"".join(parts)
+
+
+def looks_compressed(sample, name=None):
+    """True if the content is already compressed (archive, image, audio, video).
+
+    Decided from the file extension, then magic numbers, then by whether a
+    fast zlib pass over the sample saves anything worth the CPU.
+    """
+    if name and os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    sample = bytes(sample[:SNIFF_SIZE])
+    if sample.startswith(MAGIC_PREFIXES) or sample[4:8] == b"ftyp" or (
+            sample.startswith(b"RIFF") and sample[8:12] in (b"WEBP", b"AVI ", b"WAVE")):
+        return True
+    if len(sample) < COMPRESSION_MIN_SIZE:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_SAVING)
+
+
+def worth_compressing(size, sample, name=None):
+    return size >= COMPRESSION_MIN_SIZE and not looks_compressed(sample, name)
+
+
+def file_sample(f, offset=0):
+    return os.pread(f.fileno(), SNIFF_SIZE, offset)
+
+
+def compress_file_ranges(ranges, codec):
+    """Compress [(file, offset, count), ...] back to back into a temporary file.
+
+    Returns (file, size); the caller sends it with sendfile and closes it.
+    """
+    c = compressor(codec)
+    out = tempfile.TemporaryFile()
+    try:
+        for f, offset, count in ranges:
+            while count:
+                chunk = os.pread(f.fileno(), min(count, CHUNK_SIZE), offset)
+                if not chunk:
+                    raise EOFError(f"{getattr(f, 'name', 'file')} shrank while being compressed")
+                out.write(c.compress(chunk))
+                offset += len(chunk)
+                count -= len(chunk)
+        out.write(c.flush())
+        out.flush()
+        return out, out.tell()
+    except BaseException:
+        out.close()
+        raise
+
+
+def compress_files(files, codec, ranges=None):
+    """Compress `files` back to back if most of their bytes are compressible.
+
+    `ranges` gives an (offset, count) per file; whole files by default.
+    Returns (file, size) of a temporary file holding the compressed stream, or
+    None when compression would mostly be wasted on already-compressed data.
+    """
+    if ranges is None:
+        ranges = [(0, os.fstat(f.fileno()).st_size) for f in files]
+    compressible = sum(count for f, (offset, count) in zip(files, ranges)
+                       if worth_compressing(count, file_sample(f, offset), getattr(f, "name", None)))
+    if not compressible or compressible * 2 < sum(count for _, count in ranges):
+        return None
+    return compress_file_ranges([(f, offset, count) for f, (offset, count) in zip(files, ranges)], codec)
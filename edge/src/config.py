@@ -13,5 +13,74 @@ ENCODING = 'utf-8'
 # Directories for tasks and results
 TASKS_DIR = 'tasks'
 RESULTS_DIR = 'results'
+DEAD_LETTER_DIR = 'dead_letter'  # Tasks that failed MAX_TASK_ATTEMPTS times
 
+# Task scheduling
+LEASE_TIMEOUT = 60  # Seconds a task lease survives without a heartbeat from its peer
+MAX_TASK_ATTEMPTS = 3  # Handouts before a task goes to DEAD_LETTER_DIR
+MAX_TASKS_PER_REQUEST = 16  # Upper bound on a REQUEST_TASK batch
+TASK_SCAN_INTERVAL = 30  # Seconds between full scans of TASKS_DIR (safety net for the watcher)
+WATCH_TASKS_DIR = True  # Queue new task files as soon as they land in TASKS_DIR
+WATCH_POLL_INTERVAL = 1.0  # Seconds between scans when inotify is unavailable
+MAX_TASK_WAIT = 60  # Longest a REQUEST_TASK may be held open waiting for work
+SCHEDULER_TICK = 1.0  # Seconds between lease expiry checks
 
+# Peer liveness
+PEER_TIMEOUT = 35  # Peers not heard from (TCP or UDP heartbeat) for this long are dropped with their files and leases
+LIVENESS_TICK = 1.0  # Seconds per slot of the expiry timer wheel
+UDP_HEARTBEATS = True  # Offer peers compact UDP heartbeats on DISCOVERY_PORT in the REGISTERED reply
+
+# Result memoization (tasks opt in with {"deterministic": true} in their .json sidecar)
+RESULT_CACHE = True  # Complete repeated deterministic tasks from RESULT_CACHE_DIR
+RESULT_CACHE_DIR = 'result_cache'
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # Least recently used results are evicted past this
+RESULT_CACHE_MAX_AGE = 7 * 24 * 3600  # Seconds a cached result stays valid
+
+# Hot file cache: the edge pulls frequently requested shared files from a holder and serves them itself
+FILE_CACHE = False  # Cache hot files in FILE_CACHE_DIR and list the edge as one of their holders
+FILE_CACHE_DIR = 'file_cache'
+FILE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Least recently served files are evicted past this
+FILE_CACHE_MAX_FILE_BYTES = 256 * 1024 * 1024  # Larger files are never cached
+FILE_CACHE_MIN_REQUESTS = 20  # FIND_FILEs for a checksum within FILE_CACHE_WINDOW that make it hot...
+FILE_CACHE_WINDOW = 60  # ...counted over this many seconds
+FILE_CACHE_MAX_HOLDERS = 3  # Files held by more peers are left to them
+FILE_CACHE_SLOTS = 16  # Concurrent sends the edge's holder load is reported against in FIND_FILE
+FILE_CACHE_FETCH_TIMEOUT = 300  # Seconds a download into the cache may take before the next holder is tried
+
+# Warm restart: journal + snapshots of the peer registry and file lists
+STATE_DIR = 'edge_state'  # None keeps them in memory only
+STATE_FLUSH_INTERVAL = 0.5  # Seconds between journal writes (records are batched in between)
+STATE_SNAPSHOT_INTERVAL = 300  # Seconds between compacting snapshots...
+STATE_JOURNAL_MAX_BYTES = 64 * 1024 * 1024  # ...or sooner once the journal grows past this
+STATE_FSYNC = False  # fsync journal writes (survives power loss, not just a crash)
+STALE_PEER_TIMEOUT = 120  # Grace period for restored peers to REGISTER or HEARTBEAT before they are dropped
+
+# Server limits
+TCP_BACKLOG = 1024  # Pending connections queued by the kernel
+MAX_CONNECTIONS = 20000  # Concurrent peer sessions; extra connections are refused
+MAX_INFLIGHT_PER_CONNECTION = 32  # Requests processed concurrently per session
+IO_WORKERS = 8  # Threads for file/task I/O off the event loop
+SPOOL_THRESHOLD = 1024 * 1024  # Attachments larger than this are streamed to disk, not buffered
+SPOOL_CHUNK_SIZE = 1024 * 1024  # Bytes read from the socket per disk write while spooling
+SPOOL_MAX_SIZE = 4 * 1024 ** 3  # Largest request attachment (e.g. a task result) written to disk
+
+# Compression, negotiated per connection with HELLO (stdlib codecs: zlib, lzma, bz2)
+COMPRESSION = ["zlib", "lzma", "bz2"]  # Preference order; [] turns it off (best on fast LANs)
+COMPRESSION_LEVELS = {"zlib": 1, "lzma": 0, "bz2": 1}  # Fastest levels: see benchmarks/bench_compression.py
+COMPRESSION_MIN_SIZE = 1024  # Smaller bodies and attachments are sent as they are
+
+# Metrics: GET /metrics in the Prometheus text format (also the STATS message)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100  # None disables the HTTP endpoint
+
+# Federation: several edges split the file index by consistent hashing of names and checksums
+FEDERATION = False  # Join a ring of edges (peers learn it from MASTER_ANNOUNCE or RING)
+EDGE_SEEDS = []  # "host:port" of edges to join through; the first edge of a ring needs none
+EDGE_SYNC_INTERVAL = 5  # Seconds between membership exchanges with the other edges
+EDGE_TIMEOUT = 15  # Edges not heard from for this long leave the ring and the index rebalances
+EDGE_REQUEST_TIMEOUT = 10  # Seconds to wait for another edge's answer
+INDEX_BATCH = 5000  # Index entries per INDEX_UPDATE sent to another edge
+
+# File search
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 500
@@ -1,152 +1,1257 @@
 # edge/src/edge_node.py
+import asyncio
 import socket
-import threading
 import os
-import base64
 import json
+import uuid
+import random
+import zipfile
 import time
-from connection import send_json, receive_json
-from protocol import parse_message, build_message
-from config import EDGE_NODE_PORT, BUFFER_SIZE, ENCODING, DISCOVERY_PORT, TASKS_DIR, RESULTS_DIR
+import http
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from connection import read_message, write_message, write_file_message, encode_frame, ProtocolError
+from compression import StreamDecompressor, negotiate, compress_files
+from file_index import FileIndex
+from federation import Federation
+from hash_ring import HashRing, name_key, checksum_key
+from task_scheduler import TaskScheduler
+from blob_store import BlobStore
+from result_cache import ResultCache
+from file_cache import FileCache
+from state_store import StateStore
+from timer_wheel import TimerWheel
+from watcher import DirectoryWatcher
+from collections import OrderedDict
+from protocol import (
+    parse_message, build_message, message_id, unpack_heartbeat,
+    HEARTBEAT_MAGIC, HEARTBEAT_NAK_MAGIC, NAK_REGISTER, NAK_RESYNC
+)
+from config import (
+    EDGE_NODE_PORT,
+    ENCODING,
+    DISCOVERY_PORT,
+    TASKS_DIR,
+    RESULTS_DIR,
+    DEAD_LETTER_DIR,
+    LEASE_TIMEOUT,
+    MAX_TASK_ATTEMPTS,
+    MAX_TASKS_PER_REQUEST,
+    TASK_SCAN_INTERVAL,
+    SCHEDULER_TICK,
+    RESULT_CACHE,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_AGE,
+    FILE_CACHE,
+    FILE_CACHE_DIR,
+    FILE_CACHE_MAX_BYTES,
+    FILE_CACHE_MAX_FILE_BYTES,
+    FILE_CACHE_MIN_REQUESTS,
+    FILE_CACHE_WINDOW,
+    FILE_CACHE_MAX_HOLDERS,
+    FILE_CACHE_SLOTS,
+    FILE_CACHE_FETCH_TIMEOUT,
+    EDGE_REQUEST_TIMEOUT,
+    WATCH_TASKS_DIR,
+    WATCH_POLL_INTERVAL,
+    MAX_TASK_WAIT,
+    TCP_BACKLOG,
+    MAX_CONNECTIONS,
+    MAX_INFLIGHT_PER_CONNECTION,
+    IO_WORKERS,
+    SPOOL_THRESHOLD,
+    SPOOL_CHUNK_SIZE,
+    SPOOL_MAX_SIZE,
+    SEARCH_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
+    METRICS_HOST,
+    METRICS_PORT,
+    EDGE_NODE_HOST,
+    FEDERATION,
+    EDGE_SEEDS,
+    STATE_DIR,
+    STATE_FLUSH_INTERVAL,
+    STATE_SNAPSHOT_INTERVAL,
+    STATE_JOURNAL_MAX_BYTES,
+    STATE_FSYNC,
+    STALE_PEER_TIMEOUT,
+    PEER_TIMEOUT,
+    LIVENESS_TICK,
+    UDP_HEARTBEATS
+)
 
-# Dictionary to store registered peers
-peer_registry = {}
+REQUESTS = metrics.counter("edge_requests_total", "Requests handled, by message type", ("type",))
+REQUEST_ERRORS = metrics.counter("edge_request_errors_total", "Requests answered with ERROR, by message type", ("type",))
+REQUEST_SECONDS = metrics.histogram(
+    "edge_request_seconds", "Time from reading a request to sending its response, by message type", ("type",))
+BYTES_RECEIVED = metrics.counter(
+    "edge_received_bytes_total", "Bytes received, by peer ID (address until the peer names itself)", ("peer",))
+BYTES_SENT = metrics.counter("edge_sent_bytes_total", "Bytes sent, by peer ID", ("peer",))
+TASK_OUTCOMES = metrics.counter(
+    "edge_tasks_total", "Finished task attempts: completed, failed, dead_letter or memoized", ("outcome",))
+UDP_HEARTBEATS_RECEIVED = metrics.counter(
+    "edge_udp_heartbeats_total", "UDP heartbeats: ok, replayed (old sequence number), resync, unknown (token), malformed",
+    ("outcome",))
+PEERS_EXPIRED = metrics.counter("edge_peers_expired_total", "Peers dropped after PEER_TIMEOUT without a heartbeat")
+FILE_CACHE_FILLS = metrics.counter(
+    "edge_file_cache_fills_total", "Downloads into the hot file cache: cached, too_large, unavailable, mismatch, error",
+    ("outcome",))
+LEASE_SECONDS = metrics.histogram(
+    "edge_task_lease_seconds", "Time from leasing a task to its result or failure report",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
 
-def run_discovery():
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
     """UDP listener for service discovery."""
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse
-    udp_sock.bind(("0.0.0.0", DISCOVERY_PORT))
-    print(f"[MASTER] UDP listener active on port {DISCOVERY_PORT} for DISCOVER_MASTER")
-    
-    while True:
+
+    def __init__(self, node):
+        self.node = node
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[:2] == HEARTBEAT_MAGIC:
+            reason = self.node.on_udp_heartbeat(data)
+            if reason is not None:
+                self.transport.sendto(HEARTBEAT_NAK_MAGIC + reason, addr)
+            return
         try:
-            data, addr = udp_sock.recvfrom(BUFFER_SIZE)
             msg = json.loads(data.decode(ENCODING))
             msg_type, msg_data = parse_message(msg)
-            
+
             if msg_type == "DISCOVER_MASTER":
                 peer_id = msg_data.get("peer_id")
-                peer_port = msg_data.get("port")
                 print(f"[MASTER] DISCOVER_MASTER received from peer {peer_id} at {addr}")
-                
-                response = build_message("MASTER_ANNOUNCE", {
-                    "master_ip": socket.gethostbyname(socket.gethostname()),
-                    "master_port": EDGE_NODE_PORT
-                })
-                udp_sock.sendto(json.dumps(response).encode(ENCODING), addr)
+                packet = self.node.announce_packet()
+                if packet is not None:
+                    self.transport.sendto(packet, addr)
         except Exception as e:
             print(f"[MASTER] Error in discovery: {e}")
 
-def handle_peer(conn):
-    try:
-        msg = receive_json(conn)
-        msg_type, data = parse_message(msg)
 
-        if msg_type == 'REGISTER':
-            peer_id = data.get('peer_id')
-            host = data.get('host')
-            port = data.get('port')
-            
-            if host and port:
-                peer_registry[peer_id] = {
-                    "host": host,
-                    "port": port,
-                    "last_seen": time.time()
-                }
-                print(f"[MASTER] Peer registered: {peer_id}")
-                response = build_message("REGISTERED", {})
-                send_json(conn, response)
-            else:
-                response = build_message("ERROR", {"error": "Missing host or port"})
-                send_json(conn, response)
-
-        elif msg_type == 'HEARTBEAT':
-            peer_id = data.get('peer_id')
-            if peer_id in peer_registry:
-                peer_registry[peer_id]["last_seen"] = time.time()
-                print(f"[MASTER] Heartbeat received from {peer_id}")
-                response = build_message("ALIVE", {})
-                send_json(conn, response)
-            else:
-                response = build_message("ERROR", {"error": "Peer not registered"})
-                send_json(conn, response)
-
-        elif msg_type == "REQUEST_TASK":
-            peer_id = data.get('peer_id')
-            print(f"[MASTER] REQUEST_TASK received from {peer_id}")
-            
-            tasks = os.listdir(TASKS_DIR) if os.path.exists(TASKS_DIR) else []
-            if tasks:
-                task_name = tasks[0]  # Get first available task
-                task_path = os.path.join(TASKS_DIR, task_name)
-                with open(task_path, "rb") as f:
-                    task_data = f.read()
-                task_data_b64 = base64.b64encode(task_data).decode(ENCODING)
-                
-                response = build_message("TASK_PACKAGE", {
-                    "task_name": task_name,
-                    "task_data": task_data_b64
-                })
-                send_json(conn, response)
-                # Move or delete task after assignment
-                os.remove(task_path)
-            else:
-                response = build_message("NO_TASKS", {})
-                send_json(conn, response)
-
-        elif msg_type == "SUBMIT_RESULT":
-            peer_id = data.get('peer_id')
-            result_name = data.get("result_name")
-            result_data_b64 = data.get("result_data")
-            
-            print(f"[MASTER] SUBMIT_RESULT received from {peer_id}")
-            
-            result_bytes = base64.b64decode(result_data_b64.encode(ENCODING))
-            os.makedirs(RESULTS_DIR, exist_ok=True)
-            result_path = os.path.join(RESULTS_DIR, result_name)
-            
+class FileReply:
+    """Handler result whose attachment is the concatenation of open `files`, sent with sendfile.
+
+    `ranges` gives an (offset, count) per file; whole files by default.
+    The files are closed once sent. `on_sent(ok)` runs on the event loop when
+    the transfer finished (ok=True) or failed, so the handler can roll back
+    whatever it handed out.
+    """
+
+    def __init__(self, message, files, on_sent=None, ranges=None):
+        self.message = message
+        self.files = files
+        self.on_sent = on_sent
+        self.ranges = ranges
+
+
+class SpooledAttachment:
+    """A large request attachment already written to a file instead of memory."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class EdgeNode:
+    """Edge node serving peer sessions (TCP) and discovery (UDP) on one event loop."""
+
+    def __init__(self, host="0.0.0.0", port=EDGE_NODE_PORT, discovery_port=DISCOVERY_PORT,
+                 tasks_dir=TASKS_DIR, results_dir=RESULTS_DIR, dead_letter_dir=DEAD_LETTER_DIR,
+                 result_cache_dir=RESULT_CACHE_DIR, backlog=TCP_BACKLOG,
+                 max_connections=MAX_CONNECTIONS, max_inflight=MAX_INFLIGHT_PER_CONNECTION,
+                 metrics_port=METRICS_PORT, federation=FEDERATION, seeds=EDGE_SEEDS,
+                 advertise_host=EDGE_NODE_HOST, state_dir=STATE_DIR, file_cache_dir=FILE_CACHE_DIR):
+        self.host = host
+        self.port = port
+        self.advertise_host = advertise_host
+        self.edge_id = None  # "host:port" other edges and peers reach us at, once listening
+        self.discovery_port = discovery_port
+        self.tasks_dir = tasks_dir
+        self.results_dir = results_dir
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.max_inflight = max_inflight
+        self.metrics_port = metrics_port
+        # Registered peers. Only touched from the event loop, so no locking.
+        self.peer_registry = {}
+        self.file_index = FileIndex()
+        # With a federation, file_index is this edge's shard of the ring and
+        # the lists of our own peers are routed to whichever edges own them
+        self.federation = Federation(self, seeds) if federation else None
+        self.peer_files = self.federation.home if self.federation else self.file_index
+        # Registry and file lists survive restarts through a journal and snapshots
+        self.state = StateStore(state_dir, STATE_FSYNC) if state_dir else None
+        # Liveness: every peer sits in the wheel once, due PEER_TIMEOUT after it was last checked
+        self.wheel = TimerWheel(LIVENESS_TICK, PEER_TIMEOUT + LIVENESS_TICK, time.monotonic())
+        self.heartbeat_tokens = {}  # UDP heartbeat token -> peer_id
+        self.announce_ip = None  # resolved once in serve()
+        self._announce = (None, None)  # (ring version, MASTER_ANNOUNCE datagram)
+        self.scheduler = TaskScheduler(tasks_dir, dead_letter_dir, LEASE_TIMEOUT, MAX_TASK_ATTEMPTS)
+        self.scheduler.on_available = self._wake_task_waiter
+        self.blobs = BlobStore(os.path.join(tasks_dir, ".blobs"))
+        self.result_cache = None
+        if RESULT_CACHE:
+            self.result_cache = ResultCache(result_cache_dir, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE)
+        self.memo_keys = {}  # task_id -> result cache key, for queued deterministic tasks
+        # Hot shared files copied from their holders and served by the edge itself
+        self.file_cache = FileCache(file_cache_dir, FILE_CACHE_MAX_BYTES) if FILE_CACHE else None
+        self.file_requests = {}  # checksum -> FIND_FILEs answered in the current FILE_CACHE_WINDOW
+        self.cache_fills = set()  # checksums being pulled into the cache
+        self.cache_sends = 0  # cached files being sent right now
+        self.memo_checking = set()  # task IDs being looked up in the result cache
+        self.task_waiters = OrderedDict()  # futures of REQUEST_TASKs long-polling for work, oldest first
+        self.watcher = None
+        self.loop = None
+        self.active_connections = 0
+        self.executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="edge-io")
+        self.handlers = {
+            "REGISTER": self.on_register,
+            "HEARTBEAT": self.on_heartbeat,
+            "REQUEST_TASK": self.on_request_task,
+            "SUBMIT_RESULT": self.on_submit_result,
+            "TASK_FAILED": self.on_task_failed,
+            "FETCH_BLOBS": self.on_fetch_blobs,
+            "FIND_FILE": self.on_find_file,
+            "LIST_FILES": self.on_list_files,
+            "SEARCH": self.on_search,
+            "STATS": self.on_stats,
+            "RING": self.on_ring,
+        }
+        if self.file_cache is not None:
+            self.handlers["GET_FILE"] = self.on_get_file
+        if self.federation is not None:
+            self.handlers.update({
+                "EDGE_SYNC": self.on_edge_sync,
+                "EDGE_LEAVE": self.on_edge_leave,
+                "INDEX_UPDATE": self.on_index_update,
+            })
+        self._register_gauges()
+
+    def _register_gauges(self):
+        """Gauges read at scrape time (on the event loop), so they cost nothing per request."""
+        scheduler = self.scheduler
+        metrics.gauge("edge_connections", "Open peer sessions").set_function(lambda: self.active_connections)
+        metrics.gauge("edge_peers", "Registered peers").set_function(lambda: len(self.peer_registry))
+        metrics.gauge("edge_ring_members", "Edges in the ring (1 without a federation)").set_function(
+            lambda: len(self.federation.ring) if self.federation else 1)
+        metrics.gauge("edge_tasks_queued", "Tasks waiting for a peer").set_function(scheduler.queued_count)
+        metrics.gauge("edge_tasks_leased", "Tasks leased to peers").set_function(scheduler.leased_count)
+        metrics.gauge("edge_task_oldest_lease_seconds",
+                      "Age of the oldest outstanding lease").set_function(scheduler.oldest_lease_age)
+        metrics.gauge("edge_task_waiters", "REQUEST_TASKs long-polling for work").set_function(
+            lambda: len(self.task_waiters))
+        metrics.counter("edge_task_lease_expirations_total",
+                        "Leases that ran out without a heartbeat").set_function(lambda: scheduler.expirations)
+        if self.result_cache is not None:
+            cache = self.result_cache
+            metrics.counter("edge_result_cache_hits_total", "Tasks completed from the result cache").set_function(
+                lambda: cache.hits)
+            metrics.counter("edge_result_cache_misses_total", "Result cache lookups that ran the task").set_function(
+                lambda: cache.misses)
+            metrics.gauge("edge_result_cache_bytes", "Size of the result cache").set_function(
+                lambda: cache.stats()["bytes"])
+        if self.file_cache is not None:
+            files = self.file_cache
+            metrics.gauge("edge_file_cache_bytes", "Size of the hot file cache").set_function(
+                lambda: files.stats()["bytes"])
+            metrics.gauge("edge_file_cache_entries", "Files in the hot file cache").set_function(
+                lambda: files.stats()["entries"])
+            metrics.counter("edge_file_cache_evictions_total", "Files evicted from the hot file cache").set_function(
+                lambda: files.evictions)
+            metrics.gauge("edge_file_cache_sends", "Cached files being sent").set_function(lambda: self.cache_sends)
+
+    async def run_io(self, func, *args):
+        """Run blocking file/task I/O on the executor."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def on_register(self, data, attachment):
+        peer_id = data.get('peer_id')
+        host = data.get('host')
+        port = data.get('port')
+
+        if host and port:
+            old = self.peer_registry.get(peer_id)
+            if old is not None and old.get("token"):
+                self.heartbeat_tokens.pop(bytes.fromhex(old["token"]), None)
+            token = os.urandom(8)
+            info = self.peer_registry[peer_id] = {
+                "host": host,
+                "port": port,
+                "last_seen": time.monotonic(),
+                "slots": data.get("slots"),
+                "token": token.hex()
+            }
+            self.heartbeat_tokens[token] = peer_id
+            self.wheel.schedule(peer_id, info["last_seen"] + PEER_TIMEOUT)
+            if "files" in data:
+                self._sync_files(peer_id, info, data)
+            self._journal("peer", peer_id, self._peer_record(info))
+            print(f"[MASTER] Peer registered: {peer_id}")
+            reply = {}
+            if UDP_HEARTBEATS and self.discovery_port is not None:
+                reply["heartbeat"] = {"token": info["token"], "port": self.discovery_port}
+            return build_message("REGISTERED", reply)
+        return build_message("ERROR", {"error": "Missing host or port"})
+
+    def _sync_files(self, peer_id, info, data):
+        """Apply a full file list or a versioned delta. Returns False on version mismatch."""
+        if "files" in data:
+            self.peer_files.set_peer_files(peer_id, data["files"])
+            self._journal("files", peer_id, dict(self.peer_files.files_of(peer_id) or {}))
+        elif "delta" in data:
+            if data.get("base_version") != info.get("files_version"):
+                return False
+            delta = data["delta"]
+            for name in delta.get("removed", []):
+                self.peer_files.remove(peer_id, name)
+                self._journal("del", peer_id, name)
+            for entry in delta.get("added", []) + delta.get("modified", []):
+                self.peer_files.add(peer_id, entry["name"], entry["checksum"])
+                self._journal("add", peer_id, entry["name"], entry["checksum"])
+        elif "version" in data:
+            return data["version"] == info.get("files_version")
+        else:
+            return True
+        info["files_version"] = data.get("version", 0)
+        self._journal("peer", peer_id, {"files_version": info["files_version"]})
+        return True
+
+    async def on_heartbeat(self, data, attachment):
+        peer_id = data.get('peer_id')
+        info = self.peer_registry.get(peer_id)
+        if info is not None:
+            info["last_seen"] = time.monotonic()
+            info.pop("stale", None)
+            if "slots" in data:
+                info["slots"] = data["slots"]
+                info["free_slots"] = data.get("free_slots")
+            if "load" in data:
+                info["load"] = data["load"]
+            # Keep the leases of the tasks the peer is still working on
+            self.scheduler.renew(peer_id, data.get("tasks"))
+            if not self._sync_files(peer_id, info, data):
+                print(f"[MASTER] File list of {peer_id} out of sync, requesting full resync")
+                return build_message("RESYNC", {"version": info.get("files_version")})
+            print(f"[MASTER] Heartbeat received from {peer_id}")
+            return build_message("ALIVE", {})
+        return build_message("ERROR", {"error": "Peer not registered"})
+
+    def on_udp_heartbeat(self, packet):
+        """Apply a UDP heartbeat. Returns the NAK reason to send back, or None."""
+        try:
+            token, seq, files_version, free_slots, tasks, load = unpack_heartbeat(packet)
+        except ValueError:
+            UDP_HEARTBEATS_RECEIVED.inc("malformed")
+            return None
+        peer_id = self.heartbeat_tokens.get(token)
+        info = self.peer_registry.get(peer_id)
+        if info is None:
+            UDP_HEARTBEATS_RECEIVED.inc("unknown")
+            return NAK_REGISTER
+        if seq <= info.get("seq", 0):
+            UDP_HEARTBEATS_RECEIVED.inc("replayed")  # duplicated, reordered or replayed datagram
+            return None
+        info["seq"] = seq
+        info["last_seen"] = time.monotonic()
+        if free_slots >= 0:
+            info["free_slots"] = free_slots
+        if load is not None:
+            info["load"] = load
+        self.scheduler.renew(peer_id, tasks)
+        if files_version != (info.get("files_version") or 0):
+            UDP_HEARTBEATS_RECEIVED.inc("resync")
+            return NAK_RESYNC
+        info.pop("stale", None)
+        UDP_HEARTBEATS_RECEIVED.inc("ok")
+        return None
+
+    def _forget_peer(self, peer_id):
+        """Remove a peer with its files. Returns the IDs of its tasks that exhausted their attempts."""
+        info = self.peer_registry.pop(peer_id)
+        if info.get("token"):
+            self.heartbeat_tokens.pop(bytes.fromhex(info["token"]), None)
+        self.wheel.cancel(peer_id)
+        self.peer_files.remove_peer(peer_id)
+        self._journal("forget", peer_id)
+        return self.scheduler.drop_peer(peer_id)
+
+    async def _expire_peers(self):
+        """Drop peers whose timer ran out without a heartbeat since; reschedule the others."""
+        now = time.monotonic()
+        for peer_id in self.wheel.advance(now):
+            info = self.peer_registry.get(peer_id)
+            if info is None:
+                continue
+            deadline = info["last_seen"] + PEER_TIMEOUT
+            if deadline > now:
+                self.wheel.schedule(peer_id, deadline)
+                continue
+            print(f"[MASTER] Peer {peer_id} expired (no heartbeat for {now - info['last_seen']:.0f}s)")
+            PEERS_EXPIRED.inc()
+            for task_id in self._forget_peer(peer_id):
+                await self._bury(task_id)
+
+    def announce_packet(self):
+        """MASTER_ANNOUNCE datagram, built again only when the ring changes (None until we listen)."""
+        if self.edge_id is None:
+            return None  # the peer asks again
+        version = self.federation.ring.version if self.federation is not None else None
+        if self._announce[1] is None or self._announce[0] != version:
+            self._announce = (version, json.dumps(build_message("MASTER_ANNOUNCE", {
+                "master_ip": self.announce_ip,
+                "master_port": self.port,
+                "ring": self.ring_info()  # peers pick their edge and route FIND_FILE with it
+            })).encode(ENCODING))
+        return self._announce[1]
+
+    def ring_info(self):
+        if self.federation is not None:
+            return self.federation.ring_info()
+        return dict(HashRing([self.edge_id]).to_dict(), edge_id=self.edge_id)
+
+    def _peer_address(self, peer_id):
+        if self.federation is not None:
+            return self.federation.peers.get(peer_id)
+        return self.peer_registry.get(peer_id)
+
+    def _owner(self, data, key):
+        """Edge that should answer a request about `key`, or None if it is us."""
+        if self.federation is None or data.get("forwarded"):
+            return None  # forwarded requests are answered here even if our rings disagree
+        owner = self.federation.owner(key)
+        return None if owner == self.edge_id else owner
+
+    async def on_find_file(self, data, attachment):
+        filename = data.get("filename")
+        checksum = data.get("checksum")
+        owner = self._owner(data, checksum_key(checksum) if checksum else name_key(filename or ""))
+        if owner is not None:
+            response = await self.federation.forward(owner, "FIND_FILE", data)
+            response["data"]["ring"] = self.federation.ring.version
+            return response
+        if checksum:
+            found = self.federation.find_checksum(checksum) if self.federation else self.file_index.find_checksum(
+                checksum)
+            holders = {peer_id: (name, checksum) for peer_id, name in found.items()}
+        else:
+            holders = {peer_id: (filename, cs) for peer_id, cs in self.file_index.find(filename).items()}
+
+        peers = []
+        for peer_id, (name, cs) in holders.items():
+            info = self._peer_address(peer_id)
+            if info is not None:
+                peers.append({"peer_id": peer_id, "host": info["host"], "port": info["port"],
+                              "filename": name, "checksum": cs, "load": self._upload_load(peer_id)})
+                if info.get("stale"):
+                    peers[-1]["stale"] = True  # restored after a restart, not heard from since
+        if self.file_cache is not None:
+            peers.extend(self._cache_holders(peers, checksum))
+        peers = self._rank_holders(peers)
+        # The ring version lets clients notice they route with an outdated ring
+        ring = self.federation.ring.version if self.federation else None
+        if not peers:
+            return build_message("FILE_NOT_FOUND", {"filename": filename, "checksum": checksum, "ring": ring})
+        return build_message("FILE_FOUND", {"filename": filename, "peers": peers, "ring": ring})
+
+    def _cache_holders(self, peers, checksum=None):
+        """Count a FIND_FILE against each checksum it found; the edge's own holder entry for cached ones.
+
+        A checksum asked for FILE_CACHE_MIN_REQUESTS times in a window and
+        held by at most FILE_CACHE_MAX_HOLDERS fresh peers is pulled into the
+        cache in the background.
+        """
+        groups = {}
+        for peer in peers:
+            groups.setdefault(peer["checksum"], []).append(peer)
+        if checksum:
+            groups.setdefault(checksum, [])
+        entries = []
+        for cs, holders in groups.items():
+            if not cs:
+                continue
+            if self.file_cache.cached(cs):
+                entries.append({"peer_id": f"edge:{self.edge_id}", "host": self.advertise_host, "port": self.port,
+                                "filename": cs, "checksum": cs, "load": round(self.cache_sends / FILE_CACHE_SLOTS, 3),
+                                "edge": True})
+                continue
+            requests = self.file_requests[cs] = self.file_requests.get(cs, 0) + 1
+            fresh = [p for p in holders if not p.get("stale")]
+            if (requests >= FILE_CACHE_MIN_REQUESTS and fresh and len(fresh) <= FILE_CACHE_MAX_HOLDERS
+                    and cs not in self.cache_fills):
+                self.cache_fills.add(cs)
+                asyncio.ensure_future(self._fill_cache(cs, sorted(fresh, key=lambda p: p["load"])))
+        return entries
+
+    async def _fill_cache(self, checksum, holders):
+        """Pull a hot file into the file cache from the first holder that can send it."""
+        try:
+            for peer in holders:
+                try:
+                    outcome = await asyncio.wait_for(self._fetch_to_cache(peer, checksum), FILE_CACHE_FETCH_TIMEOUT)
+                except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    print(f"[MASTER] Could not cache {checksum[:12]} from {peer['peer_id']}: {e!r}")
+                    outcome = "error"
+                FILE_CACHE_FILLS.inc(outcome)
+                if outcome == "cached":
+                    print(f"[MASTER] Cached hot file {peer['filename']} ({checksum[:12]}) from {peer['peer_id']}")
+                    return
+                if outcome == "too_large":
+                    return
+        finally:
+            self.cache_fills.discard(checksum)
+            self.file_requests.pop(checksum, None)
+
+    async def _fetch_to_cache(self, peer, checksum):
+        """Download one file from a holder's file server into the cache; returns the fill outcome."""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(peer["host"], peer["port"]),
+                                                EDGE_REQUEST_TIMEOUT)
+        fill = None
+        try:
+            request = {"filename": peer["filename"], "offset": 0, "length": 0}
+            await write_message(writer, build_message("GET_FILE", request, 1))
+            msg, _ = await asyncio.wait_for(read_message(reader), EDGE_REQUEST_TIMEOUT)
+            msg_type, data = parse_message(msg)
+            if msg_type != "FILE_DATA":
+                return "unavailable"
+            if data["size"] > FILE_CACHE_MAX_FILE_BYTES:
+                return "too_large"
+            fill = await self.run_io(self.file_cache.fill, checksum)
+
+            async def spool(reader, length, codec, limit):
+                write = fill.write if codec is None else StreamDecompressor(codec, fill.write, limit)
+                remaining = length
+                while remaining:
+                    chunk = await reader.readexactly(min(remaining, SPOOL_CHUNK_SIZE))
+                    await self.run_io(write, chunk)
+                    remaining -= len(chunk)
+
+            request["length"] = data["size"]
+            await write_message(writer, build_message("GET_FILE", request, 2))
+            msg, _ = await read_message(reader, spool=spool, offload=self.run_io)
+            msg_type, data = parse_message(msg)
+            if msg_type != "FILE_DATA" or fill.size != request["length"]:
+                return "unavailable"  # BUSY, or the file changed since it was listed
+            committed = await self.run_io(self.file_cache.commit, fill)
+            fill = None
+            return "cached" if committed else "mismatch"
+        finally:
+            if fill is not None:
+                await self.run_io(fill.discard)
+            writer.close()
+
+    async def on_get_file(self, data, attachment):
+        """Serve a range of a cached file, as a peer's file server would (the file name is its checksum)."""
+        checksum = str(data.get("checksum") or data.get("filename") or "")
+        f = await self.run_io(self.file_cache.open, checksum)
+        if f is None:
+            return build_message("FILE_NOT_FOUND", {"filename": data.get("filename")})
+        size = os.fstat(f.fileno()).st_size
+        offset = min(max(0, int(data.get("offset", 0))), size)
+        length = data.get("length")
+        count = size - offset if length is None else max(0, min(int(length), size - offset))
+        message = build_message("FILE_DATA", {"filename": checksum, "offset": offset, "length": count, "size": size})
+        if not count:
+            f.close()
+            return message
+        self.cache_sends += 1
+
+        def on_sent(ok):
+            self.cache_sends -= 1
+        return FileReply(message, [f], on_sent, [(offset, count)])
+
+    def _upload_load(self, peer_id):
+        """Busy fraction of a holder's file server ((active + queued uploads) / slots); 0 if not reported."""
+        info = self.peer_registry.get(peer_id)
+        load = info.get("load") if info is not None else None
+        if not load or not load.get("slots"):
+            return 0.0
+        return round((load.get("active", 0) + load.get("queued", 0)) / load["slots"], 3)
+
+    @staticmethod
+    def _rank_holders(peers):
+        """Order holders by power of two choices: of two random candidates, the less loaded comes next.
+
+        Lightly loaded holders come first, yet two clients asking at once
+        rarely get the same order, so a hot file spreads over all its
+        holders. Stale holders go last.
+        """
+        fresh = [p for p in peers if not p.get("stale")]
+        ranked = []
+        while len(fresh) > 1:
+            i, j = random.sample(range(len(fresh)), 2)
+            best = i if fresh[i]["load"] <= fresh[j]["load"] else j
+            fresh[best], fresh[-1] = fresh[-1], fresh[best]
+            ranked.append(fresh.pop())
+        return ranked + fresh + [p for p in peers if p.get("stale")]
+
+    async def on_list_files(self, data, attachment):
+        peer_id = data.get("target_peer_id")
+        if peer_id not in self.peer_registry:
+            if self.federation is not None and not data.get("forwarded"):
+                # Its file list is kept by the edge holding its session
+                others = self.federation.ring.members - {self.edge_id}
+                for response in await asyncio.gather(*(self.federation.forward(m, "LIST_FILES", data)
+                                                       for m in others)):
+                    if response["type"] == "FILES_LIST":
+                        return response
+            return build_message("PEER_NOT_FOUND", {"peer_id": peer_id})
+        files = self.peer_files.files_of(peer_id) or {}
+        return build_message("FILES_LIST", {
+            "peer_id": peer_id,
+            "stale": bool(self.peer_registry[peer_id].get("stale")),
+            "files": [{"name": name, "checksum": cs} for name, cs in sorted(files.items())]
+        })
+
+    async def on_search(self, data, attachment):
+        query = data.get("query", "")
+        mode = data.get("mode", "substring")
+        offset = max(0, int(data.get("offset", 0)))
+        limit = max(1, int(data.get("limit", SEARCH_PAGE_SIZE)))
+        if not data.get("forwarded"):
+            limit = min(SEARCH_MAX_PAGE_SIZE, limit)
+        if self.federation is None or data.get("forwarded") or len(self.federation.ring) == 1:
+            page, total = self.file_index.search(query, mode, offset, limit)
+            results = [{"name": name, "holders": holders} for name, holders in page]
+        else:
+            # Names are spread over the shards: take the first offset+limit of each and merge
+            head = {"query": query, "mode": mode, "offset": 0, "limit": offset + limit}
+            others = self.federation.ring.members - {self.edge_id}
+            responses = await asyncio.gather(*(self.federation.forward(m, "SEARCH", head) for m in others))
+            page, total = self.file_index.search(query, mode, 0, offset + limit)
+            results = [{"name": name, "holders": holders} for name, holders in page]
+            for response in responses:
+                if response["type"] != "SEARCH_RESULTS":
+                    return response
+                total += response["data"]["total"]
+                results.extend(response["data"]["results"])
+            results.sort(key=lambda r: (r["name"].casefold(), r["name"]))
+            results = results[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < total else None
+        return build_message("SEARCH_RESULTS", {
+            "query": query,
+            "mode": mode,
+            "total": total,
+            "offset": offset,
+            "next_offset": next_offset,
+            "results": results
+        })
+
+    async def on_ring(self, data, attachment):
+        return build_message("RING", self.ring_info())
+
+    async def on_edge_sync(self, data, attachment):
+        if not data.get("edge_id"):
+            return build_message("ERROR", {"error": "Missing edge_id"})
+        self.federation.heard(data["edge_id"], data.get("members", ()))
+        return build_message("EDGE_SYNC", self.federation.ring_info())
+
+    async def on_edge_leave(self, data, attachment):
+        print(f"[MASTER] Edge {data.get('edge_id')} is leaving the ring")
+        self.federation.leave(data.get("edge_id"))
+        return build_message("OK", {})
+
+    async def on_index_update(self, data, attachment):
+        origin = data.get("origin")
+        if not origin:
+            return build_message("ERROR", {"error": "Missing origin"})
+        self.federation.heard(origin)  # may reach us before its first EDGE_SYNC
+        self.federation.apply(origin, data.get("peers", {}), data.get("ops", []))
+        return build_message("OK", {})
+
+    async def on_stats(self, data, attachment):
+        return build_message("STATS", metrics.stats_reply(data))
+
+    def _open_tasks(self, task_ids):
+        """Open leased task files; returns [(task_id, file)] and the IDs that vanished."""
+        opened, missing = [], []
+        for task_id in task_ids:
+            try:
+                opened.append((task_id, open(self.scheduler.task_path(task_id), "rb")))
+            except FileNotFoundError:
+                missing.append(task_id)
+        return opened, missing
+
+    def _wake_task_waiter(self):
+        """A task was queued: hand it to the longest-waiting REQUEST_TASK."""
+        while self.task_waiters:
+            waiter, _ = self.task_waiters.popitem(last=False)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _lease_tasks(self, peer_id, requested, wait):
+        """Lease up to `requested` tasks, holding the request open up to `wait` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        woken = False
+        while True:
+            count = requested
+            slots = (self.peer_registry.get(peer_id) or {}).get("slots")
+            if slots is not None:
+                # Never lease a peer more tasks than it can run at once
+                count = min(count, slots - self.scheduler.leased_count(peer_id))
+            task_ids = self.scheduler.lease(peer_id, count) if count > 0 else []
+            if woken and not task_ids and self.scheduler.has_queued():
+                self._wake_task_waiter()  # we cannot take the task we were woken for: pass it on
+            woken = False
+            remaining = deadline - loop.time()
+            if task_ids or remaining <= 0:
+                return task_ids
+            if count <= 0:
+                # Full peer: a queued task would not be ours, just check again shortly
+                await asyncio.sleep(min(remaining, SCHEDULER_TICK))
+                continue
+            waiter = loop.create_future()
+            self.task_waiters[waiter] = None
+            try:
+                await asyncio.wait_for(waiter, remaining)
+                woken = True
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_task_waiter()  # woken just as the request went away
+                raise
+            finally:
+                self.task_waiters.pop(waiter, None)
+
+    async def on_request_task(self, data, attachment):
+        peer_id = data.get('peer_id')
+        count = min(MAX_TASKS_PER_REQUEST, max(1, int(data.get("max_tasks", 1))))
+        wait = min(MAX_TASK_WAIT, max(0.0, float(data.get("wait", 0))))
+        print(f"[MASTER] REQUEST_TASK received from {peer_id} (up to {count}, wait {wait}s)")
+
+        task_ids = await self._lease_tasks(peer_id, count, wait)
+        if not task_ids:
+            return build_message("NO_TASKS", {})
+        if data.get("blobs"):
+            return await self._task_manifests(peer_id, task_ids)
+        opened, missing = await self.run_io(self._open_tasks, task_ids)
+        for task_id in missing:
+            await self._discard_task(task_id)
+        if not opened:
+            return build_message("NO_TASKS", {})
+
+        # One frame for the whole batch: the attachment is the packages back to back
+        tasks = [{"task_id": task_id, "size": os.fstat(f.fileno()).st_size} for task_id, f in opened]
+        message = build_message("TASK_PACKAGE", {"tasks": tasks, "lease_timeout": LEASE_TIMEOUT})
+        sent_ids = [task_id for task_id, _ in opened]
+
+        def on_sent(ok):
+            if not ok:
+                self.scheduler.release(sent_ids)
+        return FileReply(message, [f for _, f in opened], on_sent)
+
+    async def _task_manifests(self, peer_id, task_ids):
+        """TASK_PACKAGE for peers with a blob store: manifests only, blobs via FETCH_BLOBS."""
+        tasks = []
+        for task_id in task_ids:
+            try:
+                manifest = await self.run_io(self.blobs.ingest, task_id, self.scheduler.task_path(task_id))
+            except FileNotFoundError:
+                await self._discard_task(task_id)
+                continue
+            except (zipfile.BadZipFile, ValueError) as e:
+                print(f"[MASTER] Invalid task package {task_id}: {e}")
+                if self.scheduler.fail(task_id, peer_id):
+                    await self._bury(task_id)
+                continue
+            tasks.append({"task_id": task_id, "manifest": manifest})
+        if not tasks:
+            return build_message("NO_TASKS", {})
+        return build_message("TASK_PACKAGE", {"tasks": tasks, "lease_timeout": LEASE_TIMEOUT})
+
+    def _open_blobs(self, hashes):
+        opened, missing = [], []
+        for sha in hashes:
+            if len(sha) != 64 or not all(c in "0123456789abcdef" for c in sha):
+                missing.append(sha)
+                continue
+            try:
+                opened.append((sha, open(self.blobs.path(sha), "rb")))
+            except FileNotFoundError:
+                missing.append(sha)
+        return opened, missing
+
+    async def on_fetch_blobs(self, data, attachment):
+        """Send the requested blobs back to back, like a TASK_PACKAGE batch."""
+        opened, missing = await self.run_io(self._open_blobs, data.get("hashes", []))
+        blobs = [{"hash": sha, "size": os.fstat(f.fileno()).st_size} for sha, f in opened]
+        message = build_message("BLOBS", {"blobs": blobs, "missing": missing})
+        if not opened:
+            return message
+        return FileReply(message, [f for _, f in opened])
+
+    async def _discard_task(self, task_id):
+        """Forget a task whose file is gone."""
+        self.scheduler.discard(task_id)
+        self.memo_keys.pop(task_id, None)
+        await self.run_io(self.blobs.release, task_id)
+
+    @property
+    def incoming_dir(self):
+        return os.path.join(self.results_dir, ".incoming")
+
+    async def spool_attachment(self, reader, length, codec=None, limit=None):
+        """Read a request attachment, streaming large ones to a file in incoming_dir.
+
+        Compressed attachments are always spooled (their real size is unknown
+        up front) and decompressed on the executor as they arrive, to at most
+        `limit` bytes. Nothing larger than SPOOL_MAX_SIZE is written.
+        """
+        limit = SPOOL_MAX_SIZE if limit is None else min(limit, SPOOL_MAX_SIZE)
+        if length > limit and codec is None:
+            raise ProtocolError(f"Attachment of {length} bytes exceeds {limit} bytes")
+        if length <= SPOOL_THRESHOLD and codec is None:
+            return await reader.readexactly(length)
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        path = os.path.join(self.incoming_dir, f"{uuid.uuid4().hex}.part")
+        f = await self.run_io(open, path, "xb")
+        spooled = SpooledAttachment(path, length)
+        write = f.write if codec is None else StreamDecompressor(codec, f.write, limit)
+        try:
+            with f:
+                remaining = length
+                while remaining:
+                    chunk = await reader.readexactly(min(remaining, SPOOL_CHUNK_SIZE))
+                    await self.run_io(write, chunk)
+                    remaining -= len(chunk)
+                spooled.size = f.tell()
+        except BaseException:
+            spooled.discard()
+            raise
+        return spooled
+
+    def _save_result(self, result_name, attachment):
+        os.makedirs(self.results_dir, exist_ok=True)
+        result_path = os.path.join(self.results_dir, os.path.basename(result_name))
+        if isinstance(attachment, SpooledAttachment):
+            os.replace(attachment.path, result_path)
+        else:
             with open(result_path, "wb") as f:
-                f.write(result_bytes)
-            print(f"[MASTER] Result saved: {result_path}")
-            
-            response = build_message("OK", {})
-            send_json(conn, response)
-
-    except Exception as e:
-        print(f"[MASTER] Error handling peer: {e}")
+                f.write(attachment)
+        return result_path
+
+    async def on_submit_result(self, data, attachment):
+        peer_id = data.get('peer_id')
+        task_id = data.get("task_id")
+        result_name = data.get("result_name")
+
+        print(f"[MASTER] SUBMIT_RESULT received from {peer_id}")
+
+        result_path = await self.run_io(self._save_result, result_name, attachment)
+        print(f"[MASTER] Result saved: {result_path}")
+        lease_age = self.scheduler.lease_age(task_id)
+        if self.scheduler.complete(task_id):
+            TASK_OUTCOMES.inc("completed")
+            if lease_age is not None:
+                LEASE_SECONDS.observe(lease_age)
+            memo_key = self.memo_keys.pop(task_id, None)
+            if memo_key is not None:
+                await self.run_io(self.result_cache.store, memo_key, result_path)
+            await self.run_io(self.scheduler.remove_files, task_id)
+            await self.run_io(self.blobs.release, task_id)
+            self.scheduler.retired.discard(task_id)
+        else:
+            print(f"[MASTER] Task {task_id} was already completed, keeping the result anyway")
+        return build_message("OK", {})
+
+    async def _bury(self, task_id):
+        self.memo_keys.pop(task_id, None)
+        await self.run_io(self.scheduler.bury, task_id)
+        await self.run_io(self.blobs.release, task_id)
+        self.scheduler.retired.discard(task_id)
+        TASK_OUTCOMES.inc("dead_letter")
+        print(f"[MASTER] Task {task_id} exhausted its attempts, moved to dead letter")
+
+    async def on_task_failed(self, data, attachment):
+        peer_id = data.get('peer_id')
+        task_id = data.get("task_id")
+        print(f"[MASTER] TASK_FAILED {task_id} from {peer_id}: {data.get('error')}")
+        lease_age = self.scheduler.lease_age(task_id)
+        if lease_age is not None and self.scheduler.tasks[task_id].peer_id == peer_id:
+            TASK_OUTCOMES.inc("failed")
+            LEASE_SECONDS.observe(lease_age)
+        if self.scheduler.fail(task_id, peer_id):
+            await self._bury(task_id)
+        return build_message("OK", {})
+
+    async def _scan_tasks(self):
+        """Queue new task files and forget the ones removed from TASKS_DIR."""
+        new, found = await self.run_io(self.scheduler.scan, set(self.scheduler.tasks))
+        for task_id in [t for t in self.scheduler.tasks if t not in found]:
+            await self._discard_task(task_id)
+        for task_id, priority in new:
+            await self._queue_task(task_id, priority)
+
+    async def _queue_task(self, task_id, priority):
+        """Queue a new task, or complete it straight from the result cache."""
+        if self.result_cache is None:
+            self.scheduler.add(task_id, priority)
+            return
+        if task_id in self.scheduler.tasks or task_id in self.scheduler.retired or task_id in self.memo_checking:
+            return
+        self.memo_checking.add(task_id)
         try:
+            options = await self.run_io(self.scheduler.read_sidecar, task_id)
+            if not options.get("deterministic"):
+                self.scheduler.add(task_id, priority)
+                return
+            try:
+                key = await self.run_io(ResultCache.key, self.scheduler.task_path(task_id), options.get("fingerprint"))
+            except zipfile.BadZipFile:
+                self.scheduler.add(task_id, priority)  # not memoizable; fails like any broken package
+                return
+            # Same name a peer would have submitted the result under
+            result_path = os.path.join(self.results_dir, f"results_{task_id}")
+            if await self.run_io(self.result_cache.fetch, key, result_path):
+                self.scheduler.retired.add(task_id)
+                try:
+                    await self.run_io(self.scheduler.remove_files, task_id)
+                finally:
+                    self.scheduler.retired.discard(task_id)
+                TASK_OUTCOMES.inc("memoized")
+                stats = self.result_cache.stats()
+                print(f"[MASTER] Task {task_id} completed from the result cache: {result_path} "
+                      f"(hits={stats['hits']}, misses={stats['misses']})")
+                return
+            self.memo_keys[task_id] = key
+            self.scheduler.add(task_id, priority)
+        except FileNotFoundError:
+            pass  # removed while we looked; the watcher reports the deletion
+        finally:
+            self.memo_checking.discard(task_id)
+
+    def _on_task_file(self, kind, name):
+        """Watcher callback (watcher thread): hand the event to the event loop."""
+        self.loop.call_soon_threadsafe(
+            lambda: asyncio.ensure_future(self._task_file_event(kind, name)))
+
+    async def _task_file_event(self, kind, name):
+        try:
+            if kind == "rescan":
+                await self._scan_tasks()
+            elif name.startswith(".") or name.endswith(".json"):
+                return
+            elif kind == "deleted":
+                await self._discard_task(name)
+            elif name not in self.scheduler.tasks:
+                path = self.scheduler.task_path(name)
+                if await self.run_io(os.path.isfile, path):
+                    await self._queue_task(name, await self.run_io(self.scheduler.read_priority, name))
+        except Exception as e:
+            print(f"[MASTER] Error handling task file {name}: {e}")
+
+    def _journal(self, *record):
+        if self.state is not None:
+            self.state.append(*record)
+
+    @staticmethod
+    def _peer_record(info):
+        return {key: info.get(key) for key in ("host", "port", "slots", "files_version", "token")}
+
+    async def _restore_state(self):
+        """Reload peers and file lists from the state store; they stay stale until the peer checks in."""
+        start = time.monotonic()
+        peers, saved_at = await self.run_io(self.state.load)
+        now = time.monotonic()
+        restored = 0
+        for peer_id, info in peers.items():
+            if not info.get("host") or not info.get("port"):
+                continue
+            record = self.peer_registry[peer_id] = self._peer_record(info)
+            record.update(last_seen=now, stale=True)
+            if record.get("token"):
+                self.heartbeat_tokens[bytes.fromhex(record["token"])] = peer_id
+            # Expires unless it is heard from before the grace period ends
+            self.wheel.schedule(peer_id, now + STALE_PEER_TIMEOUT)
+            for name, checksum in info.get("files", {}).items():
+                self.peer_files.add(peer_id, name, checksum)
+            restored += 1
+        if restored:
+            age = f", saved {time.time() - saved_at:.0f}s ago" if saved_at else ""
+            print(f"[MASTER] Restored {restored} peer(s) and {len(self.file_index)} file name(s) "
+                  f"in {time.monotonic() - start:.2f}s{age}")
+
+    async def _flush_state(self):
+        gen, records = self.state.take()
+        if records:
+            await self.run_io(self.state.write, gen, records)
+
+    async def _snapshot_state(self):
+        await self._flush_state()
+        gen = self.state.rotate()
+        peers = {}
+        for peer_id, info in self.peer_registry.items():
+            record = peers[peer_id] = self._peer_record(info)
+            record["files"] = dict(self.peer_files.files_of(peer_id) or {})
+        await self.run_io(self.state.save_snapshot, peers, gen)
+
+    async def _state_loop(self):
+        """Write journal batches and compact them into snapshots."""
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            try:
+                await self._flush_state()
+                now = time.monotonic()
+                if (now - last_snapshot >= STATE_SNAPSHOT_INTERVAL
+                        or self.state.journal_bytes >= STATE_JOURNAL_MAX_BYTES):
+                    last_snapshot = now
+                    await self._snapshot_state()
+            except Exception as e:
+                print(f"[MASTER] State store error: {e}")
+
+    async def _scheduler_loop(self):
+        """Pick up new tasks, expire peers and leases, persist the attempt counters and restart the hot file window."""
+        last_scan = last_window = time.monotonic()
+        while True:
+            await asyncio.sleep(SCHEDULER_TICK)
+            try:
+                if time.monotonic() - last_window >= FILE_CACHE_WINDOW:
+                    last_window = time.monotonic()
+                    self.file_requests.clear()
+                if time.monotonic() - last_scan >= TASK_SCAN_INTERVAL:
+                    last_scan = time.monotonic()
+                    await self._scan_tasks()
+                    if self.result_cache is not None:
+                        await self.run_io(self.result_cache.evict)
+                await self._expire_peers()
+                for task_id in self.scheduler.expire():
+                    await self._bury(task_id)
+                if self.scheduler.dirty:
+                    await self.run_io(self.scheduler.save, self.scheduler.snapshot())
+            except Exception as e:
+                print(f"[MASTER] Scheduler error: {e}")
+
+    async def handle_message(self, msg_type, data, attachment=b""):
+        """Handle one request and return the response message."""
+        handler = self.handlers.get(msg_type)
+        if handler is None:
+            return build_message("ERROR", {"error": f"Unknown message type: {msg_type}"})
+        return await handler(data or {}, attachment)
+
+    async def _send_file_reply(self, reply, writer, write_lock, codec=None):
+        """Send a FileReply; returns the bytes written."""
+        ok = False
+        packed = None
+        try:
+            if codec is not None:
+                # Compressed on the executor, before taking the connection's write lock
+                packed = await self.run_io(compress_files, reply.files, codec, reply.ranges)
+            async with write_lock:
+                if packed is not None:
+                    sent = await write_file_message(writer, reply.message, [packed[0]], codec, attachment_codec=codec)
+                else:
+                    sent = await write_file_message(writer, reply.message, reply.files, codec, ranges=reply.ranges)
+            ok = True
+            return sent
+        finally:
+            for f in reply.files:
+                f.close()
+            if packed is not None:
+                packed[0].close()
+            if reply.on_sent is not None:
+                reply.on_sent(ok)
+
+    async def _write_response(self, response, writer, write_lock, codec=None):
+        """Send a response message; returns the bytes written."""
+        if codec is None:
+            frame = encode_frame(response)
+        else:
+            frame = await self.run_io(encode_frame, response, 0, codec)
+        async with write_lock:
+            writer.write(frame)
+            await writer.drain()
+        return len(frame)
+
+    async def _serve_request(self, msg, attachment, writer, write_lock, slots, codec=None, peer="-"):
+        start = time.perf_counter()
+        msg_type, data = parse_message(msg)
+        label = msg_type if msg_type in self.handlers else "unknown"  # bounded label values
+        try:
+            response = await self.handle_message(msg_type, data, attachment)
+        except Exception as e:
+            print(f"[MASTER] Error handling {msg_type}: {e}")
             response = build_message("ERROR", {"error": str(e)})
-            send_json(conn, response)
-        except:
+        finally:
+            slots.release()
+            if isinstance(attachment, SpooledAttachment):
+                await self.run_io(attachment.discard)  # no-op if the handler kept it
+        failed = isinstance(response, dict) and response.get("type") == "ERROR"
+        try:
+            if isinstance(response, FileReply):
+                response.message["id"] = message_id(msg)
+                sent = await self._send_file_reply(response, writer, write_lock, codec)
+            else:
+                response["id"] = message_id(msg)
+                sent = await self._write_response(response, writer, write_lock, codec)
+            BYTES_SENT.inc(peer, value=sent)
+        except (ConnectionError, RuntimeError, OSError) as e:
+            print(f"[MASTER] Failed to send {msg_type} response: {e}")
+            failed = True
+        REQUESTS.inc(label)
+        if failed:
+            REQUEST_ERRORS.inc(label)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, label)
+
+    async def handle_peer(self, reader, writer):
+        """Serve one persistent session until the peer disconnects."""
+        if self.active_connections >= self.max_connections:
+            writer.close()
+            return
+        self.active_connections += 1
+        write_lock = asyncio.Lock()
+        slots = asyncio.Semaphore(self.max_inflight)
+        pending = set()
+        codec = None  # compression agreed on with HELLO
+        peername = writer.get_extra_info("peername")
+        peer = peername[0] if peername else "-"  # metrics label until a message names the peer
+        received = []
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    msg, attachment = await read_message(reader, spool=self.spool_attachment, offload=self.run_io,
+                                                         on_frame=received.append)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                data = msg.get("data")
+                if isinstance(data, dict) and data.get("peer_id") is not None:
+                    peer = str(data["peer_id"])
+                BYTES_RECEIVED.inc(peer, value=received.pop())
+                if msg.get("type") == "HELLO":
+                    # Answered inline: the peer waits for it before sending anything else
+                    slots.release()
+                    codec = negotiate((data or {}).get("compression"))
+                    sent = await self._write_response(
+                        build_message("HELLO", {"compression": codec}, message_id(msg)), writer, write_lock)
+                    BYTES_SENT.inc(peer, value=sent)
+                    REQUESTS.inc("HELLO")
+                    continue
+                task = asyncio.ensure_future(
+                    self._serve_request(msg, attachment, writer, write_lock, slots, codec, peer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except Exception as e:
+            print(f"[MASTER] Error handling peer: {e}")
+        finally:
+            self.active_connections -= 1
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            writer.close()
+
+    async def handle_metrics_http(self, reader, writer):
+        """Answer one GET /metrics. Served on the event loop, since the gauges read loop-only state."""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            method, _, rest = request.partition(b" ")
+            if method == b"GET":
+                status, content_type, body = metrics.http_response(rest.split(b" ", 1)[0].decode("latin-1"))
+            else:
+                status, content_type, body = 405, "text/plain", b"Method not allowed\n"
+            writer.write((f"HTTP/1.0 {status} {http.HTTPStatus(status).phrase}\r\n"
+                          f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                          f"Connection: close\r\n\r\n").encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
             pass
-    finally:
-        conn.close()
-
-def run_tcp():
-    """Run TCP server for peer connections."""
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse
-    server.bind(("0.0.0.0", EDGE_NODE_PORT))
-    server.listen(5)
-    print(f"[MASTER] Active on TCP port {EDGE_NODE_PORT}...")
-    
-    while True:
-        conn, addr = server.accept()
-        threading.Thread(target=handle_peer, args=(conn,), daemon=True).start()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Run the TCP server and UDP discovery until cancelled."""
+        # Ensure required directories exist
+        os.makedirs(self.tasks_dir, exist_ok=True)
+        os.makedirs(self.results_dir, exist_ok=True)
+
+        self.loop = asyncio.get_running_loop()
+        state_task = None
+        if self.state is not None:
+            await self._restore_state()
+            state_task = asyncio.ensure_future(self._state_loop())
+        if WATCH_TASKS_DIR:
+            # Started before the first scan so nothing written in between is missed
+            self.watcher = DirectoryWatcher(self.tasks_dir, self._on_task_file, WATCH_POLL_INTERVAL).start()
+            print(f"[MASTER] Watching {self.tasks_dir} for new tasks ({self.watcher.backend})")
+        await self.run_io(self.scheduler.load)
+        await self.run_io(self.blobs.clear)
+        if self.result_cache is not None:
+            await self.run_io(self.result_cache.load)
+        if self.file_cache is not None:
+            await self.run_io(self.file_cache.load)
+            stats = self.file_cache.stats()
+            print(f"[MASTER] Hot file cache: {stats['entries']} file(s), {stats['bytes']} bytes "
+                  f"in {self.file_cache.cache_dir}")
+        await self._scan_tasks()
+        print(f"[MASTER] {len(self.scheduler)} task(s) queued")
+        scheduler_task = asyncio.ensure_future(self._scheduler_loop())
+
+        loop = asyncio.get_running_loop()
+        if self.discovery_port is not None:
+            self.announce_ip = await self.run_io(socket.gethostbyname, socket.gethostname())
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self),
+                local_addr=("0.0.0.0", self.discovery_port)
+            )
+            self.discovery_port = transport.get_extra_info("sockname")[1]
+            print(f"[MASTER] UDP listener active on port {self.discovery_port} for DISCOVER_MASTER and heartbeats")
+
+        metrics_server = None
+        if self.metrics_port is not None:
+            metrics_server = await asyncio.start_server(self.handle_metrics_http, METRICS_HOST, self.metrics_port,
+                                                        reuse_address=True)
+            self.metrics_port = metrics_server.sockets[0].getsockname()[1]
+            print(f"[MASTER] Metrics on http://{METRICS_HOST}:{self.metrics_port}/metrics")
+
+        server = await asyncio.start_server(
+            self.handle_peer, self.host, self.port, backlog=self.backlog, reuse_address=True
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self.edge_id = f"{self.advertise_host}:{self.port}"
+        print(f"[MASTER] Active on TCP port {self.port}...")
+        if self.federation is not None:
+            self.federation.start(self.edge_id)
+            print(f"[MASTER] Joining the edge ring as {self.edge_id} "
+                  f"(seeds: {', '.join(self.federation.seeds) or 'none'})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            scheduler_task.cancel()
+            if state_task is not None:
+                state_task.cancel()
+                try:
+                    await self._snapshot_state()  # restart from one compact file
+                except Exception as e:
+                    print(f"[MASTER] Could not save the final snapshot: {e}")
+            if self.federation is not None:
+                try:
+                    await self.federation.close()
+                except Exception as e:
+                    print(f"[MASTER] Error leaving the ring: {e}")
+            if metrics_server is not None:
+                metrics_server.close()
+            if self.watcher is not None:
+                self.watcher.stop()
+
 
 def run_edge():
     """Initialize and run the master node."""
-    # Ensure required directories exist
-    os.makedirs(TASKS_DIR, exist_ok=True)
-    os.makedirs(RESULTS_DIR, exist_ok=True)
-    
-    # Start UDP discovery service
-    udp_thread = threading.Thread(target=run_discovery, daemon=True)
-    udp_thread.start()
-    
-    # Run main TCP server
-    run_tcp()
+    try:
+        asyncio.run(EdgeNode().serve())
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     run_edge()
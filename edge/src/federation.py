@@ -0,0 +1,424 @@
+import asyncio
+import itertools
+import time
+from connection import read_message, write_message
+from file_index import FileIndex
+from hash_ring import HashRing, name_key, checksum_key, split_address
+from protocol import build_message, parse_message, message_id
+from config import EDGE_SYNC_INTERVAL, EDGE_TIMEOUT, EDGE_REQUEST_TIMEOUT, INDEX_BATCH
+
+
+class EdgeLink:
+    """Persistent session from this edge to another one, shared by concurrent requests.
+
+    The asyncio counterpart of the peers' EdgeSession: requests carry
+    correlation IDs and a reader task hands each response to its caller.
+    The connection is opened on first use and again after it drops.
+    """
+
+    def __init__(self, member):
+        self.member = member
+        self.host, self.port = split_address(member)
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._connect_lock = asyncio.Lock()
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), EDGE_REQUEST_TIMEOUT)
+                self._read_task = asyncio.ensure_future(self._read_loop(self._reader, self._writer))
+
+    async def _read_loop(self, reader, writer):
+        error = ConnectionError(f"Link to {self.member} closed")
+        try:
+            while True:
+                msg, _ = await read_message(reader)
+                future = self._pending.pop(message_id(msg), None)
+                if future is not None and not future.done():
+                    future.set_result(msg)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError) as e:
+            error = ConnectionError(f"Link to {self.member} lost: {e}")
+        finally:
+            self._drop(writer, error)
+
+    def _drop(self, writer, error):
+        if self._writer is not writer:
+            return
+        self._reader = self._writer = None
+        writer.close()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, msg_type, data, timeout=EDGE_REQUEST_TIMEOUT):
+        """Send a request and wait for its response. Returns (type, data)."""
+        await self._ensure_connected()
+        writer = self._writer
+        msg_id = next(self._ids)
+        future = self._pending[msg_id] = asyncio.get_running_loop().create_future()
+        try:
+            await write_message(writer, build_message(msg_type, data, msg_id))
+            return parse_message(await asyncio.wait_for(future, timeout))
+        except (ConnectionError, OSError) as e:
+            self._drop(writer, e)
+            raise ConnectionError(f"{msg_type} to {self.member} failed: {e}")
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def close(self):
+        if self._writer is not None:
+            self._drop(self._writer, ConnectionError(f"Link to {self.member} closed"))
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+
+class HomeFiles:
+    """File lists of the peers whose sessions this edge holds, routed to the shards owning each entry.
+
+    Offers the update methods of FileIndex, so the edge applies REGISTER and
+    HEARTBEAT file lists the same way with or without a federation. Every
+    entry is indexed on the owner of its name (FIND_FILE by name, SEARCH) and,
+    when that is another edge, also on the owner of its checksum.
+    """
+
+    def __init__(self, federation):
+        self.federation = federation
+        self.peer_files = {}  # peer_id -> {filename: checksum}
+
+    def _route(self, op, peer_id, name, checksum):
+        owner = self.federation.owner(name_key(name))
+        self.federation.send(owner, peer_id, [op, "n", peer_id, name] + ([checksum] if op == "add" else []))
+        by_checksum = self.federation.owner(checksum_key(checksum))
+        if by_checksum != owner:
+            self.federation.send(by_checksum, peer_id, [op, "c", peer_id, name] + ([checksum] if op == "add" else []))
+
+    def add(self, peer_id, name, checksum):
+        files = self.peer_files.setdefault(peer_id, {})
+        old = files.get(name)
+        if old == checksum:
+            return
+        if old is not None:
+            self._route("del", peer_id, name, old)
+        files[name] = checksum
+        self._route("add", peer_id, name, checksum)
+
+    def remove(self, peer_id, name):
+        files = self.peer_files.get(peer_id)
+        if not files or name not in files:
+            return
+        checksum = files.pop(name)
+        if not files:
+            del self.peer_files[peer_id]
+        self._route("del", peer_id, name, checksum)
+
+    def set_peer_files(self, peer_id, files):
+        new = {f["name"]: f["checksum"] for f in files}
+        old = self.peer_files.get(peer_id, {})
+        for name in [n for n in old if n not in new]:
+            self.remove(peer_id, name)
+        for name, checksum in new.items():
+            self.add(peer_id, name, checksum)
+
+    def remove_peer(self, peer_id):
+        for name in list(self.peer_files.get(peer_id, ())):
+            self.remove(peer_id, name)
+        # Every shard may hold its address, even with no entries left
+        for member in self.federation.ring.members:
+            self.federation.send(member, peer_id, ["forget", peer_id])
+
+    def files_of(self, peer_id):
+        return self.peer_files.get(peer_id)
+
+    def slices(self):
+        """Every entry routed under the current ring: {member: [add ops]}."""
+        out = {member: [] for member in self.federation.ring.members}
+        owner = self.federation.owner
+        for peer_id, files in self.peer_files.items():
+            for name, checksum in files.items():
+                by_name = owner(name_key(name))
+                out[by_name].append(["add", "n", peer_id, name, checksum])
+                by_checksum = owner(checksum_key(checksum))
+                if by_checksum != by_name:
+                    out[by_checksum].append(["add", "c", peer_id, name, checksum])
+        return out
+
+
+class Federation:
+    """Membership of the edge ring and this edge's shard of the file index.
+
+    Edges find each other through EDGE_SEEDS and exchange their member lists
+    with EDGE_SYNC every EDGE_SYNC_INTERVAL seconds; an edge not heard from
+    for EDGE_TIMEOUT seconds (or that sent EDGE_LEAVE) is dropped. Whenever
+    the membership changes, every edge re-sends the file lists of its own
+    peers under the new ring (a "reset" followed by the entries), so each
+    shard ends up with exactly the keys it owns.
+
+    The shard keeps `index` (entries whose name it owns) and
+    `checksum_index` (entries whose checksum it owns but whose name another
+    edge owns), plus the address and home edge of every peer in them.
+    Everything runs on the edge's event loop.
+    """
+
+    def __init__(self, node, seeds=()):
+        self.node = node
+        self.seeds = list(seeds)
+        self.seed_ids = {}  # seed address -> edge ID it answered with
+        self.edge_id = None
+        self.ring = HashRing()
+        self.index = node.file_index
+        self.checksum_index = FileIndex(searchable=False)
+        self.home = HomeFiles(self)
+        self.peers = {}  # peer_id -> {"host", "port", "edge"} for every peer with entries here
+        self.origin_peers = {}  # edge ID -> peer IDs it sent entries for
+        self.last_heard = {}  # member -> monotonic time of its last EDGE_SYNC (either direction)
+        self.departed = {}  # member -> monotonic time it was dropped; gossip about it is ignored meanwhile
+        self.links = {}
+        self.queues = {}  # member -> ordered INDEX_UPDATEs waiting to be sent
+        self.senders = {}
+        self.outbox = {}  # member -> (peer IDs, ops) gathered during this loop iteration
+        self.flush_handle = None
+        self.dirty = set()  # members to re-send every entry to (after a failed send)
+        self.task = None
+
+    # Ring
+
+    def start(self, edge_id):
+        self.edge_id = edge_id
+        self.ring.add(edge_id)
+        self.rebalance()  # peers restored from the state store
+        self.task = asyncio.ensure_future(self._run())
+
+    def owner(self, key):
+        return self.ring.owner(key)
+
+    def is_local(self, key):
+        return self.ring.owner(key) == self.edge_id
+
+    def ring_info(self):
+        info = self.ring.to_dict()
+        info["edge_id"] = self.edge_id
+        return info
+
+    def heard(self, member, members=()):
+        """`member` talked to us and knows `members`: add whoever is new."""
+        now = time.monotonic()
+        changed = False
+        if member != self.edge_id:
+            self.departed.pop(member, None)
+            self.last_heard[member] = now
+            if member not in self.ring:
+                self.ring.add(member)
+                changed = True
+        for other in members:
+            if other in self.ring or other == self.edge_id:
+                continue
+            if now - self.departed.get(other, -EDGE_TIMEOUT) < EDGE_TIMEOUT:
+                continue  # we dropped it recently; others may not have noticed yet
+            self.ring.add(other)
+            self.last_heard[other] = now
+            changed = True
+        if changed:
+            self._changed()
+
+    def leave(self, member):
+        if member in self.ring and member != self.edge_id:
+            self.ring.remove(member)
+            self._forget(member)
+            self._changed()
+
+    def _forget(self, member):
+        self.departed[member] = time.monotonic()
+        self.last_heard.pop(member, None)
+        self.outbox.pop(member, None)
+        self.dirty.discard(member)
+        link = self.links.pop(member, None)
+        if link is not None:
+            link.close()
+        sender = self.senders.pop(member, None)
+        if sender is not None:
+            sender.cancel()
+        self.queues.pop(member, None)
+        # Its peers lost their sessions with it; they show up again through another edge
+        self.drop_origin(member)
+
+    def _expire(self):
+        now = time.monotonic()
+        gone = [m for m, t in self.last_heard.items() if now - t > EDGE_TIMEOUT]
+        for member in gone:
+            print(f"[MASTER] Edge {member} timed out, leaving the ring")
+            self.ring.remove(member)
+            self._forget(member)
+        if gone:
+            self._changed()
+
+    def _changed(self):
+        print(f"[MASTER] Ring {self.ring.version}: {', '.join(sorted(self.ring.members))}")
+        self.rebalance()
+
+    async def _sync(self, target):
+        try:
+            msg_type, data = await self.link(target).request("EDGE_SYNC", self.ring_info(), timeout=EDGE_SYNC_INTERVAL)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            return
+        member = data.get("edge_id") if msg_type == "EDGE_SYNC" else None
+        if not member:
+            return
+        if target != member:
+            self.seed_ids[target] = member  # a seed listed under another address
+            self.links.pop(target).close()
+        self.heard(member, data.get("members", ()))
+
+    async def _run(self):
+        while True:
+            seeds = {s for s in self.seeds if self.seed_ids.get(s, s) not in self.ring}
+            targets = (seeds | self.ring.members) - {self.edge_id}
+            await asyncio.gather(*(self._sync(target) for target in targets))
+            self._expire()
+            for member in list(self.dirty):
+                self.resync(member)
+            await asyncio.sleep(EDGE_SYNC_INTERVAL)
+
+    async def close(self):
+        """Tell the other edges we are leaving, so they rebalance without waiting for EDGE_TIMEOUT."""
+        if self.task is not None:
+            self.task.cancel()
+        others = self.ring.members - {self.edge_id}
+        await asyncio.gather(*(self.link(m).request("EDGE_LEAVE", {"edge_id": self.edge_id}, timeout=2)
+                               for m in others), return_exceptions=True)
+        for link in self.links.values():
+            link.close()
+
+    def link(self, member):
+        link = self.links.get(member)
+        if link is None:
+            link = self.links[member] = EdgeLink(member)
+        return link
+
+    async def forward(self, member, msg_type, data):
+        """Ask another edge; returns its response as a message."""
+        try:
+            resp_type, resp_data = await self.link(member).request(msg_type, dict(data, forwarded=True))
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            return build_message("ERROR", {"error": f"Edge {member} unavailable: {e}"})
+        return build_message(resp_type, resp_data)
+
+    # Index updates
+
+    def send(self, member, peer_id, op):
+        """Queue an index operation for `member`; sent with the others of this loop iteration."""
+        if member is None:
+            return  # not started yet: start() routes everything once the ring exists
+        peer_ids, ops = self.outbox.setdefault(member, (set(), []))
+        peer_ids.add(peer_id)
+        ops.append(op)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def _addresses(self, peer_ids):
+        registry = self.node.peer_registry
+        return {p: [registry[p]["host"], registry[p]["port"]] for p in peer_ids if p in registry}
+
+    def flush(self):
+        self.flush_handle = None
+        outbox, self.outbox = self.outbox, {}
+        for member, (peer_ids, ops) in outbox.items():
+            self._deliver(member, peer_ids, ops)
+
+    def _deliver(self, member, peer_ids, ops):
+        if member == self.edge_id:
+            self.apply(self.edge_id, self._addresses(peer_ids), ops)
+            return
+        if member not in self.ring:
+            return
+        for i in range(0, max(1, len(ops)), INDEX_BATCH):
+            batch = ops[i:i + INDEX_BATCH]
+            ids = {op[2] for op in batch if len(op) > 2}
+            self._queue(member).put_nowait({"origin": self.edge_id, "peers": self._addresses(ids), "ops": batch})
+
+    def _queue(self, member):
+        queue = self.queues.get(member)
+        if queue is None:
+            queue = self.queues[member] = asyncio.Queue()
+            self.senders[member] = asyncio.ensure_future(self._send_loop(member, queue))
+        return queue
+
+    async def _send_loop(self, member, queue):
+        """Send INDEX_UPDATEs to `member` one at a time, in order."""
+        while True:
+            update = await queue.get()
+            try:
+                msg_type, data = await self.link(member).request("INDEX_UPDATE", update)
+                if msg_type != "OK":
+                    raise ConnectionError(data.get("error", msg_type))
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                print(f"[MASTER] Index update to {member} failed ({e}), resyncing it")
+                while not queue.empty():
+                    queue.get_nowait()
+                self.dirty.add(member)
+
+    def _reset(self, member, ops):
+        """Replace everything `member` holds from our peers with `ops` (queued deltas are superseded)."""
+        self.dirty.discard(member)
+        self.outbox.pop(member, None)
+        queue = self.queues.get(member)
+        while queue is not None and not queue.empty():
+            queue.get_nowait()
+        self._deliver(member, {op[2] for op in ops}, [["reset"]] + ops)
+
+    def resync(self, member):
+        self._reset(member, self.home.slices().get(member, []))
+
+    def rebalance(self):
+        """Re-send our peers' entries under the current ring to every member (ourselves included)."""
+        if self.edge_id is None:
+            return
+        self.outbox.clear()
+        slices = self.home.slices()
+        for member in self.ring.members:
+            self._reset(member, slices[member])
+
+    def apply(self, origin, peers, ops):
+        """Apply an INDEX_UPDATE from `origin` (or from ourselves) to this shard."""
+        if ops and ops[0][0] == "reset":
+            self.drop_origin(origin)
+            ops = ops[1:]
+        known = self.origin_peers.setdefault(origin, set())
+        for peer_id, (host, port) in peers.items():
+            self.peers[peer_id] = {"host": host, "port": port, "edge": origin}
+            known.add(peer_id)
+        for op in ops:
+            if op[0] == "forget":
+                self._drop_peer(origin, op[1])
+                continue
+            index = self.index if op[1] == "n" else self.checksum_index
+            if op[0] == "add":
+                index.add(op[2], op[3], op[4])
+            else:
+                index.remove(op[2], op[3])
+
+    def _drop_peer(self, origin, peer_id):
+        """`origin` no longer holds a session with `peer_id`."""
+        self.origin_peers.get(origin, set()).discard(peer_id)
+        info = self.peers.get(peer_id)
+        if info is None or info["edge"] != origin:
+            return  # moved to another edge since, which now sends its entries
+        del self.peers[peer_id]
+        self.index.remove_peer(peer_id)
+        self.checksum_index.remove_peer(peer_id)
+
+    def drop_origin(self, origin):
+        for peer_id in self.origin_peers.pop(origin, ()):
+            self._drop_peer(origin, peer_id)
+
+    # Queries
+
+    def find_checksum(self, checksum):
+        holders = dict(self.index.find_checksum(checksum))
+        holders.update(self.checksum_index.find_checksum(checksum))
+        return holders
@@ -0,0 +1,146 @@
+import os
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class _Fill:
+    """A cache entry being downloaded: a hidden temporary file hashed as it is written."""
+
+    def __init__(self, checksum, path):
+        self.checksum = checksum
+        self.path = path
+        self.file = open(path, "xb")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class FileCache:
+    """Copies of hot shared files, so the edge can serve them like a peer.
+
+    Entries are files in `cache_dir` named by their SHA-256 checksum. A file
+    is written through fill() and becomes an entry only if commit() finds
+    the data matches the checksum. Entries are evicted least recently served
+    first once the cache holds more than `max_bytes`; a file being sent when
+    it is evicted is still sent in full. cached() only reads the index and
+    is safe on the event loop; the other methods block (run them on an
+    executor).
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # checksum -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.mismatches = 0
+
+    def path(self, checksum):
+        return os.path.join(self.cache_dir, checksum)
+
+    def load(self):
+        """Index the entries left by a previous run, least recently used first."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    os.remove(entry.path)  # interrupted fill
+                elif entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        with self._lock:
+            for _, checksum, size in sorted(found):
+                self._entries[checksum] = size
+                self._bytes += size
+        self.evict()
+
+    def cached(self, checksum):
+        with self._lock:
+            return checksum in self._entries
+
+    def open(self, checksum):
+        """Open a cached file for sending and mark it recently used; None if it is not cached."""
+        with self._lock:
+            if checksum not in self._entries:
+                return None
+            self._entries.move_to_end(checksum)
+            self.hits += 1
+        path = self.path(checksum)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            with self._lock:
+                if checksum in self._entries:
+                    self._drop(checksum)
+            return None
+        os.utime(path)  # keeps the LRU order across restarts
+        return f
+
+    def fill(self, checksum):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return _Fill(checksum, os.path.join(self.cache_dir, f".{checksum}.{uuid.uuid4().hex}"))
+
+    def commit(self, fill):
+        """Turn a finished fill into an entry. False (and the data is dropped) on a checksum mismatch."""
+        fill.file.close()
+        if fill.sha256.hexdigest() != fill.checksum:
+            fill.discard()
+            with self._lock:
+                self.mismatches += 1
+            return False
+        os.replace(fill.path, self.path(fill.checksum))
+        with self._lock:
+            if fill.checksum in self._entries:
+                self._drop(fill.checksum)
+            self._entries[fill.checksum] = fill.size
+            self._bytes += fill.size
+            self.stores += 1
+        self.evict()
+        return True
+
+    def _drop(self, checksum):
+        self._bytes -= self._entries.pop(checksum)
+
+    def evict(self):
+        """Drop the least recently used entries until under max_bytes."""
+        victims = []
+        with self._lock:
+            for checksum in list(self._entries):
+                if self._bytes <= self.max_bytes:
+                    break
+                self._drop(checksum)
+                victims.append(checksum)
+            self.evictions += len(victims)
+        for checksum in victims:
+            try:
+                os.remove(self.path(checksum))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "mismatches": self.mismatches,
+            }
@@ -0,0 +1,158 @@
+import heapq
+
+# Marks the start of a name so prefix queries become anchored substring queries.
+_START = "\x00"
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _name_grams(folded):
+    anchored = _START + folded
+    return _trigrams(anchored) | {anchored[:2]}
+
+
+class FileIndex:
+    """In-memory index of shared files, updated incrementally from peer file lists.
+
+    - by_name: filename -> {peer_id: checksum}
+    - by_checksum: checksum -> {peer_id: filename}
+    - peer_files: peer_id -> {filename: checksum}
+
+    Search is case-insensitive and backed by a trigram index over the names,
+    anchored at the start so prefix queries use the same posting sets as
+    substring queries. Only substring queries shorter than three characters
+    fall back to a scan. With searchable=False the trigram index is not kept
+    (lookups by name and checksum only).
+    """
+
+    def __init__(self, searchable=True):
+        self.searchable = searchable
+        self.by_name = {}
+        self.by_checksum = {}
+        self.peer_files = {}
+        self._folded = {}  # folded name -> set of original names
+        self._grams = {}  # trigram -> set of folded names
+
+    def __len__(self):
+        return len(self.by_name)
+
+    # Updates
+
+    def add(self, peer_id, name, checksum):
+        holders = self.by_name.get(name)
+        if holders is None:
+            holders = self.by_name[name] = {}
+            if self.searchable:
+                self._add_name(name)
+        old = holders.get(peer_id)
+        if old is not None and old != checksum:
+            self._unlink_checksum(peer_id, old)
+        holders[peer_id] = checksum
+        self.by_checksum.setdefault(checksum, {})[peer_id] = name
+        self.peer_files.setdefault(peer_id, {})[name] = checksum
+
+    def remove(self, peer_id, name):
+        files = self.peer_files.get(peer_id)
+        if not files or name not in files:
+            return
+        checksum = files.pop(name)
+        if not files:
+            del self.peer_files[peer_id]
+        holders = self.by_name[name]
+        del holders[peer_id]
+        if not holders:
+            del self.by_name[name]
+            if self.searchable:
+                self._remove_name(name)
+        self._unlink_checksum(peer_id, checksum)
+
+    def set_peer_files(self, peer_id, files):
+        """Replace a peer's file list, applying only the differences."""
+        new = {f["name"]: f["checksum"] for f in files}
+        old = self.peer_files.get(peer_id, {})
+        for name in [n for n in old if n not in new]:
+            self.remove(peer_id, name)
+        for name, checksum in new.items():
+            if old.get(name) != checksum:
+                self.add(peer_id, name, checksum)
+
+    def remove_peer(self, peer_id):
+        for name in list(self.peer_files.get(peer_id, ())):
+            self.remove(peer_id, name)
+
+    def _unlink_checksum(self, peer_id, checksum):
+        holders = self.by_checksum.get(checksum)
+        if holders is not None:
+            holders.pop(peer_id, None)
+            if not holders:
+                del self.by_checksum[checksum]
+
+    def _add_name(self, name):
+        folded = name.casefold()
+        names = self._folded.get(folded)
+        if names is None:
+            names = self._folded[folded] = set()
+            for gram in _name_grams(folded):
+                self._grams.setdefault(gram, set()).add(folded)
+        names.add(name)
+
+    def _remove_name(self, name):
+        folded = name.casefold()
+        names = self._folded[folded]
+        names.discard(name)
+        if names:
+            return
+        del self._folded[folded]
+        for gram in _name_grams(folded):
+            posting = self._grams[gram]
+            posting.discard(folded)
+            if not posting:
+                del self._grams[gram]
+
+    # Queries
+
+    def find(self, name):
+        return self.by_name.get(name, {})
+
+    def find_checksum(self, checksum):
+        return self.by_checksum.get(checksum, {})
+
+    def files_of(self, peer_id):
+        return self.peer_files.get(peer_id)
+
+    def _match(self, query, offset, limit):
+        grams = _trigrams(query) or ({query} if query.startswith(_START) else None)
+        if grams is None:
+            matches = [n for n in self._folded if query in n]
+        else:
+            postings = sorted((self._grams.get(g, ()) for g in grams), key=len)
+            if not postings[0]:
+                return [], 0
+            matches = postings[0]
+            if len(postings) > 1:
+                # Narrow with the rarer trigrams until the candidate set is
+                # small, then confirm the real substring: trigrams alone can
+                # match out of order.
+                for posting in postings[1:]:
+                    if len(matches) <= 64:
+                        break
+                    matches = matches & posting
+                if query.startswith(_START):
+                    prefix = query[1:]
+                    matches = [n for n in matches if n.startswith(prefix)]
+                else:
+                    matches = [n for n in matches if query in n]
+        return heapq.nsmallest(offset + limit, matches)[offset:], len(matches)
+
+    def search(self, query, mode="substring", offset=0, limit=50):
+        """Return (page, total) where page is a list of (name, holders) pairs."""
+        query = query.casefold()
+        if not query:
+            return [], 0
+        if mode == "prefix":
+            query = _START + query
+        folded, total = self._match(query, offset, limit)
+        page = [(name, len(self.by_name[name])) for f in folded for name in sorted(self._folded[f])]
+        return page, total
@@ -0,0 +1,86 @@
+import bisect
+import hashlib
+
+# Points per member on the ring: more points, more even shares
+RING_VNODES = 64
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+def name_key(filename):
+    """Ring key of a file name: FIND_FILE by name and SEARCH results live on its owner."""
+    return "name:" + filename
+
+
+def checksum_key(checksum):
+    """Ring key of a checksum: FIND_FILE by checksum is answered by its owner."""
+    return "checksum:" + checksum
+
+
+def peer_key(peer_id):
+    """Ring key of a peer: the edge that should hold its session."""
+    return "peer:" + str(peer_id)
+
+
+class HashRing:
+    """Consistent hashing over edge IDs ("host:port").
+
+    Every member owns RING_VNODES points on a 64-bit ring; a key belongs to
+    the first point at or after its hash. Adding or removing a member only
+    moves the keys next to that member's points.
+    """
+
+    def __init__(self, members=(), vnodes=RING_VNODES):
+        self.vnodes = vnodes
+        self.members = set(members)
+        self._points = []
+        self._owners = []
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((ring_hash(f"{member}#{i}"), member) for member in self.members for i in range(self.vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        return member in self.members
+
+    def add(self, member):
+        if member not in self.members:
+            self.members.add(member)
+            self._rebuild()
+
+    def remove(self, member):
+        if member in self.members:
+            self.members.discard(member)
+            self._rebuild()
+
+    def owner(self, key):
+        """Member owning `key`, or None on an empty ring."""
+        if not self._points:
+            return None
+        i = bisect.bisect_left(self._points, ring_hash(key))
+        return self._owners[i % len(self._owners)]
+
+    @property
+    def version(self):
+        """Short digest of the membership: equal versions route every key the same way."""
+        return hashlib.sha1(f"{self.vnodes}|{','.join(sorted(self.members))}".encode()).hexdigest()[:12]
+
+    def to_dict(self):
+        return {"members": sorted(self.members), "vnodes": self.vnodes, "version": self.version}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("members", ()), data.get("vnodes", RING_VNODES))
+
+
+def split_address(member):
+    """("host", port) of an edge ID."""
+    host, _, port = member.rpartition(":")
+    return host, int(port)
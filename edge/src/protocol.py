@@ -1,5 +1,49 @@
-def build_message(msg_type, data):
-    return {"type": msg_type, "data": data}
+import struct
+
+def build_message(msg_type, data, msg_id=None):
+    msg = {"type": msg_type, "data": data}
+    if msg_id is not None:
+        msg["id"] = msg_id
+    return msg
 
 def parse_message(msg):
-    return msg.get("type"), msg.get("data")
\ No newline at end of file
+    return msg.get("type"), msg.get("data")
+
+def message_id(msg):
+    """Correlation ID of a request/response pair on a shared session."""
+    return msg.get("id")
+
+# Compact UDP heartbeat (sent to the edge's discovery port):
+# magic, token from REGISTERED, sequence number, file list version, free task
+# slots (-1 unknown), upload load of the file server (slots, active and
+# queued uploads, recent send rate in KiB/s; all 0 without a file server),
+# then the IDs of the running tasks, "\n"-separated.
+HEARTBEAT_MAGIC = b"H2"
+HEARTBEAT_PACKET = struct.Struct("!2s8sQIhHHHI")
+# Edge -> peer when a heartbeat cannot be applied: magic and a reason.
+HEARTBEAT_NAK_MAGIC = b"HN"
+NAK_REGISTER = b"R"  # unknown token: REGISTER again
+NAK_RESYNC = b"S"  # file list version differs: send a TCP HEARTBEAT
+
+def _clamp(value, high, low=0):
+    return max(low, min(high, int(value)))
+
+def pack_heartbeat(token, seq, files_version=0, free_slots=-1, tasks=(), load=None):
+    """`load` is the "load" dict of a TCP HEARTBEAT ({"slots", "active", "queued", "rate"}) or None.
+
+    Values too large for their field are sent as the field's maximum.
+    """
+    load = load or {}
+    return HEARTBEAT_PACKET.pack(HEARTBEAT_MAGIC, token, seq, files_version, _clamp(free_slots, 0x7FFF, -1),
+                                 _clamp(load.get("slots", 0), 0xFFFF), _clamp(load.get("active", 0), 0xFFFF),
+                                 _clamp(load.get("queued", 0), 0xFFFF),
+                                 _clamp(load.get("rate", 0) // 1024, 0xFFFFFFFF)) + "\n".join(tasks).encode("utf-8")
+
+def unpack_heartbeat(packet):
+    """(token, seq, files_version, free_slots, tasks, load or None); raises ValueError if malformed."""
+    if packet[:2] != HEARTBEAT_MAGIC or len(packet) < HEARTBEAT_PACKET.size:
+        raise ValueError("not a heartbeat")
+    _, token, seq, files_version, free_slots, slots, active, queued, rate = HEARTBEAT_PACKET.unpack_from(packet)
+    tail = packet[HEARTBEAT_PACKET.size:].decode("utf-8")
+    load = {"slots": slots, "active": active, "queued": queued, "rate": rate * 1024} if slots else None
+    return token, seq, files_version, free_slots, tail.split("\n") if tail else [], load
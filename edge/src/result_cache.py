@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+
+HASH_READ_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """Results of deterministic tasks, keyed on the task package plus an input fingerprint.
+
+    A task opts in with {"deterministic": true} in its `<task>.json` sidecar,
+    optionally adding {"fingerprint": "..."} for inputs that live outside the
+    package. The key is a SHA-256 over the package's files and the
+    fingerprint, so resubmitting the same task completes from the cache
+    without running it, even if it was zipped again.
+
+    Entries are files in `cache_dir` named by their key. Entries older than
+    `max_age` seconds are dropped on lookup and on eviction passes. Entries
+    are also evicted least recently used first once the cache holds more than
+    `max_bytes`. All methods block (run them on an executor).
+    """
+
+    def __init__(self, cache_dir, max_bytes, max_age):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()  # key -> (size, stored_at), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self):
+        """Index the entries left by a previous run, oldest first."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    os.remove(entry.path)  # interrupted store
+                elif entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        with self._lock:
+            for stored_at, key, size in sorted(found):
+                self._entries[key] = (size, stored_at)
+                self._bytes += size
+        self.evict()
+
+    @staticmethod
+    def key(package_path, fingerprint=None):
+        """Hash of the package's member names and contents (zip timestamps and
+        compression do not matter) plus the fingerprint."""
+        sha = hashlib.sha256()
+        with zipfile.ZipFile(package_path) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                sha.update(info.filename.encode() + b"\0")
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    while True:
+                        chunk = member.read(HASH_READ_SIZE)
+                        if not chunk:
+                            break
+                        sha.update(chunk)
+                sha.update(b"\0%d\0" % info.file_size)
+        sha.update(b"\0")
+        if fingerprint is not None:
+            sha.update(str(fingerprint).encode())
+        return sha.hexdigest()
+
+    def fetch(self, key, dest_path):
+        """Copy the cached result for `key` to `dest_path`; returns False on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            expired = entry is not None and time.time() - entry[1] > self.max_age
+            if entry is None or expired:
+                self.misses += 1
+                if expired:
+                    self._drop(key)
+                    self.evictions += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        if entry is None or expired:
+            if expired:
+                self._remove(key)
+            return False
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(self.path(key), tmp_path)
+        except FileNotFoundError:
+            # Removed behind our back: forget it and run the task
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+                self.hits -= 1
+                self.misses += 1
+            return False
+        os.replace(tmp_path, dest_path)
+        return True
+
+    def store(self, key, result_path):
+        """Keep a copy of a finished task's result (the original may be moved by users)."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        shutil.copyfile(result_path, tmp_path)
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self.path(key))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (size, time.time())
+            self._bytes += size
+            self.stores += 1
+        self.evict()
+
+    def _drop(self, key):
+        size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until under max_bytes."""
+        now = time.time()
+        with self._lock:
+            victims = [key for key, (_, stored_at) in self._entries.items() if now - stored_at > self.max_age]
+            for key in victims:
+                self._drop(key)
+            for key in list(self._entries):
+                if self._bytes <= self.max_bytes:
+                    break
+                self._drop(key)
+                victims.append(key)
+            self.evictions += len(victims)
+        for key in victims:
+            self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_PREFIX = "journal-"
+
+
+class StateStore:
+    """Append-only journal plus compacting snapshots of the edge's peers and their file lists.
+
+    Records are appended to memory on the event loop; write() puts a batch
+    in the journal with one write call, and save_snapshot() replaces the
+    journal so far with one compact file. Journals are numbered by
+    generation: a snapshot of generation G covers everything logged before
+    journal G, so loading reads the snapshot and replays journals >= G.
+
+    Records set state rather than change it, so replaying one that the
+    snapshot already covers does no harm:
+
+        ["peer", peer_id, info]         registry fields (host, port, slots, files_version)
+        ["files", peer_id, {name: cs}]  the peer's whole file list
+        ["add", peer_id, name, cs]
+        ["del", peer_id, name]
+        ["forget", peer_id]
+
+    write(), save_snapshot() and load() block (run them on an executor),
+    one at a time.
+    """
+
+    def __init__(self, state_dir, fsync=False):
+        self.state_dir = state_dir
+        self.fsync = fsync
+        self.gen = 0
+        self.pending = []
+        self.journal_bytes = 0
+
+    def journal_path(self, gen):
+        return os.path.join(self.state_dir, f"{JOURNAL_PREFIX}{gen:08d}.log")
+
+    def _journals(self):
+        gens = []
+        for name in os.listdir(self.state_dir):
+            if name.startswith(JOURNAL_PREFIX) and name.endswith(".log"):
+                try:
+                    gens.append(int(name[len(JOURNAL_PREFIX):-4]))
+                except ValueError:
+                    pass
+        return sorted(gens)
+
+    # Event loop
+
+    def append(self, *record):
+        self.pending.append(record)
+
+    def take(self):
+        """Pending records and the generation they belong to."""
+        records, self.pending = self.pending, []
+        return self.gen, records
+
+    def rotate(self):
+        """Start a new journal; returns its generation (the one the next snapshot covers up to)."""
+        self.gen += 1
+        self.journal_bytes = 0
+        return self.gen
+
+    # Executor
+
+    def write(self, gen, records):
+        if not records:
+            return
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode()
+        with open(self.journal_path(gen), "ab") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.journal_bytes += len(data)
+
+    def save_snapshot(self, peers, gen):
+        """Write `peers` as the state at the start of journal `gen`, then drop older journals."""
+        path = os.path.join(self.state_dir, SNAPSHOT_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"gen": gen, "time": time.time(), "peers": peers}, f, separators=(",", ":"))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        for old in self._journals():
+            if old < gen:
+                os.remove(self.journal_path(old))
+
+    def load(self):
+        """Rebuild {peer_id: info with "files"} from the snapshot and journals.
+
+        Returns (peers, snapshot time or None). A torn last line (crash
+        mid-write) ends the replay of its journal.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        peers, saved_at, first = {}, None, 0
+        try:
+            with open(os.path.join(self.state_dir, SNAPSHOT_FILE)) as f:
+                snapshot = json.load(f)
+            peers, saved_at, first = snapshot["peers"], snapshot.get("time"), snapshot["gen"]
+        except (OSError, ValueError, KeyError):
+            pass
+        journals = [gen for gen in self._journals() if gen >= first]
+        for gen in journals:
+            with open(self.journal_path(gen), "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self._replay(peers, record)
+        # Continue in a fresh journal so a torn line is never followed by new records
+        self.gen = max(journals + [first]) + 1
+        return peers, saved_at
+
+    @staticmethod
+    def _replay(peers, record):
+        kind, peer_id = record[0], record[1]
+        if kind == "peer":
+            peer = peers.setdefault(peer_id, {"files": {}})
+            peer.update(record[2])
+        elif kind == "files":
+            peers.setdefault(peer_id, {"files": {}})["files"] = record[2]
+        elif kind == "add":
+            peers.setdefault(peer_id, {"files": {}})["files"][record[2]] = record[3]
+        elif kind == "del":
+            peers.get(peer_id, {"files": {}})["files"].pop(record[2], None)
+        elif kind == "forget":
+            peers.pop(peer_id, None)
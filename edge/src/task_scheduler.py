@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import heapq
+
+QUEUED = "queued"
+LEASED = "leased"
+
+# Written next to the task files; dotfiles and *.json are never tasks.
+STATE_FILE = ".scheduler.json"
+
+
+class _Task:
+    def __init__(self, task_id, priority=0, attempts=0):
+        self.task_id = task_id
+        self.priority = priority
+        self.attempts = attempts
+        self.state = QUEUED
+        self.peer_id = None
+        self.deadline = None
+        self.leased_at = None
+        self.seq = 0  # bumped on every state change; stale heap entries are skipped
+
+
+class TaskScheduler:
+    """Leased task queue backed by the task files in `tasks_dir`.
+
+    A task file stays on disk until its result is submitted, so the queue
+    survives an edge restart. So do leases: a task leased before the restart
+    comes back leased to the same peer, whose heartbeats renew it as usual,
+    and is requeued only if the lease then runs out.
+    Tasks are handed out highest priority first, then oldest first. A lease
+    expires `lease_timeout` seconds after the peer's last heartbeat; expired
+    or failed tasks are requeued until `max_attempts` handouts, then moved to
+    `dead_letter_dir`.
+
+    Priorities come from an optional `<task>.json` sidecar ({"priority": n}),
+    which may carry other per-task options read by the edge.
+    The in-memory methods are meant to run on the event loop only; scan(),
+    save() and the file helpers block and belong on an executor.
+    """
+
+    def __init__(self, tasks_dir, dead_letter_dir, lease_timeout=60, max_attempts=3):
+        self.tasks_dir = tasks_dir
+        self.dead_letter_dir = dead_letter_dir
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.tasks = {}  # task_id -> _Task
+        self._queue = []  # (-priority, order, seq, task_id)
+        self._leases = []  # (deadline, seq, task_id)
+        self._by_peer = {}  # peer_id -> set of leased task IDs
+        self._order = 0
+        self._saved_attempts = {}  # from the state file, applied when the task is first seen
+        self._saved_leases = {}  # task_id -> peer_id, likewise
+        # Finished tasks whose files are still being removed/buried, so a
+        # concurrent scan does not queue them again.
+        self.retired = set()
+        self.dirty = False
+        self.on_available = None  # called whenever a task is (re)queued
+        self.expirations = 0  # leases that ran out, for metrics
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def has_queued(self):
+        """True if a task is waiting to be leased (drops stale heap entries on the way)."""
+        while self._queue:
+            _, _, seq, task_id = self._queue[0]
+            task = self.tasks.get(task_id)
+            if task is not None and task.seq == seq and task.state == QUEUED:
+                return True
+            heapq.heappop(self._queue)
+        return False
+
+    # Queue operations (event loop)
+
+    def _unlink(self, task):
+        leased = self._by_peer.get(task.peer_id)
+        if leased is not None:
+            leased.discard(task.task_id)
+            if not leased:
+                del self._by_peer[task.peer_id]
+
+    def _enqueue(self, task):
+        self._unlink(task)
+        task.state = QUEUED
+        task.peer_id = None
+        task.deadline = None
+        task.leased_at = None
+        task.seq += 1
+        self._order += 1
+        heapq.heappush(self._queue, (-task.priority, self._order, task.seq, task.task_id))
+        if self.on_available is not None:
+            self.on_available()
+
+    def add(self, task_id, priority=0):
+        """Queue a task found on disk. No-op if it is already known."""
+        if task_id in self.tasks or task_id in self.retired:
+            return False
+        attempts = self._saved_attempts.pop(task_id, 0)
+        task = self.tasks[task_id] = _Task(task_id, priority, attempts)
+        peer_id = self._saved_leases.pop(task_id, None)
+        if peer_id is None:
+            self._enqueue(task)
+        else:
+            # The peer may still be running it: wait for its heartbeat instead of handing it out again
+            task.state = LEASED
+            task.peer_id = peer_id
+            task.leased_at = time.monotonic()
+            self._by_peer.setdefault(peer_id, set()).add(task_id)
+            self._extend(task, task.leased_at)
+        return True
+
+    def discard(self, task_id):
+        """Forget a task whose file disappeared."""
+        task = self.tasks.pop(task_id, None)
+        if task is not None:
+            self._unlink(task)
+            self.dirty = True
+
+    def lease(self, peer_id, count=1, now=None):
+        """Hand out up to `count` tasks to `peer_id`. Returns their IDs."""
+        now = time.monotonic() if now is None else now
+        leased = []
+        while self._queue and len(leased) < count:
+            _, _, seq, task_id = heapq.heappop(self._queue)
+            task = self.tasks.get(task_id)
+            if task is None or task.seq != seq or task.state != QUEUED:
+                continue
+            task.state = LEASED
+            task.peer_id = peer_id
+            self._by_peer.setdefault(peer_id, set()).add(task_id)
+            task.attempts += 1
+            task.seq += 1
+            task.leased_at = now
+            self._extend(task, now)
+            leased.append(task_id)
+        if leased:
+            self.dirty = True
+        return leased
+
+    def leased_count(self, peer_id=None):
+        """Tasks leased to `peer_id`, or to anyone."""
+        if peer_id is None:
+            return sum(len(leased) for leased in self._by_peer.values())
+        return len(self._by_peer.get(peer_id, ()))
+
+    def queued_count(self):
+        return len(self.tasks) - self.leased_count()
+
+    def lease_age(self, task_id, now=None):
+        """Seconds since `task_id` was leased, or None if it is not leased."""
+        task = self.tasks.get(task_id)
+        if task is None or task.leased_at is None:
+            return None
+        return (time.monotonic() if now is None else now) - task.leased_at
+
+    def oldest_lease_age(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max((now - t.leased_at for t in self.tasks.values() if t.leased_at is not None), default=0.0)
+
+    def _extend(self, task, now):
+        task.deadline = now + self.lease_timeout
+        heapq.heappush(self._leases, (task.deadline, task.seq, task.task_id))
+
+    def renew(self, peer_id, task_ids=None, now=None):
+        """Extend the leases `peer_id` holds (only `task_ids` if given)."""
+        now = time.monotonic() if now is None else now
+        ids = list(self._by_peer.get(peer_id, ())) if task_ids is None else task_ids
+        for task_id in ids:
+            task = self.tasks.get(task_id)
+            if task is not None and task.state == LEASED and task.peer_id == peer_id:
+                self._extend(task, now)
+
+    def release(self, task_ids):
+        """Requeue tasks whose transfer failed, without counting the attempt."""
+        for task_id in task_ids:
+            task = self.tasks.get(task_id)
+            if task is not None and task.state == LEASED:
+                task.attempts -= 1
+                self._enqueue(task)
+        self.dirty = True
+
+    def complete(self, task_id):
+        """Mark a task done. Returns True the first time (its file should be removed)."""
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return False
+        self._unlink(task)
+        self.retired.add(task_id)
+        self.dirty = True
+        return True
+
+    def fail(self, task_id, peer_id=None):
+        """Requeue a failed task. Returns True if it ran out of attempts (dead letter)."""
+        task = self.tasks.get(task_id)
+        if task is None or task.state != LEASED or (peer_id is not None and task.peer_id != peer_id):
+            return False
+        self.dirty = True
+        if task.attempts >= self.max_attempts:
+            del self.tasks[task_id]
+            self._unlink(task)
+            self.retired.add(task_id)
+            return True
+        self._enqueue(task)
+        return False
+
+    def drop_peer(self, peer_id):
+        """Requeue every task leased to a peer that went away. Returns the IDs that exhausted their attempts."""
+        dead = []
+        for task_id in sorted(self._by_peer.get(peer_id, ())):
+            if self.fail(task_id, peer_id):
+                dead.append(task_id)
+        return dead
+
+    def expire(self, now=None):
+        """Requeue expired leases. Returns the IDs that exhausted their attempts."""
+        now = time.monotonic() if now is None else now
+        dead = []
+        while self._leases and self._leases[0][0] <= now:
+            deadline, seq, task_id = heapq.heappop(self._leases)
+            task = self.tasks.get(task_id)
+            if task is None or task.state != LEASED or task.seq != seq or task.deadline != deadline:
+                continue
+            print(f"[SCHEDULER] Lease on {task_id} held by {task.peer_id} expired")
+            self.expirations += 1
+            if self.fail(task_id):
+                dead.append(task_id)
+        return dead
+
+    # Disk (executor)
+
+    def task_path(self, task_id):
+        return os.path.join(self.tasks_dir, task_id)
+
+    def read_sidecar(self, task_id):
+        """The task's `<task>.json` options, or {} if it has none."""
+        try:
+            with open(self.task_path(task_id) + ".json") as f:
+                options = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return options if isinstance(options, dict) else {}
+
+    def read_priority(self, task_id):
+        try:
+            return int(self.read_sidecar(task_id).get("priority", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def load(self):
+        """Read the attempt counters and leases saved by a previous run."""
+        try:
+            with open(os.path.join(self.tasks_dir, STATE_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self._saved_attempts = state.get("attempts", {})
+        self._saved_leases = state.get("leases", {})
+
+    def scan(self, known=()):
+        """List task files: returns ([(task_id, priority)] for new ones, oldest first, and the set of all IDs)."""
+        found = set()
+        new = []
+        with os.scandir(self.tasks_dir) as it:
+            for entry in it:
+                name = entry.name
+                if name.startswith(".") or name.endswith(".json") or not entry.is_file():
+                    continue
+                found.add(name)
+                if name not in known:
+                    new.append((entry.stat().st_mtime_ns, name))
+        return [(name, self.read_priority(name)) for _, name in sorted(new)], found
+
+    def snapshot(self):
+        self.dirty = False
+        return {
+            "attempts": {t.task_id: t.attempts for t in self.tasks.values() if t.attempts},
+            "leases": {t.task_id: t.peer_id for t in self.tasks.values() if t.state == LEASED},
+        }
+
+    def save(self, snapshot):
+        path = os.path.join(self.tasks_dir, STATE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+
+    def remove_files(self, task_id):
+        for path in (self.task_path(task_id), self.task_path(task_id) + ".json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def bury(self, task_id):
+        """Move a task (and its sidecar) to the dead-letter directory."""
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        for suffix in ("", ".json"):
+            try:
+                os.replace(self.task_path(task_id) + suffix,
+                           os.path.join(self.dead_letter_dir, task_id + suffix))
+            except FileNotFoundError:
+                pass
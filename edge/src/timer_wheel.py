@@ -0,0 +1,56 @@
+import math
+
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) schedule/cancel, each tick only visits the slot it lands on.
+
+    Time is cut into `tick`-second slots arranged in a ring of enough slots
+    to cover `span` seconds. A key scheduled further out than one turn of
+    the ring sits in its slot until the turn it is due in, so `span` only
+    needs to cover the usual delay, not the longest one.
+
+    For liveness, schedule each peer once and let advance() hand it back when
+    its timer runs out; if the peer was heard from in the meantime, schedule
+    it again from its last heartbeat. Heartbeats then never touch the wheel.
+    """
+
+    def __init__(self, tick=1.0, span=60.0, now=0.0):
+        self.tick = tick
+        self.slots = [dict() for _ in range(int(math.ceil(span / tick)) + 1)]
+        self.where = {}  # key -> slot index
+        self.current = int(now // tick)  # next tick to process
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def schedule(self, key, deadline):
+        """(Re)schedule `key` to come due at `deadline`."""
+        self.cancel(key)
+        # Never into a tick already processed: those slots are only visited again a turn later
+        index = max(int(math.ceil(deadline / self.tick)), self.current) % len(self.slots)
+        self.slots[index][key] = deadline
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now):
+        """Keys whose deadline is <= `now`, removed from the wheel."""
+        due = []
+        last = int(now // self.tick)
+        # After a long pause one turn visits every slot; later ticks would only repeat it
+        first = max(self.current, last - len(self.slots) + 1)
+        for t in range(first, last + 1):
+            slot = self.slots[t % len(self.slots)]
+            expired = [key for key, deadline in slot.items() if deadline <= now]
+            for key in expired:
+                del slot[key]
+                del self.where[key]
+            due.extend(expired)
+        self.current = last + 1
+        return due
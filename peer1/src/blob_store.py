@@ -0,0 +1,260 @@
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+FICLONE = 0x40049409  # ioctl from <linux/fs.h>: share extents (copy-on-write clone)
+EMPTY_SHA = hashlib.sha256(b"").hexdigest()
+
+
+class BlobError(Exception):
+    pass
+
+
+class BlobStore:
+    """Local LRU cache of task blobs, named by the SHA-256 of their contents.
+
+    Task trees are built from blobs with materialize(): a copy-on-write clone
+    where the filesystem supports it, otherwise a copy (`link_mode` "copy"
+    forces copies), so a task writing to its inputs never reaches the store.
+    Blobs are stored read-only; ensure() and check() still evict any blob
+    whose size or mtime changed since it was stored, so it is fetched again.
+    Blobs in use by a task are pinned and never evicted.
+    """
+
+    def __init__(self, blob_dir, max_bytes, link_mode="auto"):
+        self.blob_dir = blob_dir
+        self.max_bytes = max_bytes
+        self.link_mode = link_mode
+        self._entries = OrderedDict()  # sha -> (size, mtime_ns), least recently used first
+        self._bytes = 0
+        self._pins = {}
+        self._inflight = {}  # sha -> Event set when its download finishes
+        self._lock = threading.Lock()
+        os.makedirs(blob_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        with os.scandir(self.blob_dir) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    os.remove(entry.path)  # interrupted download
+                elif entry.is_file():
+                    os.chmod(entry.path, 0o444)  # stores from before blobs were read-only
+                    st = entry.stat()
+                    found.append((st.st_atime_ns, entry.name, st.st_size, st.st_mtime_ns))
+        for _, sha, size, mtime_ns in sorted(found):
+            self._entries[sha] = (size, mtime_ns)
+            self._bytes += size
+
+    def path(self, sha):
+        return os.path.join(self.blob_dir, sha)
+
+    def has(self, sha):
+        with self._lock:
+            return sha in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "pinned": len(self._pins)}
+
+    def missing(self, hashes):
+        with self._lock:
+            return [sha for sha in hashes if sha not in self._entries]
+
+    # Downloads
+
+    def writer(self, sha):
+        """Open a temporary file for a blob being downloaded; finish with add()."""
+        tmp_path = os.path.join(self.blob_dir, f".{sha}.{uuid.uuid4().hex}")
+        return tmp_path, open(tmp_path, "wb")
+
+    def add(self, sha, tmp_path, digest):
+        """Move a downloaded blob into the store if its SHA-256 `digest` matches."""
+        if digest != sha:
+            os.remove(tmp_path)
+            raise BlobError(f"Blob {sha} failed verification")
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, self.path(sha))
+        st = os.stat(self.path(sha))
+        with self._lock:
+            if sha not in self._entries:
+                self._bytes += st.st_size
+            self._entries[sha] = (st.st_size, st.st_mtime_ns)
+            self._entries.move_to_end(sha)
+        self._evict()
+
+    def ensure(self, hashes, fetch):
+        """Make every blob in `hashes` available and pin them; returns the pinned set.
+
+        `fetch(missing)` downloads the blobs nobody else is already fetching;
+        blobs another thread is downloading are waited for instead.
+        """
+        hashes = set(hashes)
+        self.check(hashes)  # a changed blob counts as missing
+        with self._lock:
+            for sha in hashes:
+                self._pins[sha] = self._pins.get(sha, 0) + 1
+        if EMPTY_SHA in hashes and not self.has(EMPTY_SHA):
+            # Nothing to download; a zero-length attachment never reaches a sink
+            tmp_path, f = self.writer(EMPTY_SHA)
+            f.close()
+            self.add(EMPTY_SHA, tmp_path, EMPTY_SHA)
+        with self._lock:
+            mine = [sha for sha in hashes if sha not in self._entries and sha not in self._inflight]
+            theirs = [self._inflight[sha] for sha in hashes if sha not in self._entries and sha in self._inflight]
+            for sha in mine:
+                self._inflight[sha] = threading.Event()
+        try:
+            try:
+                if mine:
+                    fetch(mine)
+            finally:
+                with self._lock:
+                    for sha in mine:
+                        self._inflight.pop(sha).set()
+            for event in theirs:
+                event.wait()
+            lost = self.missing(hashes)
+            if lost:
+                raise BlobError(f"{len(lost)} blob(s) could not be fetched")
+        except BaseException:
+            self.unpin(hashes)
+            raise
+        return hashes
+
+    def unpin(self, hashes):
+        with self._lock:
+            for sha in hashes:
+                self._pins[sha] -= 1
+                if not self._pins[sha]:
+                    del self._pins[sha]
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            victims = []
+            for sha, (size, _) in self._entries.items():
+                if self._bytes <= self.max_bytes:
+                    break
+                if sha not in self._pins:
+                    victims.append(sha)
+                    self._bytes -= size
+            for sha in victims:
+                del self._entries[sha]
+        for sha in victims:
+            self._remove(sha)
+
+    def _remove(self, sha):
+        try:
+            os.remove(self.path(sha))
+        except FileNotFoundError:
+            pass
+
+    # Task trees
+
+    def _place(self, src, dest):
+        if self.link_mode != "copy":
+            try:
+                with open(src, "rb") as s, open(dest, "wb") as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                    raise
+                os.remove(dest)
+        # Never a hardlink: the task would share the blob's inode and could rewrite it
+        shutil.copyfile(src, dest)
+
+    def materialize(self, manifest, dest_dir):
+        """Build the task tree described by `manifest` in `dest_dir` from (pinned) blobs."""
+        for path in manifest.get("dirs", []):
+            os.makedirs(os.path.join(dest_dir, path), exist_ok=True)
+        for path, sha, _ in manifest["files"]:
+            dest = os.path.join(dest_dir, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            self._place(self.path(sha), dest)
+        with self._lock:
+            for _, sha, _ in manifest["files"]:
+                if sha in self._entries:
+                    self._entries.move_to_end(sha)
+
+    def check(self, hashes):
+        """Evict blobs whose file changed (size or mtime) since it was stored."""
+        changed = []
+        with self._lock:
+            for sha in hashes:
+                entry = self._entries.get(sha)
+                if entry is None:
+                    continue
+                try:
+                    st = os.stat(self.path(sha))
+                    if (st.st_size, st.st_mtime_ns) == entry:
+                        continue
+                except FileNotFoundError:
+                    pass
+                changed.append(sha)
+                del self._entries[sha]
+                self._bytes -= entry[0]
+        for sha in changed:
+            print(f"[BLOBS] Blob {sha} was modified on disk, evicting it")
+            self._remove(sha)
+
+
+class BlobSink:
+    """Session sink splitting a BLOBS attachment into blob files (sizes from the message).
+
+    Each blob is hashed as it arrives and only stored if the hash matches.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+        self.current = None  # [sha, tmp_path, file, hasher]
+        self.remaining = 0
+
+    def __call__(self, msg_type, data):
+        if msg_type != "BLOBS":
+            return None
+        self.pending = [(blob["hash"], blob["size"]) for blob in data.get("blobs", [])]
+        return self.write
+
+    def _next(self):
+        self._finish()
+        sha, size = self.pending.pop(0)
+        tmp_path, f = self.store.writer(sha)
+        self.current = [sha, tmp_path, f, hashlib.sha256()]
+        self.remaining = size
+
+    def _finish(self):
+        if self.current is not None:
+            sha, tmp_path, f, hasher = self.current
+            self.current = None
+            f.close()
+            self.store.add(sha, tmp_path, hasher.hexdigest())
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            while not self.remaining:
+                self._next()
+            n = min(len(view), self.remaining)
+            self.current[2].write(view[:n])
+            self.current[3].update(view[:n])
+            self.remaining -= n
+            view = view[n:]
+
+    def close(self):
+        """Store the last blob once the response is complete, or drop a truncated one."""
+        if self.current is not None and self.remaining:
+            _, tmp_path, f, _ = self.current
+            self.current = None
+            f.close()
+            os.remove(tmp_path)
+            return
+        self._finish()
@@ -15,7 +15,56 @@ EDGE_NODE_PORT = 55000  # Must match edge node's port
 # Directory settings
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 WORK_DIR = os.path.join(BASE_DIR, "work")  # Directory for task processing
+SHARED_FILES_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'shared_files'))  # Downloads land here
+
+# Discovery: cached edges are probed while DISCOVER_MASTER is broadcast
+EDGE_CACHE_PATH = os.path.join(BASE_DIR, '.edge_cache.json')  # Edges found last time
+DISCOVERY_TIMEOUT_MIN = 0.25  # First wait for an answer; doubles (with jitter) on every miss...
+DISCOVERY_TIMEOUT_MAX = 2.0  # ...up to this
 
 # Intervals
 UPDATE_INTERVAL = 20
 HEARTBEAT_INTERVAL = 10
+
+# Tasks
+TASK_SLOTS = os.cpu_count() or 1  # Tasks run in parallel, each in its own work dir
+TASK_WAIT = 60  # Seconds the edge may hold REQUEST_TASK open until work arrives
+
+# Warm workers: run main.py in processes forked from pre-started interpreters
+# instead of a cold `python main.py` per task
+WARM_POOL = False
+WARM_PRELOAD_MODULES = []  # Imported once per worker, e.g. ["numpy", "pandas"]
+WARM_MAX_TASKS = 100  # Tasks before a worker is replaced
+WARM_MAX_RSS_MB = 512  # Replace a worker whose memory grew past this
+
+# Task blobs: package contents cached by SHA-256 and shared between tasks
+BLOB_DIR = os.path.join(BASE_DIR, "blobs")  # None: no store, tasks arrive as whole zips
+BLOB_CACHE_MAX_BYTES = 2 * 1024 ** 3  # LRU eviction above this
+BLOB_LINK_MODE = "auto"  # "auto": reflink (copy-on-write), else copy; "copy": always copy
+BLOB_FETCH_TIMEOUT = 300
+
+# Session settings (persistent connection to the edge node)
+SESSION_CONNECT_TIMEOUT = 5
+SESSION_REQUEST_TIMEOUT = 30
+RECONNECT_BACKOFF_MAX = 30
+
+# Compression, negotiated per connection with HELLO (stdlib codecs: zlib, lzma, bz2)
+COMPRESSION = ["zlib", "lzma", "bz2"]  # Preference order; [] turns it off (best on fast LANs)
+COMPRESSION_LEVELS = {"zlib": 1, "lzma": 0, "bz2": 1}  # Fastest levels: see benchmarks/bench_compression.py
+COMPRESSION_MIN_SIZE = 1024  # Smaller bodies and attachments are sent as they are
+
+# Metrics: GET /metrics in the Prometheus text format
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9101  # None disables the HTTP endpoint (use a different port per peer on one host)
+
+# Swarm downloads (parallel ranges from every peer holding the file)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_SPAN = 16  # Chunks requested at once from a fast peer
+DOWNLOAD_TARGET_REQUEST_SECONDS = 0.5  # Target duration of each range request
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_CHECKPOINT_INTERVAL = 1.0
+DOWNLOAD_BUSY_WAIT_MAX = 60  # Seconds a source may answer only BUSY before the download stops using it
+DOWNLOAD_MAX_SOURCES = 8  # Holders downloaded from at once, least loaded first; the rest are fallbacks
+
+# Partial downloads (data + bitmap sidecar) until the checksum verifies
+STAGING_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'partial_downloads'))
@@ -0,0 +1,115 @@
+import os
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from connection import send_message, receive_message
+from protocol import build_message, parse_message
+from hash_ring import split_address
+from config import (
+    DISCOVERY_PORT,
+    BUFFER_SIZE,
+    ENCODING,
+    EDGE_CACHE_PATH,
+    DISCOVERY_TIMEOUT_MIN,
+    DISCOVERY_TIMEOUT_MAX
+)
+
+
+def backoff(attempt):
+    """Seconds to wait after `attempt` failures: doubling from DISCOVERY_TIMEOUT_MIN, capped, with jitter.
+
+    The jitter (50-100% of the step) keeps peers restarted together from
+    probing in lockstep.
+    """
+    step = min(DISCOVERY_TIMEOUT_MAX, DISCOVERY_TIMEOUT_MIN * 2 ** attempt)
+    return step * random.uniform(0.5, 1.0)
+
+
+def load_cached_edges(path=EDGE_CACHE_PATH):
+    """[(host, port)] of the edges found last time, most recent first."""
+    try:
+        with open(path) as f:
+            return [split_address(edge) for edge in json.load(f).get("edges", [])]
+    except (OSError, ValueError, AttributeError):
+        return []
+
+
+def save_cached_edges(edges, path=EDGE_CACHE_PATH):
+    """Remember `edges` ("host:port") for the next start; best effort."""
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump({"edges": edges, "time": time.time()}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[DISCOVERY] Could not save {path}: {e}")
+
+
+def _probe(host, port, found, stop):
+    """Ask a cached edge for its ring until it answers or discovery is over."""
+    attempt = 0
+    while not stop.is_set():
+        timeout = backoff(attempt)
+        deadline = time.monotonic() + timeout
+        try:
+            with socket.create_connection((host, port), timeout=timeout) as sock:
+                sock.settimeout(timeout)
+                send_message(sock, build_message("RING", {}, 1))
+                msg, _ = receive_message(sock)
+            msg_type, data = parse_message(msg)
+            found.put((host, port, data if msg_type == "RING" else None, "cache"))
+            return
+        except (OSError, ValueError):
+            # Refused (edge still starting) returns at once: wait out the rest of the step
+            stop.wait(max(0, deadline - time.monotonic()))
+        attempt += 1
+
+
+def _broadcast(peer_id, peer_port, discovery_port, found, stop):
+    """Broadcast DISCOVER_MASTER, waiting longer after every unanswered attempt."""
+    packet = json.dumps(build_message("DISCOVER_MASTER", {"peer_id": peer_id, "port": peer_port})).encode(ENCODING)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_sock:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        attempt = 0
+        while not stop.is_set():
+            deadline = time.monotonic() + backoff(attempt)
+            try:
+                udp_sock.sendto(packet, ('<broadcast>', discovery_port))
+                while not stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    udp_sock.settimeout(remaining)
+                    try:
+                        data, addr = udp_sock.recvfrom(BUFFER_SIZE)
+                    except socket.timeout:
+                        break
+                    msg_type, data = parse_message(json.loads(data.decode(ENCODING)))
+                    if msg_type == "MASTER_ANNOUNCE":
+                        found.put((data.get("master_ip"), data.get("master_port"), data.get("ring"), "broadcast"))
+                        return
+            except (OSError, ValueError) as e:
+                print(f"[DISCOVERY] Broadcast error: {e}")
+                stop.wait(max(0, deadline - time.monotonic()))
+            attempt += 1
+            if attempt == 3:
+                print("[DISCOVERY] No edge answered yet, still trying...")
+
+
+def discover_edge(peer_id, peer_port, discovery_port=DISCOVERY_PORT, cache_path=EDGE_CACHE_PATH):
+    """Find an edge: (host, port, ring info or None, how it was found: "cache" or "broadcast").
+
+    Every cached edge is probed directly while DISCOVER_MASTER is broadcast;
+    the first answer wins. Blocks until one comes.
+    """
+    found = queue.Queue()
+    stop = threading.Event()
+    for host, port in load_cached_edges(cache_path):
+        threading.Thread(target=_probe, args=(host, port, found, stop), daemon=True).start()
+    threading.Thread(target=_broadcast, args=(peer_id, peer_port, discovery_port, found, stop), daemon=True).start()
+    try:
+        return found.get()
+    finally:
+        stop.set()
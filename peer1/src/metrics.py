@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; request handling on a LAN sits in the low buckets, transfers in the high ones
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set_function(self, func):
+        """Compute the value at scrape time instead: `func()` returns a number,
+        or {label values tuple: number} for a labelled metric."""
+        self._function = func
+
+    def _items(self):
+        if self._function is not None:
+            value = self._function()
+            return sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+    def snapshot(self):
+        return [{"labels": dict(zip(self.labelnames, labels)), "value": value} for labels, value in self._items()]
+
+
+class Counter(_Metric):
+    """Monotonic count; inc(*label_values, value=1)."""
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; usually set_function() so it costs nothing until scraped."""
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets; observe(value, *label_values)."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def _items(self):
+        with self._lock:
+            return sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total) in self._items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        samples = []
+        for labels, (counts, total) in self._items():
+            samples.append({
+                "labels": dict(zip(self.labelnames, labels)),
+                "buckets": [[bound, count] for bound, count in zip(self.buckets + ("+Inf",), counts)],
+                "sum": total,
+                "count": sum(counts),
+            })
+        return samples
+
+
+class Registry:
+    """Named metrics of one process, rendered in the Prometheus text format.
+
+    Metrics are cheap to update from any thread: one lock, one dict lookup.
+    Registering a name twice returns the existing metric.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def _all(self):
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def render(self):
+        lines = []
+        for _, metric in self._all():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly view of every metric, for the STATS message."""
+        snapshot = {"time": time.time()}
+        for name, metric in self._all():
+            try:
+                snapshot[name] = {"type": metric.kind, "samples": metric.snapshot()}
+            except Exception as e:
+                snapshot[name] = {"type": metric.kind, "error": str(e)}
+        return snapshot
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def stats_reply(data, registry=REGISTRY):
+    """Payload answering a STATS request: {"metrics": snapshot}, or {"text": ...} with format "prometheus"."""
+    if (data or {}).get("format") == "prometheus":
+        return {"text": registry.render()}
+    return {"metrics": registry.snapshot()}
+
+
+def http_response(path, registry=REGISTRY):
+    """(status, content type, body) for a GET of `path` on the metrics endpoint."""
+    if path.split("?", 1)[0] in ("/metrics", "/"):
+        return 200, CONTENT_TYPE, registry.render().encode()
+    return 404, "text/plain", b"Not found\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        status, content_type, body = http_response(self.path, self.registry)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(host, port, registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread. Returns the server (server_address has the port)."""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
@@ -1,205 +1,372 @@
-import socket
 import threading
 import os
 import sys
 import time
-import json
 import uuid
-import base64
+import shutil
 import zipfile
 import subprocess
-from connection import send_json, receive_json
-from protocol import build_message, parse_message
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from protocol import NAK_REGISTER
+from session import get_session
+from hash_ring import HashRing, peer_key, split_address
+from discovery import discover_edge, save_cached_edges
+from udp_heartbeat import UdpHeartbeat
+from warm_pool import WarmPool
+from blob_store import BlobStore, BlobSink
 from config import (
     PEER_HOST, 
     PEER_PORT,
-    DISCOVERY_PORT,
-    BUFFER_SIZE,
-    ENCODING,
     EDGE_NODE_PORT,
     EDGE_NODE_HOST,
     WORK_DIR,
     UPDATE_INTERVAL,
-    HEARTBEAT_INTERVAL
+    HEARTBEAT_INTERVAL,
+    TASK_SLOTS,
+    TASK_WAIT,
+    WARM_POOL,
+    WARM_PRELOAD_MODULES,
+    WARM_MAX_TASKS,
+    WARM_MAX_RSS_MB,
+    BLOB_DIR,
+    BLOB_CACHE_MAX_BYTES,
+    BLOB_LINK_MODE,
+    BLOB_FETCH_TIMEOUT,
+    SESSION_REQUEST_TIMEOUT,
+    METRICS_HOST,
+    METRICS_PORT
 )
 
 # Generate a unique peer ID if not provided
 PEER_ID = str(uuid.uuid4())
 
+TASKS = metrics.counter(
+    "peer_tasks_total", "Task outcomes: completed, failed, lost (result or failure report not delivered)", ("outcome",))
+TASK_SECONDS = metrics.histogram(
+    "peer_task_seconds", "Time per task phase: prepare (unpack/fetch blobs), run, upload", ("phase",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+
+class TaskPackageSink:
+    """Session sink splitting a TASK_PACKAGE attachment into one zip per task.
+
+    The edge sends every package of a batch back to back; the sizes listed in
+    the message tell where each one ends.
+    """
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.pending = []
+        self.current = None
+        self.remaining = 0
+
+    def __call__(self, msg_type, data):
+        if msg_type != "TASK_PACKAGE":
+            return None
+        self.pending = [(task["task_id"], task["size"]) for task in data.get("tasks", [])]
+        return self.write
+
+    def _next(self):
+        self.close()
+        task_id, size = self.pending.pop(0)
+        task_dir, zip_path = self.peer.task_paths(task_id)
+        shutil.rmtree(task_dir, ignore_errors=True)  # leftovers of an earlier attempt
+        os.makedirs(task_dir)
+        self.current = open(zip_path, 'wb')
+        self.remaining = size
+
+    def write(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            while not self.remaining:
+                self._next()
+            n = min(len(view), self.remaining)
+            self.current.write(view[:n])
+            self.remaining -= n
+            view = view[n:]
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
 class Peer:
     def __init__(self):
         self.master_ip = None
         self.master_port = None
+        self.session = None
+        self.udp = UdpHeartbeat()  # used once the edge offers it at REGISTER
         self.peer_id = PEER_ID
         self.work_dir = WORK_DIR
+        # Tasks leased from the edge and not yet submitted; reported in heartbeats
+        self.slots = TASK_SLOTS
+        self.running = set()
+        self.running_changed = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="task")
+        self.blob_store = BlobStore(BLOB_DIR, BLOB_CACHE_MAX_BYTES, BLOB_LINK_MODE) if BLOB_DIR else None
+        self.warm_pool = None
+        if WARM_POOL and hasattr(os, "fork"):
+            self.warm_pool = WarmPool(self.slots, WARM_PRELOAD_MODULES, WARM_MAX_TASKS, WARM_MAX_RSS_MB)
         os.makedirs(self.work_dir, exist_ok=True)
+        metrics.gauge("peer_task_slots", "Tasks this peer runs at once").set_function(lambda: self.slots)
+        metrics.gauge("peer_tasks_running", "Leased tasks not yet submitted").set_function(
+            lambda: self.slots - self.free_slots())
+        if self.blob_store is not None:
+            metrics.gauge("peer_blob_cache_bytes", "Size of the local blob store").set_function(
+                lambda: self.blob_store.stats()["bytes"])
+
+    def free_slots(self):
+        with self.running_changed:
+            return self.slots - len(self.running)
 
     def discover_master(self):
-        """Discover master node using UDP broadcast."""
+        """Find the edge: cached edges are probed while DISCOVER_MASTER is broadcast."""
         print(f"[PEER {self.peer_id}] Discovering master...")
-        
-        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        
-        discover_msg = build_message("DISCOVER_MASTER", {
-            "peer_id": self.peer_id,
-            "port": PEER_PORT
-        })
-        
-        while not self.master_ip:
-            try:
-                # Broadcast discovery message
-                udp_sock.sendto(json.dumps(discover_msg).encode(ENCODING), ('<broadcast>', DISCOVERY_PORT))
-                
-                # Wait for response
-                udp_sock.settimeout(5)
-                data, addr = udp_sock.recvfrom(BUFFER_SIZE)
-                msg_type, data = parse_message(json.loads(data.decode(ENCODING)))
-                
-                if msg_type == "MASTER_ANNOUNCE":
-                    self.master_ip = data.get("master_ip")
-                    self.master_port = data.get("master_port")
-                    print(f"[PEER {self.peer_id}] Master found at {self.master_ip}:{self.master_port}")
-                    return True
-                    
-            except socket.timeout:
-                print(f"[PEER {self.peer_id}] No master response, retrying...")
-            except Exception as e:
-                print(f"[PEER {self.peer_id}] Discovery error: {e}")
-                time.sleep(5)
-        
-        return False
+        start = time.perf_counter()
+        self.master_ip, self.master_port, ring_info, source = discover_edge(self.peer_id, PEER_PORT)
+        ring = HashRing.from_dict(ring_info) if ring_info else None
+        if ring is not None and len(ring) > 1:
+            # Federated edges: our session goes to the one owning our peer ID
+            self.master_ip, self.master_port = split_address(ring.owner(peer_key(self.peer_id)))
+        print(f"[PEER {self.peer_id}] Master found at {self.master_ip}:{self.master_port} "
+              f"({source}, {time.perf_counter() - start:.2f}s)")
+        # Next start tries the edge we use first, then the rest of the ring
+        edge = f"{self.master_ip}:{self.master_port}"
+        save_cached_edges([edge] + [member for member in sorted(ring.members if ring else ()) if member != edge])
+        self.session = get_session(self.master_ip, self.master_port)
+        self.session.on_reconnect(self.register_with_master)
+        return True
 
     def register_with_master(self):
         """Register peer with the master node."""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.master_ip, self.master_port))
-                msg = build_message("REGISTER", {
-                    "peer_id": self.peer_id,
-                    "host": PEER_HOST,
-                    "port": PEER_PORT
-                })
-                send_json(s, msg)
-                msg_type, data = parse_message(receive_json(s))
-                if msg_type == "REGISTERED":
-                    print(f"[PEER {self.peer_id}] Successfully registered with master")
-                    return True
-                else:
-                    print(f"[PEER {self.peer_id}] Registration failed: {data.get('error', 'Unknown error')}")
+            msg_type, data, _ = self.session.request("REGISTER", {
+                "peer_id": self.peer_id,
+                "host": PEER_HOST,
+                "port": PEER_PORT,
+                "slots": self.slots
+            })
+            if msg_type == "REGISTERED":
+                self.udp.configure(self.master_ip, data.get("heartbeat"))
+                print(f"[PEER {self.peer_id}] Successfully registered with master")
+                return True
+            else:
+                print(f"[PEER {self.peer_id}] Registration failed: {data.get('error', 'Unknown error')}")
         except Exception as e:
             print(f"[PEER {self.peer_id}] Registration error: {e}")
         return False
 
     def send_heartbeat(self, interval=HEARTBEAT_INTERVAL):
-        """Send periodic heartbeat to master."""
+        """Send periodic heartbeat to master, as a UDP datagram when the edge offered it."""
         while True:
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((self.master_ip, self.master_port))
-                    msg = build_message("HEARTBEAT", {
-                        "peer_id": self.peer_id
-                    })
-                    send_json(s, msg)
-                    msg_type, data = parse_message(receive_json(s))
-                    if msg_type == "ALIVE":
-                        print(f"[PEER {self.peer_id}] Heartbeat acknowledged")
+                with self.running_changed:
+                    running = sorted(self.running)
+                if self.udp.nak() == NAK_REGISTER:
+                    # Edge restarted and forgot us: register again
+                    self.register_with_master()
+                if not self.udp.send(0, self.slots - len(running), running):
+                    self.send_tcp_heartbeat(running)
             except Exception as e:
                 print(f"[PEER {self.peer_id}] Heartbeat error: {e}")
             time.sleep(interval)
 
-    def process_task(self, task_name, task_data_b64):
-        """Process a received task package."""
+    def send_tcp_heartbeat(self, running):
+        msg_type, data, _ = self.session.request("HEARTBEAT", {
+            "peer_id": self.peer_id,
+            "tasks": running,
+            "slots": self.slots,
+            "free_slots": self.slots - len(running)
+        })
+        if msg_type == "ALIVE":
+            print(f"[PEER {self.peer_id}] Heartbeat acknowledged")
+        elif msg_type == "ERROR":
+            # Edge restarted and forgot us: register again
+            self.register_with_master()
+
+    def task_paths(self, task_name):
+        """Return (task_dir, zip_path) for a task package."""
+        task_name = os.path.basename(task_name)
+        task_dir = os.path.join(self.work_dir, task_name.replace('.zip', ''))
+        return task_dir, os.path.join(task_dir, task_name)
+
+    def fetch_blobs(self, hashes):
+        """Download blobs missing from the local store from the edge."""
+        sink = BlobSink(self.blob_store)
         try:
-            # Create task directory
-            task_dir = os.path.join(self.work_dir, task_name.replace('.zip', ''))
-            os.makedirs(task_dir, exist_ok=True)
-            
-            # Save and extract ZIP
-            zip_path = os.path.join(task_dir, task_name)
-            with open(zip_path, 'wb') as f:
-                f.write(base64.b64decode(task_data_b64))
-            
+            msg_type, data, _ = self.session.request("FETCH_BLOBS", {"hashes": hashes},
+                                                     timeout=BLOB_FETCH_TIMEOUT, sink_for=sink)
+        finally:
+            sink.close()
+        print(f"[PEER {self.peer_id}] Fetched {len(data.get('blobs', []))} blob(s)")
+
+    def prepare_task_dir(self, task_dir, manifest):
+        """Build the task tree from cached blobs, fetching only the missing ones.
+
+        Returns the blobs used, still pinned: unpin them once the task has run.
+        """
+        shutil.rmtree(task_dir, ignore_errors=True)
+        os.makedirs(task_dir)
+        hashes = self.blob_store.ensure([entry[1] for entry in manifest["files"]], self.fetch_blobs)
+        try:
+            self.blob_store.materialize(manifest, task_dir)
+        except BaseException:
+            self.blob_store.unpin(hashes)
+            raise
+        return hashes
+
+    def process_task(self, task_name, manifest=None):
+        """Process a task, given as a blob manifest or a zip already in its task directory.
+
+        Returns (results_name, results_path); raises if the task cannot run.
+        """
+        task_dir, zip_path = self.task_paths(task_name)
+        start = time.perf_counter()
+        
+        if manifest is not None:
+            hashes = self.prepare_task_dir(task_dir, manifest)
+        else:
+            # Extract ZIP
+            hashes = ()
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                 zip_ref.extractall(task_dir)
-            
+        
+        # The blobs stay pinned (never evicted) until the task is done with them
+        try:
             # Execute main.py
             main_script = os.path.join(task_dir, 'main.py')
             if not os.path.exists(main_script):
                 raise Exception("main.py not found in task package")
-            
+        
             # Run the script and capture output
             stdout_path = os.path.join(task_dir, 'stdout.txt')
             stderr_path = os.path.join(task_dir, 'stderr.txt')
-            
-            with open(stdout_path, 'w') as stdout_file, open(stderr_path, 'w') as stderr_file:
-                process = subprocess.Popen(
-                    [sys.executable, main_script],
-                    stdout=stdout_file,
-                    stderr=stderr_file,
-                    cwd=task_dir
-                )
-                process.wait()
-            
-            # Create results ZIP
-            results_name = f"results_{task_name}"
-            results_path = os.path.join(self.work_dir, results_name)
-            
-            with zipfile.ZipFile(results_path, 'w') as zip_ref:
-                zip_ref.write(stdout_path, 'stdout.txt')
-                zip_ref.write(stderr_path, 'stderr.txt')
-            
-            # Read and encode results
-            with open(results_path, 'rb') as f:
-                results_data = base64.b64encode(f.read()).decode(ENCODING)
-            
-            return results_name, results_data
-            
+        
+            TASK_SECONDS.observe(time.perf_counter() - start, "prepare")
+            start = time.perf_counter()
+            if self.warm_pool is not None:
+                self.warm_pool.run(task_dir, main_script, stdout_path, stderr_path)
+            else:
+                with open(stdout_path, 'w') as stdout_file, open(stderr_path, 'w') as stderr_file:
+                    process = subprocess.Popen(
+                        [sys.executable, main_script],
+                        stdout=stdout_file,
+                        stderr=stderr_file,
+                        cwd=task_dir
+                    )
+                    process.wait()
+            TASK_SECONDS.observe(time.perf_counter() - start, "run")
+        finally:
+            if hashes:
+                # Drop cached blobs whose files changed on disk while the task ran
+                self.blob_store.check(hashes)
+                self.blob_store.unpin(hashes)
+        
+        # Create results ZIP
+        results_name = f"results_{task_name}"
+        results_path = os.path.join(self.work_dir, results_name)
+        
+        with zipfile.ZipFile(results_path, 'w') as zip_ref:
+            zip_ref.write(stdout_path, 'stdout.txt')
+            zip_ref.write(stderr_path, 'stderr.txt')
+        
+        return results_name, results_path
+
+    def run_task(self, task_id, manifest=None):
+        """Process one leased task and submit its result, or report the failure.
+
+        The task stays in `running` (its lease renewed by heartbeats) until
+        the result is uploaded; a task this peer gives up on lets its lease
+        lapse and the edge requeues it.
+        """
+        try:
+            self._run_task(task_id, manifest)
+        except Exception as e:
+            print(f"[PEER {self.peer_id}] Task {task_id} error: {e}")
+            TASKS.inc("lost")
+        finally:
+            with self.running_changed:
+                self.running.discard(task_id)
+                self.running_changed.notify_all()
+
+    def _run_task(self, task_id, manifest):
+        try:
+            results_name, results_path = self.process_task(task_id, manifest)
         except Exception as e:
             print(f"[PEER {self.peer_id}] Task processing error: {e}")
-            return None, None
+            TASKS.inc("failed")
+            self.session.request("TASK_FAILED", {
+                "peer_id": self.peer_id,
+                "task_id": task_id,
+                "error": str(e)
+            })
+            return
+        
+        # Submit results, sent from disk with sendfile
+        start = time.perf_counter()
+        with open(results_path, 'rb') as f:
+            msg_type, data, _ = self.session.request("SUBMIT_RESULT", {
+                "peer_id": self.peer_id,
+                "task_id": task_id,
+                "result_name": results_name
+            }, file=f)
+        TASK_SECONDS.observe(time.perf_counter() - start, "upload")
+        if msg_type == "OK":
+            TASKS.inc("completed")
+            print(f"[PEER {self.peer_id}] Results submitted successfully")
 
     def request_and_process_tasks(self):
-        """Main loop for requesting and processing tasks."""
+        """Main loop: keep every task slot busy, each task running on its own thread."""
         while True:
+            # Wait for a free slot, then ask for as many tasks as there are free slots
+            with self.running_changed:
+                while len(self.running) >= self.slots:
+                    self.running_changed.wait()
+                free = self.slots - len(self.running)
             try:
-                # Request task
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((self.master_ip, self.master_port))
-                    msg = build_message("REQUEST_TASK", {
-                        "peer_id": self.peer_id
-                    })
-                    send_json(s, msg)
-                    msg_type, data = parse_message(receive_json(s))
+                # Long-poll: the edge answers as soon as work arrives (or after
+                # TASK_WAIT with NO_TASKS). The packages are streamed straight to disk.
+                sink = TaskPackageSink(self)
+                try:
+                    msg_type, data, _ = self.session.request("REQUEST_TASK", {
+                        "peer_id": self.peer_id,
+                        "max_tasks": free,
+                        "wait": TASK_WAIT,
+                        "blobs": self.blob_store is not None
+                    }, timeout=TASK_WAIT + SESSION_REQUEST_TIMEOUT, sink_for=sink)
+                finally:
+                    sink.close()
                 
                 if msg_type == "TASK_PACKAGE":
-                    task_name = data.get("task_name")
-                    task_data = data.get("task_data")
-                    print(f"[PEER {self.peer_id}] Received task: {task_name}")
-                    
-                    # Process task
-                    results_name, results_data = self.process_task(task_name, task_data)
-                    if results_name and results_data:
-                        # Submit results
-                        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                            s.connect((self.master_ip, self.master_port))
-                            msg = build_message("SUBMIT_RESULT", {
-                                "peer_id": self.peer_id,
-                                "result_name": results_name,
-                                "result_data": results_data
-                            })
-                            send_json(s, msg)
-                            msg_type, data = parse_message(receive_json(s))
-                            if msg_type == "OK":
-                                print(f"[PEER {self.peer_id}] Results submitted successfully")
+                    tasks = data.get("tasks", [])
+                    task_ids = [task["task_id"] for task in tasks]
+                    print(f"[PEER {self.peer_id}] Received tasks: {', '.join(task_ids)}")
+                    with self.running_changed:
+                        self.running.update(task_ids)
+                    for task in tasks:
+                        self.executor.submit(self.run_task, task["task_id"], task.get("manifest"))
+                continue  # fill the remaining slots, or poll again after NO_TASKS
                 
             except Exception as e:
                 print(f"[PEER {self.peer_id}] Task processing cycle error: {e}")
             
-            time.sleep(UPDATE_INTERVAL)  # Wait before requesting next task
+            time.sleep(UPDATE_INTERVAL)  # Back off after an error before retrying
+
+    def start_metrics(self):
+        """Serve GET /metrics on METRICS_PORT (unless disabled or already taken)."""
+        if METRICS_PORT is None:
+            return
+        try:
+            server = metrics.serve_http(METRICS_HOST, METRICS_PORT)
+            print(f"[PEER {self.peer_id}] Metrics on http://{METRICS_HOST}:{server.server_address[1]}/metrics")
+        except OSError as e:
+            print(f"[PEER {self.peer_id}] Metrics endpoint unavailable: {e}")
 
     def run(self):
         """Start the peer node."""
+        self.start_metrics()
+
         # Discover master
         if not self.discover_master():
             print(f"[PEER {self.peer_id}] Failed to discover master")
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import queue
+import threading
+import subprocess
+
+_WORKER = os.path.abspath(__file__)
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class _Worker:
+    def __init__(self, preload):
+        self.process = subprocess.Popen(
+            [sys.executable, _WORKER, json.dumps(preload)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        self.tasks = 0
+        ready = self.process.stdout.readline()
+        if not ready:
+            raise WorkerError("Worker failed to start")
+
+    def run(self, cwd, script, stdout_path, stderr_path):
+        request = {"cwd": cwd, "script": script, "stdout": stdout_path, "stderr": stderr_path}
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b"\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        except (BrokenPipeError, ValueError) as e:
+            raise WorkerError(f"Worker died: {e}")
+        if not reply:
+            raise WorkerError("Worker died")
+        self.tasks += 1
+        return json.loads(reply)["returncode"]
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class WarmPool:
+    """Pre-warmed Python workers for running task scripts.
+
+    Each worker is a long-lived interpreter that imports `preload` once, then
+    forks a child per task. The child chdirs into the task directory, points
+    stdout/stderr at the task's files and runs the script with runpy, so a
+    task still gets a fresh process (nothing leaks between tasks) without
+    paying interpreter startup or the preloaded imports again.
+
+    Workers take requests as JSON lines on stdin and answer on stdout. A
+    worker is replaced after `max_tasks` tasks or when its RSS grows past
+    `max_rss_mb`. run() blocks until one of the `size` workers is free.
+    """
+
+    def __init__(self, size, preload=(), max_tasks=100, max_rss_mb=512):
+        self.preload = list(preload)
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self._idle = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(_Worker(self.preload))
+
+    def run(self, cwd, script, stdout_path, stderr_path):
+        """Run `script` in `cwd` with output captured to the given files. Returns its exit code."""
+        worker = self._idle.get()
+        try:
+            return worker.run(cwd, script, stdout_path, stderr_path)
+        except WorkerError:
+            worker.close()
+            worker = None
+            raise
+        finally:
+            self._release(worker)
+
+    def _release(self, worker):
+        if worker is not None and (not worker.alive() or worker.tasks >= self.max_tasks
+                                   or _rss_mb(worker.process.pid) > self.max_rss_mb):
+            worker.close()
+            worker = None
+        with self._lock:
+            if self._closed:
+                if worker is not None:
+                    worker.close()
+                return
+        self._idle.put(worker if worker is not None else _Worker(self.preload))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# Worker process
+
+def _run_child(request, proto_fds):
+    """In the forked child: become the task process and never return."""
+    code = 1
+    try:
+        for fd in proto_fds:
+            os.close(fd)
+        os.chdir(request["cwd"])
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        out = os.open(request["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        err = os.open(request["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(out, 1)
+        os.dup2(err, 2)
+        for fd in (null, out, err):
+            os.close(fd)
+
+        import runpy
+        import traceback
+        script = request["script"]
+        # Same view of the world as `python main.py` run from the task dir
+        sys.argv = [script]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        try:
+            runpy.run_path(script, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _worker_main(preload):
+    # Keep the pool's pipes on private descriptors; 0/1 are left for the tasks.
+    proto_in = os.fdopen(os.dup(0), "rb")
+    proto_out = os.fdopen(os.dup(1), "wb")
+    null = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null, 0)
+    os.dup2(2, 1)
+    os.close(null)
+
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception as e:
+            print(f"[WARM POOL] Could not preload {name}: {e}", file=sys.stderr)
+    proto_out.write(b"ready\n")
+    proto_out.flush()
+
+    for line in proto_in:
+        request = json.loads(line)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _run_child(request, (proto_in.fileno(), proto_out.fileno()))
+        _, status = os.waitpid(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        proto_out.write(json.dumps({"returncode": returncode}).encode() + b"\n")
+        proto_out.flush()
+
+
+if __name__ == "__main__":
+    # Started by WarmPool: not meant to be run by hand.
+    sys.path.pop(0)  # the peer's src dir must not shadow modules imported by tasks
+    _worker_main(json.loads(sys.argv[1]))
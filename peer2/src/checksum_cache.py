@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from files_utils import calculate_checksum
+
+
+class ChecksumCache:
+    """Checksums dos arquivos compartilhados, persistidos em disco.
+
+    Cada entrada é indexada por (inode, tamanho, mtime_ns): um arquivo só é
+    lido de novo quando um desses valores muda. Os hashes são calculados em
+    um pool de threads (o hashlib libera o GIL em blocos grandes).
+    """
+
+    def __init__(self, directory, cache_path, workers=4):
+        self.directory = directory
+        self.cache_path = cache_path
+        self.workers = workers
+        self.entries = {}  # nome -> [inode, tamanho, mtime_ns, checksum]
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _key(st):
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def _refresh(self, stats, removed):
+        """Aplica {nome: stat} e remoções; devolve True se algo mudou."""
+        stale = {name: st for name, st in stats.items()
+                 if self.entries.get(name, [None])[:3] != self._key(st)}
+        removed = [name for name in removed if name in self.entries]
+        if not stale and not removed:
+            return False
+
+        def hash_one(name):
+            try:
+                return name, calculate_checksum(os.path.join(self.directory, name))
+            except OSError:
+                return name, None  # removido enquanto era lido
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            hashed = dict(pool.map(hash_one, stale))
+        for name in removed:
+            del self.entries[name]
+        for name, checksum in hashed.items():
+            if checksum is None:
+                self.entries.pop(name, None)
+            else:
+                self.entries[name] = self._key(stale[name]) + [checksum]
+        return True
+
+    def scan(self):
+        """Varre o diretório e devolve {nome: checksum}, recalculando só o que mudou."""
+        with self._lock:
+            stats = {}
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        stats[entry.name] = entry.stat()
+            if self._refresh(stats, [name for name in self.entries if name not in stats]):
+                self.save()
+            return self.checksums()
+
+    def update(self, names):
+        """Atualiza só os arquivos indicados (eventos do watcher), sem varrer o diretório."""
+        with self._lock:
+            stats, removed = {}, []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                if os.path.isfile(path):
+                    try:
+                        stats[name] = os.stat(path)
+                        continue
+                    except FileNotFoundError:
+                        pass
+                removed.append(name)
+            if self._refresh(stats, removed):
+                self.save()
+            return self.checksums()
+
+    def checksums(self):
+        return {name: entry[3] for name, entry in self.entries.items()}
+
+
+def diff_files(old, new):
+    """Delta entre duas listagens {nome: checksum}."""
+    return {
+        "added": [{"name": n, "checksum": c} for n, c in new.items() if n not in old],
+        "modified": [{"name": n, "checksum": c} for n, c in new.items() if n in old and old[n] != c],
+        "removed": [n for n in old if n not in new],
+    }
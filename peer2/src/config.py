@@ -19,3 +19,46 @@ HEARTBEAT_INTERVAL = 10
 
 # Opcional: definir um PEER_ID único para o peer2, se não for informado via linha de comando.
 PEER_ID = "peer2"
+
+# Sessão persistente com o nó de borda
+SESSION_CONNECT_TIMEOUT = 5
+SESSION_REQUEST_TIMEOUT = 30
+RECONNECT_BACKOFF_MAX = 30
+
+# Compressão negociada por conexão com HELLO (codecs da stdlib: zlib, lzma, bz2)
+COMPRESSION = ["zlib", "lzma", "bz2"]  # ordem de preferência; [] desliga (melhor em LANs rápidas)
+COMPRESSION_LEVELS = {"zlib": 1, "lzma": 0, "bz2": 1}  # níveis mais rápidos: ver benchmarks/bench_compression.py
+COMPRESSION_MIN_SIZE = 1024  # corpos e anexos menores vão sem compressão
+
+# Servidor de arquivos: envios simultâneos limitados, fila justa entre clientes
+UPLOAD_SLOTS = 4  # GET_FILEs enviados ao mesmo tempo
+UPLOAD_QUEUE_MAX = 64  # pedidos esperando slot; além disso, BUSY na hora
+UPLOAD_QUEUE_TIMEOUT = 2.0  # segundos na fila antes de responder BUSY
+UPLOAD_RATE_LIMIT = None  # bytes/s por conexão (None = sem limite)
+MAX_CONNECTIONS = 128  # conexões atendidas; as demais recebem BUSY e são fechadas
+LISTEN_BACKLOG = 128
+
+# Métricas: GET /metrics no formato texto do Prometheus (e a mensagem STATS)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9102  # None desliga o endpoint HTTP
+
+# Cache de checksums dos arquivos compartilhados (fora de SHARED_FILES_DIR)
+CHECKSUM_CACHE_PATH = os.path.join(BASE_DIR, '.checksum_cache.json')
+HASH_WORKERS = 4
+
+# Observação de SHARED_FILES_DIR (inotify no Linux, polling nos demais casos)
+WATCH_SHARED_FILES = True
+WATCH_POLL_INTERVAL = 1.0
+WATCH_DEBOUNCE = 0.05  # agrupa rajadas de eventos antes de sincronizar
+
+# Downloads em paralelo de vários peers (swarm)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_SPAN = 16  # chunks pedidos de uma vez a um peer rápido
+DOWNLOAD_TARGET_REQUEST_SECONDS = 0.5  # duração alvo de cada requisição de faixa
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_CHECKPOINT_INTERVAL = 1.0
+DOWNLOAD_BUSY_WAIT_MAX = 60  # segundos que uma fonte pode responder só BUSY antes de ser abandonada
+DOWNLOAD_MAX_SOURCES = 8  # holders usados de uma vez, os menos carregados primeiro; os demais ficam de reserva
+
+# Downloads parciais (dados + bitmap) até o checksum ser verificado
+STAGING_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'partial_downloads'))
@@ -1,10 +1,212 @@
+import os
 import json
-from config import BUFFER_SIZE, ENCODING
+import struct
+from config import BUFFER_SIZE, ENCODING, COMPRESSION_MIN_SIZE
+from compression import (
+    CODEC_IDS, CODEC_NAMES, StreamDecompressor, compress, decompress, worth_compressing,
+    file_sample, compress_file_ranges
+)
+
+# Frame layout (network byte order):
+#   | body_type (1) | body_len (4) | attachment_len (8) | body | attachment |
+# The body is the JSON envelope; the attachment carries raw bytes (task
+# packages, results, file data) so they never have to be base64-encoded.
+# The first byte also flags compression: bits 0-3 are the body type, bits
+# 4-5 the body codec and bits 6-7 the attachment codec (see CODEC_IDS; only
+# codecs agreed on with a HELLO exchange are ever sent). Lengths are the
+# compressed sizes on the wire.
+HEADER = struct.Struct("!BIQ")
+BODY_JSON = 1
+MAX_BODY_SIZE = 64 * 1024 * 1024
+# Largest attachment a compressed one may expand to when its body announces no size
+MAX_ATTACHMENT_SIZE = 16 * 1024 ** 3
+THROTTLE_CHUNK_SIZE = 256 * 1024
+
+
+class ProtocolError(ValueError):
+    """Raised when a peer sends a malformed frame."""
+
+
+def attachment_limit(msg):
+    """Most bytes a compressed attachment of `msg` may decompress to.
+
+    The size the body announces (FILE_DATA length, BLOBS and TASK_PACKAGE
+    sizes), capped at MAX_ATTACHMENT_SIZE, which also applies to the rest.
+    """
+    data = msg.get("data") if isinstance(msg, dict) else None
+    announced = None
+    if isinstance(data, dict):
+        if msg.get("type") == "FILE_DATA":
+            announced = data.get("length")
+        elif msg.get("type") in ("BLOBS", "TASK_PACKAGE"):
+            items = data.get("blobs" if msg["type"] == "BLOBS" else "tasks")
+            sizes = [item.get("size") for item in items] if isinstance(items, list) and all(
+                isinstance(item, dict) for item in items) else [None]
+            if all(isinstance(size, int) and size >= 0 for size in sizes):
+                announced = sum(sizes)
+    if isinstance(announced, int) and 0 <= announced < MAX_ATTACHMENT_SIZE:
+        return announced
+    return MAX_ATTACHMENT_SIZE
+
+
+def _check_attachment(data, attachment_len, codec):
+    """Refuse an attachment larger than attachment_limit(data) before reading it.
+
+    A compressed one may exceed the limit by the little that compressing
+    incompressible data adds.
+    """
+    limit = attachment_limit(data)
+    if codec:
+        limit += limit // 64 + 1024
+    if attachment_len > limit:
+        raise ProtocolError(f"Attachment of {attachment_len} bytes exceeds the {limit} bytes announced")
+
+
+def _recv_exact(conn, size):
+    """Read exactly `size` bytes into a preallocated buffer."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = conn.recv_into(view[pos:], min(size - pos, BUFFER_SIZE * 16))
+        if not n:
+            raise ConnectionError("Connection closed before receiving complete message")
+        pos += n
+    return buf
+
+
+def _flags(body_codec=None, attachment_codec=None):
+    return BODY_JSON | CODEC_IDS.get(body_codec, 0) << 4 | CODEC_IDS.get(attachment_codec, 0) << 6
+
+
+def _unpack_header(header):
+    """Returns (body_codec, attachment_codec, body_len, attachment_len); codecs are names or None."""
+    flags, body_len, attachment_len = HEADER.unpack(header)
+    if flags & 0x0F != BODY_JSON:
+        raise ProtocolError(f"Unknown body type: {flags & 0x0F}")
+    if body_len > MAX_BODY_SIZE:
+        raise ProtocolError(f"Message body too large: {body_len} bytes")
+    if attachment_len > MAX_ATTACHMENT_SIZE:
+        raise ProtocolError(f"Attachment too large: {attachment_len} bytes")
+    return CODEC_NAMES.get(flags >> 4 & 3), CODEC_NAMES.get(flags >> 6), body_len, attachment_len
+
+
+def _encode_body(data, codec=None):
+    """JSON body, compressed with `codec` when that pays off. Returns (body, codec used)."""
+    body = json.dumps(data).encode(ENCODING)
+    if codec and len(body) >= COMPRESSION_MIN_SIZE:
+        packed = compress(body, codec)
+        if len(packed) < len(body):
+            return packed, codec
+    return body, None
+
+
+def _decode_body(body, codec):
+    if codec:
+        body = decompress(body, codec, MAX_BODY_SIZE)
+    return json.loads(body.decode(ENCODING))
+
+
+def send_message(conn, data, attachment=b"", codec=None):
+    """Send one frame; with `codec`, body and attachment are compressed when worthwhile.
+
+    Returns the frame's size on the wire.
+    """
+    body, body_codec = _encode_body(data, codec)
+    attachment_codec = None
+    if codec and worth_compressing(len(attachment), attachment):
+        attachment, attachment_codec = compress(attachment, codec), codec
+    header = HEADER.pack(_flags(body_codec, attachment_codec), len(body), len(attachment))
+    if len(attachment) <= BUFFER_SIZE:
+        conn.sendall(header + body + attachment)
+    else:
+        conn.sendall(header + body)
+        conn.sendall(attachment)
+    return len(header) + len(body) + len(attachment)
+
+
+def _sendfile(conn, file, offset, count, throttle=None):
+    if throttle is None:
+        conn.sendfile(file, offset, count)
+        return
+    while count:
+        n = min(count, THROTTLE_CHUNK_SIZE)
+        throttle(n)
+        conn.sendfile(file, offset, n)
+        offset += n
+        count -= n
+
+
+def send_file_message(conn, data, file, offset=0, count=None, codec=None, throttle=None):
+    """Send a frame whose attachment is `count` bytes of `file` from `offset`, using sendfile.
+
+    With `codec`, compressible content (judged from the file name and its
+    first bytes) is compressed into a temporary file first, on the calling
+    thread, and that file is sent instead. With `throttle`, the attachment
+    goes out in THROTTLE_CHUNK_SIZE pieces and throttle(n) is called before
+    each one (e.g. a token bucket that sleeps). Returns the frame's size on
+    the wire.
+    """
+    if count is None:
+        count = os.fstat(file.fileno()).st_size - offset
+    body, body_codec = _encode_body(data, codec)
+    if codec and worth_compressing(count, file_sample(file, offset), getattr(file, "name", None)):
+        packed, size = compress_file_ranges([(file, offset, count)], codec)
+        with packed:
+            conn.sendall(HEADER.pack(_flags(body_codec, codec), len(body), size) + body)
+            _sendfile(conn, packed, 0, size, throttle)
+        return HEADER.size + len(body) + size
+    conn.sendall(HEADER.pack(_flags(body_codec), len(body), count) + body)
+    if count:
+        _sendfile(conn, file, offset, count, throttle)
+    return HEADER.size + len(body) + count
+
+
+def _recv_stream(conn, size, sink):
+    """Pass `size` bytes to `sink(chunk)` as they arrive, reusing one buffer."""
+    buf = bytearray(min(size, BUFFER_SIZE * 64))
+    view = memoryview(buf)
+    remaining = size
+    while remaining:
+        n = conn.recv_into(view, min(remaining, len(buf)))
+        if not n:
+            raise ConnectionError("Connection closed before receiving complete message")
+        sink(view[:n])
+        remaining -= n
+
+
+def receive_message(conn, sink=None, sink_for=None, on_frame=None):
+    """Read one frame and return (data, attachment).
+
+    With `sink`, the attachment is streamed to `sink(chunk)` instead of being
+    buffered, and the returned attachment is empty. `sink_for(data)` picks the
+    sink once the body is decoded (None to buffer the attachment as usual).
+    Compressed bodies and attachments are decompressed transparently, an
+    attachment to at most attachment_limit(data) bytes.
+    `on_frame(size)` is told the frame's size on the wire once it is read.
+    """
+    body_codec, attachment_codec, body_len, attachment_len = _unpack_header(_recv_exact(conn, HEADER.size))
+    data = _decode_body(_recv_exact(conn, body_len), body_codec)
+    if on_frame is not None:
+        on_frame(HEADER.size + body_len + attachment_len)
+    _check_attachment(data, attachment_len, attachment_codec)
+    if attachment_len and sink is None and sink_for is not None:
+        sink = sink_for(data)
+    if attachment_len and sink is not None:
+        if attachment_codec:
+            sink = StreamDecompressor(attachment_codec, sink, attachment_limit(data))
+        _recv_stream(conn, attachment_len, sink)
+        return data, b""
+    attachment = _recv_exact(conn, attachment_len) if attachment_len else b""
+    if attachment_codec:
+        attachment = decompress(attachment, attachment_codec, attachment_limit(data))
+    return data, attachment
+
 
 def send_json(conn, data):
-    message = json.dumps(data).encode(ENCODING)
-    conn.sendall(message)
+    return send_message(conn, data)
+
 
 def receive_json(conn):
-    data = conn.recv(BUFFER_SIZE)
-    return json.loads(data.decode(ENCODING))
\ No newline at end of file
+    data, _ = receive_message(conn)
+    return data
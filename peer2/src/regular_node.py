@@ -3,10 +3,20 @@ import threading
 import os
 import sys
 import time
-from connection import send_json, receive_json
-from protocol import build_message, parse_message
-from files_utils import list_files, calculate_checksum
-from config import PEER_HOST, PEER_PORT, EDGE_NODE_HOST, EDGE_NODE_PORT, SHARED_FILES_DIR, ENCODING
+import metrics
+from connection import send_json, receive_message, send_file_message
+from protocol import build_message, parse_message, message_id, NAK_REGISTER, NAK_RESYNC
+from session import get_session
+from compression import negotiate
+from checksum_cache import ChecksumCache, diff_files
+from watcher import DirectoryWatcher
+from udp_heartbeat import UdpHeartbeat
+from upload_slots import UploadSlots, TokenBucket
+from config import (
+    PEER_HOST, PEER_PORT, EDGE_NODE_HOST, EDGE_NODE_PORT, SHARED_FILES_DIR, ENCODING,
+    CHECKSUM_CACHE_PATH, HASH_WORKERS, WATCH_POLL_INTERVAL, WATCH_DEBOUNCE, METRICS_HOST, METRICS_PORT,
+    UPLOAD_SLOTS, UPLOAD_QUEUE_MAX, UPLOAD_QUEUE_TIMEOUT, UPLOAD_RATE_LIMIT, MAX_CONNECTIONS, LISTEN_BACKLOG
+)
 
 # Obtém o PEER_ID, ou define como o hostname se não for passado via argumento ou no config
 try:
@@ -14,22 +24,115 @@ try:
 except ImportError:
     PEER_ID = socket.gethostname()
 
+REQUESTS = metrics.counter("peer_requests_total", "Pedidos atendidos pelo servidor de arquivos, por tipo", ("type",))
+REQUEST_SECONDS = metrics.histogram(
+    "peer_request_seconds", "Tempo para atender um pedido (até o fim do envio), por tipo", ("type",))
+BYTES_SENT = metrics.counter("peer_sent_bytes_total", "Bytes enviados pelo servidor de arquivos, por cliente", ("client",))
+BYTES_RECEIVED = metrics.counter("peer_received_bytes_total", "Bytes recebidos pelo servidor de arquivos, por cliente",
+                                 ("client",))
+CONNECTIONS = metrics.gauge("peer_connections", "Conexões abertas no servidor de arquivos")
+SERVED_TYPES = ("HELLO", "GET_FILE", "STATS")
+
+uploads = UploadSlots(UPLOAD_SLOTS, UPLOAD_QUEUE_MAX)
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+metrics.gauge("peer_upload_slots_in_use", "Slots de envio ocupados").set_function(uploads.in_use)
+metrics.gauge("peer_upload_queue", "GET_FILEs esperando um slot de envio").set_function(lambda: uploads.waiting)
+metrics.counter("peer_upload_busy_total", "GET_FILEs respondidos com BUSY").set_function(lambda: uploads.busy_replies)
+
+def send_file_range(conn, msg_id, data, codec=None, throttle=None):
+    """Responde a um GET_FILE com FILE_DATA e a faixa pedida (offset/length) via sendfile.
+
+    Com `codec`, conteúdo compressível é comprimido nesta thread antes do envio;
+    com `throttle`, o envio respeita o limite de banda da conexão.
+    """
+    filename = os.path.basename(data.get('filename') or '')
+    path = os.path.join(SHARED_FILES_DIR, filename)
+    if not filename or not os.path.isfile(path):
+        print(f"[PEER {PEER_ID}] Arquivo não encontrado: {filename}")
+        return send_json(conn, build_message("FILE_NOT_FOUND", {"filename": filename}, msg_id))
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = min(max(0, int(data.get('offset', 0))), size)
+        length = data.get('length')
+        count = size - offset if length is None else max(0, min(int(length), size - offset))
+        return send_file_message(conn, build_message("FILE_DATA", {
+            "filename": filename,
+            "offset": offset,
+            "length": count,
+            "size": size
+        }, msg_id), f, offset, count, codec=codec, throttle=throttle)
+
 def handle_request(conn):
-    """Função que lida com requisições de arquivos de outros peers."""
+    """Função que lida com requisições de arquivos de outros peers.
+
+    Uma mesma conexão pode carregar vários GET_FILE (faixas do mesmo arquivo).
+    Um HELLO inicial escolhe o codec de compressão da conexão. STATS devolve
+    as métricas do peer. Cada GET_FILE com dados ocupa um slot de envio
+    (fila justa entre clientes); sem slot, a resposta é BUSY com retry_after.
+    """
+    codec = None
+    client = "-"
+    bucket = TokenBucket(UPLOAD_RATE_LIMIT) if UPLOAD_RATE_LIMIT else None
+    CONNECTIONS.inc()
     try:
-        msg = receive_json(conn)
-        msg_type, data = parse_message(msg)
-
-        if msg_type == 'GET_FILE':
-            filename = data.get('filename')
-            path = os.path.join(SHARED_FILES_DIR, filename)
-            if os.path.exists(path):
-                with open(path, 'rb') as f:
-                    conn.sendfile(f)
+        client = conn.getpeername()[0]
+        received = []
+        while True:
+            try:
+                msg, _ = receive_message(conn, on_frame=received.append)
+            except ConnectionError:
+                break
+            start = time.perf_counter()
+            BYTES_RECEIVED.inc(client, value=received.pop())
+            msg_type, data = parse_message(msg)
+
+            if msg_type == 'HELLO':
+                codec = negotiate((data or {}).get("compression"))
+                sent = send_json(conn, build_message("HELLO", {"compression": codec}, message_id(msg)))
+            elif msg_type == 'GET_FILE':
+                sent = upload(conn, client, message_id(msg), data or {}, codec, bucket)
+            elif msg_type == 'STATS':
+                sent = send_json(conn, build_message("STATS", metrics.stats_reply(data), message_id(msg)))
             else:
-                print(f"[PEER {PEER_ID}] Arquivo não encontrado: {filename}")
+                sent = send_json(conn, build_message("ERROR", {"error": f"Tipo de mensagem desconhecido: {msg_type}"},
+                                                     message_id(msg)))
+            label = msg_type if msg_type in SERVED_TYPES else "unknown"
+            BYTES_SENT.inc(client, value=sent)
+            REQUESTS.inc(label)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, label)
     except Exception as e:
         print(f"[PEER {PEER_ID}] Erro em handle_request: {e}")
+    finally:
+        CONNECTIONS.dec()
+        connection_slots.release()
+        conn.close()
+
+def upload(conn, client, msg_id, data, codec, bucket):
+    """GET_FILE dentro de um slot de envio; pedidos de tamanho zero (sondagens) não esperam."""
+    if data.get('length') == 0:
+        return send_file_range(conn, msg_id, data, codec)
+    if not uploads.acquire(client, UPLOAD_QUEUE_TIMEOUT):
+        return send_json(conn, build_message("BUSY", {"retry_after": uploads.retry_after()}, msg_id))
+    start = time.monotonic()
+    sent = 0
+    try:
+        sent = send_file_range(conn, msg_id, data, codec, bucket.consume if bucket else None)
+        return sent
+    finally:
+        uploads.release(time.monotonic() - start, sent)
+
+def refuse(conn):
+    """Conexão além de MAX_CONNECTIONS: responde o HELLO, devolve BUSY ao primeiro pedido e fecha."""
+    try:
+        conn.settimeout(5)
+        while True:
+            msg, _ = receive_message(conn)
+            if parse_message(msg)[0] != 'HELLO':
+                break
+            send_json(conn, build_message("HELLO", {"compression": None}, message_id(msg)))
+        send_json(conn, build_message("BUSY", {"retry_after": uploads.retry_after()}, message_id(msg)))
+    except (OSError, ValueError):
+        pass
     finally:
         conn.close()
 
@@ -37,12 +140,73 @@ def serve():
     """Inicia o servidor que atende solicitações de outros peers (GET_FILE, etc.)."""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.bind((PEER_HOST, PEER_PORT))
-    server.listen(5)
-    print(f"[PEER {PEER_ID}] Aguardando conexões em {PEER_HOST}:{PEER_PORT}...")
+    server.listen(LISTEN_BACKLOG)
+    print(f"[PEER {PEER_ID}] Aguardando conexões em {PEER_HOST}:{PEER_PORT} "
+          f"({UPLOAD_SLOTS} slots de envio, até {MAX_CONNECTIONS} conexões)...")
 
     while True:
         conn, addr = server.accept()
-        threading.Thread(target=handle_request, args=(conn,), daemon=True).start()
+        if connection_slots.acquire(blocking=False):
+            threading.Thread(target=handle_request, args=(conn,), daemon=True).start()
+        else:
+            threading.Thread(target=refuse, args=(conn,), daemon=True).start()
+
+def start_metrics():
+    """Serve GET /metrics em METRICS_PORT (a não ser que esteja desligado)."""
+    if METRICS_PORT is None:
+        return None
+    try:
+        server = metrics.serve_http(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        print(f"[PEER {PEER_ID}] Endpoint de métricas indisponível: {e}")
+        return None
+    print(f"[PEER {PEER_ID}] Métricas em http://{METRICS_HOST}:{server.server_address[1]}/metrics")
+    return server
+
+def edge_session():
+    """Sessão persistente (compartilhada) com o nó de borda."""
+    session = get_session(EDGE_NODE_HOST, EDGE_NODE_PORT)
+    session.on_reconnect(register_with_edge)
+    return session
+
+# Última listagem de arquivos confirmada pelo nó de borda, com sua versão
+checksum_cache = ChecksumCache(SHARED_FILES_DIR, CHECKSUM_CACHE_PATH, HASH_WORKERS)
+synced = {"version": 0, "files": {}}
+sync_lock = threading.RLock()
+# Heartbeats sem mudanças vão por UDP quando o nó de borda oferece no REGISTERED
+udp = UdpHeartbeat()
+
+# Eventos do watcher ainda não aplicados ao cache (None = varredura completa)
+watcher = None
+file_events = threading.Event()
+changed_names = set()
+changes_lock = threading.Lock()
+
+def on_file_event(kind, name):
+    """Callback do watcher: anota o arquivo e acorda a thread de heartbeat."""
+    with changes_lock:
+        changed_names.add(None if kind == "rescan" else name)
+    file_events.set()
+
+def start_watcher():
+    """Passa a observar SHARED_FILES_DIR; os heartbeats deixam de varrer o diretório."""
+    global watcher
+    watcher = DirectoryWatcher(SHARED_FILES_DIR, on_file_event, WATCH_POLL_INTERVAL).start()
+    print(f"[PEER {PEER_ID}] Observando {SHARED_FILES_DIR} ({watcher.backend}).")
+    return watcher
+
+def apply_file_events():
+    """Atualiza o cache só com os arquivos que mudaram desde a última chamada."""
+    with changes_lock:
+        names = set(changed_names)
+        changed_names.clear()
+    if None in names:
+        checksum_cache.scan()
+    elif names:
+        checksum_cache.update(names)
+
+def file_listing(files):
+    return [{"name": name, "checksum": checksum} for name, checksum in sorted(files.items())]
 
 def register_with_edge():
     """Registra o peer e a lista de arquivos disponíveis com o nó de borda."""
@@ -50,47 +214,88 @@ def register_with_edge():
         print(f"[PEER {PEER_ID}] Diretório de arquivos compartilhados não encontrado: {SHARED_FILES_DIR}")
         return
 
-    files = list_files(SHARED_FILES_DIR)
-    print(f"[PEER {PEER_ID}] Diretório SHARED_FILES: {SHARED_FILES_DIR}")
-    print(f"[PEER {PEER_ID}] Arquivos detectados: {files}")  # Debug
+    with sync_lock:
+        files = checksum_cache.scan()
+        version = synced["version"] + 1
+        print(f"[PEER {PEER_ID}] Diretório SHARED_FILES: {SHARED_FILES_DIR}")
+        print(f"[PEER {PEER_ID}] Arquivos detectados: {sorted(files)}")  # Debug
 
-    file_data = [{"name": f, "checksum": calculate_checksum(os.path.join(SHARED_FILES_DIR, f))} for f in files]
-    print(f"[PEER {PEER_ID}] Dados dos arquivos a enviar: {file_data}")  # Debug
-
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((EDGE_NODE_HOST, EDGE_NODE_PORT))
-            msg = build_message("REGISTER", {
+        try:
+            msg_type, data, _ = edge_session().request("REGISTER", {
                 "peer_id": PEER_ID,
                 "host": PEER_HOST,
                 "port": PEER_PORT,
-                "files": file_data
+                "version": version,
+                "files": file_listing(files)
             })
-            send_json(s, msg)
-            response = receive_json(s)
-            if response.get("status") == "REGISTERED":
+            if msg_type == "REGISTERED":
+                synced.update(version=version, files=files)
+                udp.configure(EDGE_NODE_HOST, data.get("heartbeat"))
                 print(f"[PEER {PEER_ID}] Registro efetuado com sucesso.")
             else:
-                print(f"[PEER {PEER_ID}] Erro no registro: ", response)
-    except Exception as e:
-        print(f"[PEER {PEER_ID}] Exceção no registro: {e}")
+                print(f"[PEER {PEER_ID}] Erro no registro: ", data)
+        except Exception as e:
+            print(f"[PEER {PEER_ID}] Exceção no registro: {e}")
+
+def sync_files():
+    """Envia um heartbeat com o delta desde a última versão confirmada.
+
+    Sem mudanças, o heartbeat é um datagrama UDP; com delta (ou se o nó de
+    borda recusou o último datagrama), vai pela sessão TCP. Se o nó de borda
+    estiver em outra versão (RESYNC), reenvia a lista completa. Todo heartbeat
+    leva a carga do servidor de arquivos, usada pelo nó de borda para
+    ordenar as respostas de FIND_FILE.
+    """
+    with sync_lock:
+        if watcher is None:
+            files = checksum_cache.scan()
+        else:
+            apply_file_events()
+            files = checksum_cache.checksums()
+        base = synced["version"]
+        delta = diff_files(synced["files"], files)
+        load = uploads.load()
+        msg = {"peer_id": PEER_ID, "host": PEER_HOST, "port": PEER_PORT, "version": base, "load": load}
+        changed = any(delta.values())
+        nak = udp.nak()
+        if nak == NAK_REGISTER:
+            # O nó de borda não conhece mais o nosso token: registra de novo
+            register_with_edge()
+            return None
+        if not changed and nak != NAK_RESYNC and udp.send(base, load=load):
+            return None
+        if changed:
+            msg.update(version=base + 1, base_version=base, delta=delta)
+
+        msg_type, data, _ = edge_session().request("HEARTBEAT", msg)
+        if msg_type == "RESYNC":
+            print(f"[PEER {PEER_ID}] Versões divergentes, reenviando lista completa.")
+            msg = {"peer_id": PEER_ID, "host": PEER_HOST, "port": PEER_PORT,
+                   "version": base + 1, "files": file_listing(files), "load": load}
+            msg_type, data, _ = edge_session().request("HEARTBEAT", msg)
+        if msg_type == "ALIVE":
+            synced.update(version=msg["version"], files=files)
+            return delta if changed else None
+        if msg_type == "ERROR":
+            # O nó de borda foi reiniciado e não nos conhece: registra de novo
+            register_with_edge()
+        return None
 
 def send_heartbeat(interval=10):
-    """Envia periodicamente um heartbeat com informações atualizadas dos arquivos."""
+    """Envia periodicamente um heartbeat, com os arquivos alterados desde o último.
+
+    Com o watcher ativo, uma mudança em SHARED_FILES_DIR antecipa o heartbeat.
+    """
     while True:
+        file_events.clear()
         try:
-            files = list_files(SHARED_FILES_DIR)
-            file_data = [{"name": f, "checksum": calculate_checksum(os.path.join(SHARED_FILES_DIR, f))} for f in files]
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((EDGE_NODE_HOST, EDGE_NODE_PORT))
-                msg = build_message("HEARTBEAT", {
-                    "peer_id": PEER_ID,
-                    "host": PEER_HOST,
-                    "port": PEER_PORT,
-                    "files": file_data
-                })
-                send_json(s, msg)
-            print(f"[PEER {PEER_ID}] Enviou heartbeat com {len(files)} arquivo(s).")
+            delta = sync_files()
+            if delta:
+                print(f"[PEER {PEER_ID}] Heartbeat com delta: {len(delta['added'])} novo(s), "
+                      f"{len(delta['modified'])} alterado(s), {len(delta['removed'])} removido(s).")
+            else:
+                print(f"[PEER {PEER_ID}] Enviou heartbeat.")
         except Exception as e:
             print(f"[PEER {PEER_ID}] Erro ao enviar heartbeat: {e}")
-        time.sleep(interval)
+        if file_events.wait(interval):
+            time.sleep(WATCH_DEBOUNCE)
@@ -1,46 +1,38 @@
-import socket
 import os
-from connection import send_json, receive_json
-from protocol import build_message
-from config import EDGE_NODE_HOST, EDGE_NODE_PORT, SHARED_FILES_DIR, BUFFER_SIZE
+from session import get_ring
+from hash_ring import name_key
+from swarm import download, DownloadError, ChecksumMismatch
+from config import EDGE_NODE_HOST, EDGE_NODE_PORT, SHARED_FILES_DIR
 
 
 def request_file(filename):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((EDGE_NODE_HOST, EDGE_NODE_PORT))
-        msg = build_message("FIND_FILE", {"filename": filename})
-        send_json(s, msg)
-        response = receive_json(s)
-
-    response_type = response.get("type")
+    # Asked directly to the edge owning the name when there are several
+    ring = get_ring(EDGE_NODE_HOST, EDGE_NODE_PORT)
+    response_type, data, _ = ring.request(name_key(filename), "FIND_FILE", {"filename": filename})
     if response_type == "FILE_NOT_FOUND":
         print(f"[!] Nenhum peer possui o arquivo '{filename}'.")
         return
 
-    peers = response.get("data", {}).get("peers", [])
+    peers = (data or {}).get("peers", [])
     if not peers:
         print(f"[!] Nenhum peer possui o arquivo '{filename}'.")
         return
 
-    peer = peers[0]
-    peer_host = peer["host"]
-    peer_port = peer["port"]
-    print(f"[+] Arquivo encontrado em {peer_host}:{peer_port}, baixando...")
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as ps:
-        ps.connect((peer_host, peer_port))
-        msg = build_message("GET_FILE", {"filename": filename})
-        send_json(ps, msg)
-
-        path = os.path.join(SHARED_FILES_DIR, filename)
-        with open(path, "wb") as f:
-            while True:
-                data = ps.recv(BUFFER_SIZE)
-                if not data:
-                    break
-                f.write(data)
-
-    print(f"[✓] Arquivo '{filename}' salvo em {path}")
+    holders = {(p["host"], p["port"]) for p in peers}
+    print(f"[+] Arquivo encontrado em {len(holders)} peer(s), baixando em paralelo...")
+
+    path = os.path.join(SHARED_FILES_DIR, filename)
+    try:
+        checksum = download(peers, path)
+    except ChecksumMismatch as e:
+        print(f"[!] Download de '{filename}' descartado: {e}")
+        return
+    except DownloadError as e:
+        print(f"[!] Falha ao baixar '{filename}': {e}")
+        print("[!] O progresso foi mantido; execute novamente para retomar.")
+        return
+
+    print(f"[✓] Arquivo '{filename}' salvo em {path} (checksum {checksum[:12]}… verificado)")
 
 
 if __name__ == "__main__":
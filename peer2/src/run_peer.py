@@ -1,4 +1,5 @@
-from regular_node import serve, register_with_edge, send_heartbeat
+from regular_node import serve, register_with_edge, send_heartbeat, start_watcher, start_metrics
+from config import WATCH_SHARED_FILES
 import threading
 
 if __name__ == '__main__':
@@ -6,6 +7,13 @@ if __name__ == '__main__':
     server_thread = threading.Thread(target=serve)
     server_thread.start()
 
+    # Expõe /metrics para o Prometheus
+    start_metrics()
+
+    # Observa o diretório compartilhado para anunciar mudanças na hora
+    if WATCH_SHARED_FILES:
+        start_watcher()
+
     # Registra o peer no nó de borda
     register_with_edge()
 
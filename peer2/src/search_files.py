@@ -0,0 +1,30 @@
+from session import get_session
+from config import EDGE_NODE_HOST, EDGE_NODE_PORT
+
+
+def search_files(query, mode="substring", offset=0, limit=50):
+    session = get_session(EDGE_NODE_HOST, EDGE_NODE_PORT)
+    msg_type, data, _ = session.request("SEARCH", {
+        "query": query,
+        "mode": mode,
+        "offset": offset,
+        "limit": limit
+    })
+    if msg_type != "SEARCH_RESULTS":
+        print("Resposta inesperada:", msg_type, data)
+        return None
+
+    print(f"{data['total']} arquivo(s) encontrado(s) para '{query}':")
+    for result in data["results"]:
+        print(f" - {result['name']} ({result['holders']} peer(s))")
+    return data.get("next_offset")
+
+
+if __name__ == "__main__":
+    query = input("Digite parte do nome do arquivo: ")
+    mode = "prefix" if input("Buscar por prefixo? [s/N] ").strip().lower() == "s" else "substring"
+    offset = 0
+    while offset is not None:
+        offset = search_files(query, mode, offset)
+        if offset is not None and input("Mais resultados? [S/n] ").strip().lower() == "n":
+            break
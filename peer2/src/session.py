@@ -0,0 +1,299 @@
+import itertools
+import random
+import socket
+import threading
+import time
+import metrics
+from connection import send_message, send_file_message, receive_message
+from compression import negotiate
+from protocol import build_message, parse_message, message_id
+from hash_ring import HashRing, split_address
+from config import SESSION_CONNECT_TIMEOUT, SESSION_REQUEST_TIMEOUT, RECONNECT_BACKOFF_MAX, COMPRESSION
+
+REQUESTS = metrics.counter("peer_session_requests_total", "Requests sent on sessions, by message type", ("type",))
+REQUEST_ERRORS = metrics.counter(
+    "peer_session_request_errors_total", "Session requests that failed or timed out, by message type", ("type",))
+REQUEST_SECONDS = metrics.histogram(
+    "peer_session_request_seconds", "Round trip of session requests, by message type", ("type",))
+BYTES_SENT = metrics.counter("peer_session_sent_bytes_total", "Bytes sent on sessions, by node", ("node",))
+BYTES_RECEIVED = metrics.counter("peer_session_received_bytes_total", "Bytes received on sessions, by node", ("node",))
+
+
+def hello(sock):
+    """Offer our codecs on a fresh connection; returns the one the other side picked, or None.
+
+    Must run before any other request on `sock` (its reply carries ID 0).
+    """
+    if not COMPRESSION:
+        return None
+    send_message(sock, build_message("HELLO", {"compression": COMPRESSION}, 0))
+    msg, _ = receive_message(sock)
+    msg_type, data = parse_message(msg)
+    if msg_type != "HELLO":
+        return None  # e.g. ERROR from a node without compression support
+    return negotiate([(data or {}).get("compression")])
+
+
+class _Pending:
+    def __init__(self, sink_for=None):
+        self.event = threading.Event()
+        self.sink_for = sink_for
+        self.response = None
+        self.attachment = b""
+        self.error = None
+
+
+class EdgeSession:
+    """Long-lived connection to a node carrying many request/response exchanges.
+
+    Every request gets a correlation ID; a reader thread matches responses to
+    waiting callers, so several threads can share one socket. A dropped
+    connection is re-established on the next request with exponential backoff.
+    Each connection starts with a HELLO exchange that picks the compression
+    codec (see hello()); nodes that do not know HELLO get uncompressed frames.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._node = f"{host}:{port}"  # metrics label
+        self._sock = None
+        self.codec = None
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._reconnect_hooks = []
+        self._connects = 0
+        self._failures = 0
+        self._next_attempt = 0.0
+
+    def on_reconnect(self, callback):
+        """Call `callback()` after every reconnection (e.g. to re-REGISTER)."""
+        if callback not in self._reconnect_hooks:
+            self._reconnect_hooks.append(callback)
+
+    def _backoff(self):
+        delay = min(RECONNECT_BACKOFF_MAX, 0.5 * (2 ** self._failures))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _ensure_connected(self, deadline):
+        """Connect if needed. Returns True if a reconnection just happened."""
+        with self._connect_lock:
+            while self._sock is None:
+                wait = self._next_attempt - time.monotonic()
+                if wait > 0:
+                    if time.monotonic() + wait > deadline:
+                        raise ConnectionError(f"Edge {self.host}:{self.port} unavailable, backing off")
+                    time.sleep(wait)
+                try:
+                    sock = socket.create_connection((self.host, self.port), timeout=SESSION_CONNECT_TIMEOUT)
+                except OSError:
+                    self._next_attempt = time.monotonic() + self._backoff()
+                    self._failures += 1
+                    if time.monotonic() >= deadline:
+                        raise
+                    continue
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    self.codec = hello(sock)
+                except (OSError, ValueError) as e:
+                    sock.close()
+                    self._next_attempt = time.monotonic() + self._backoff()
+                    self._failures += 1
+                    if time.monotonic() >= deadline:
+                        raise ConnectionError(f"HELLO to {self.host}:{self.port} failed: {e}")
+                    continue
+                sock.settimeout(None)
+                self._sock = sock
+                self._failures = 0
+                self._connects += 1
+                threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+                return self._connects > 1
+        return False
+
+    def _read_loop(self, sock):
+        try:
+            while True:
+                msg, attachment = receive_message(sock, sink_for=self._sink_for, on_frame=self._received)
+                with self._pending_lock:
+                    pending = self._pending.pop(message_id(msg), None)
+                if pending is None:
+                    continue
+                pending.response = msg
+                pending.attachment = attachment
+                pending.event.set()
+        except Exception as e:
+            self._drop(sock, e)
+
+    def _received(self, size):
+        BYTES_RECEIVED.inc(self._node, value=size)
+
+    def _sink_for(self, msg):
+        """Stream a response attachment to the sink its caller asked for, if any."""
+        with self._pending_lock:
+            pending = self._pending.get(message_id(msg))
+        if pending is None or pending.sink_for is None:
+            return None
+        return pending.sink_for(*parse_message(msg))
+
+    def _drop(self, sock, error):
+        with self._connect_lock:
+            if self._sock is sock:
+                self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for p in pending.values():
+            p.error = ConnectionError(f"Session closed: {error}")
+            p.event.set()
+
+    def request(self, msg_type, data, attachment=b"", timeout=SESSION_REQUEST_TIMEOUT,
+                file=None, sink_for=None):
+        """Send a request and wait for its response. Returns (type, data, attachment).
+
+        `file` sends an open file as the attachment with sendfile. With
+        `sink_for(resp_type, resp_data)` returning a callable, the response
+        attachment is streamed to it instead of being buffered in memory.
+        """
+        start = time.perf_counter()
+        REQUESTS.inc(msg_type)
+        try:
+            response = self._request(msg_type, data, attachment, timeout, file, sink_for)
+        except Exception:
+            REQUEST_ERRORS.inc(msg_type)
+            raise
+        REQUEST_SECONDS.observe(time.perf_counter() - start, msg_type)
+        return response
+
+    def _request(self, msg_type, data, attachment, timeout, file, sink_for):
+        deadline = time.monotonic() + timeout
+        if self._ensure_connected(deadline):
+            for hook in self._reconnect_hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"[SESSION] Reconnect hook failed: {e}")
+        sock = self._sock
+        if sock is None:
+            raise ConnectionError(f"Edge {self.host}:{self.port} unavailable")
+
+        msg_id = next(self._ids)
+        pending = _Pending(sink_for)
+        with self._pending_lock:
+            self._pending[msg_id] = pending
+        try:
+            with self._send_lock:
+                if file is not None:
+                    sent = send_file_message(sock, build_message(msg_type, data, msg_id), file, codec=self.codec)
+                else:
+                    sent = send_message(sock, build_message(msg_type, data, msg_id), attachment, codec=self.codec)
+            BYTES_SENT.inc(self._node, value=sent)
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(msg_id, None)
+            self._drop(sock, e)
+            raise ConnectionError(f"Failed to send {msg_type}: {e}")
+
+        if not pending.event.wait(max(0.0, deadline - time.monotonic())):
+            with self._pending_lock:
+                self._pending.pop(msg_id, None)
+            raise TimeoutError(f"No response to {msg_type} within {timeout}s")
+        if pending.error:
+            raise pending.error
+        resp_type, resp_data = parse_message(pending.response)
+        return resp_type, resp_data, pending.attachment
+
+    def close(self):
+        sock = self._sock
+        if sock is not None:
+            self._drop(sock, "closed by client")
+
+
+class ConnectionPool:
+    """Process-wide pool of sessions, one per (host, port)."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port):
+        with self._lock:
+            session = self._sessions.get((host, port))
+            if session is None:
+                session = self._sessions[(host, port)] = EdgeSession(host, port)
+            return session
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+pool = ConnectionPool()
+
+
+def get_session(host, port):
+    return pool.get(host, port)
+
+
+class EdgeRing:
+    """Sends each request to the edge that owns its key (see hash_ring) when edges are federated.
+
+    Starts from one known edge and asks it for the ring (RING). A reply
+    carrying another ring version makes the next request fetch it again. If
+    the owner cannot be reached, the known edge gets the request and forwards
+    it, so routing with an outdated ring costs a hop, not an answer.
+    """
+
+    def __init__(self, host, port):
+        self.seed = get_session(host, port)
+        self.ring = None
+
+    def update(self, info):
+        self.ring = HashRing.from_dict(info)
+
+    def refresh(self):
+        msg_type, data, _ = self.seed.request("RING", {})
+        # Edges without RING answer ERROR: an empty ring sends everything to the seed
+        self.ring = HashRing.from_dict(data) if msg_type == "RING" else HashRing()
+
+    def session_for(self, key):
+        if self.ring is None:
+            self.refresh()
+        if len(self.ring) <= 1:
+            return self.seed
+        return get_session(*split_address(self.ring.owner(key)))
+
+    def request(self, key, msg_type, data, **kwargs):
+        """Like EdgeSession.request, on the session of the edge owning `key`."""
+        session = self.session_for(key)
+        try:
+            response = session.request(msg_type, data, **kwargs)
+        except OSError:
+            if session is self.seed:
+                raise
+            self.ring = None
+            response = self.seed.request(msg_type, data, **kwargs)
+        version = response[1].get("ring") if isinstance(response[1], dict) else None
+        if version and self.ring is not None and version != self.ring.version:
+            self.ring = None
+        return response
+
+
+_rings = {}
+_rings_lock = threading.Lock()
+
+
+def get_ring(host, port):
+    """Shared EdgeRing starting from the edge at (host, port)."""
+    with _rings_lock:
+        ring = _rings.get((host, port))
+        if ring is None:
+            ring = _rings[(host, port)] = EdgeRing(host, port)
+        return ring
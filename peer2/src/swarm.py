@@ -0,0 +1,422 @@
+import os
+import json
+import socket
+import hashlib
+import threading
+import time
+import metrics
+from collections import deque
+from connection import send_json, receive_message
+from protocol import build_message, parse_message
+from session import hello
+from config import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_MAX_SPAN,
+    DOWNLOAD_TARGET_REQUEST_SECONDS,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_CHECKPOINT_INTERVAL,
+    DOWNLOAD_BUSY_WAIT_MAX,
+    DOWNLOAD_MAX_SOURCES,
+    STAGING_DIR
+)
+
+DOWNLOAD_BYTES = metrics.counter(
+    "peer_download_bytes_total", "Bytes received from other peers' file servers, by source peer", ("source",))
+
+
+# (host, port) -> {"rtt": s, "throughput": bytes/s}, moving averages kept across downloads
+_estimates = {}
+_estimates_lock = threading.Lock()
+
+
+def _observe(peer, rtt=None, throughput=None):
+    """Fold a measured connect+HELLO time or transfer rate into the peer's estimate."""
+    with _estimates_lock:
+        estimate = _estimates.setdefault((peer["host"], peer["port"]), {})
+        for key, value in (("rtt", rtt), ("throughput", throughput)):
+            if value is not None:
+                old = estimate.get(key)
+                estimate[key] = value if old is None else old + (value - old) * 0.3
+
+
+def rank_sources(peers):
+    """Order holders by the load the edge reported, ties broken by our own throughput and RTT estimates.
+
+    Loads are compared to one decimal so that measurement noise does not
+    undo the edge's spreading; the sort is stable, so holders we know
+    nothing about keep the edge's order.
+    """
+    def key(peer):
+        with _estimates_lock:
+            estimate = dict(_estimates.get((peer["host"], peer["port"]), ()))
+        return (round(peer.get("load") or 0, 1), -estimate.get("throughput", 0), estimate.get("rtt", 0))
+    return sorted(peers, key=key)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+
+class SourceBusy(DownloadError):
+    """The source has no free upload slot; ask again after `retry_after` seconds."""
+
+    def __init__(self, peer_id, retry_after):
+        super().__init__(f"{peer_id}: busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SourceConnection:
+    """Persistent connection to one peer's file server for range requests."""
+
+    def __init__(self, peer):
+        self.peer = peer
+        started = time.monotonic()
+        self.sock = socket.create_connection((peer["host"], peer["port"]), timeout=DOWNLOAD_TIMEOUT)
+        try:
+            self.codec = hello(self.sock)  # FILE_DATA comes back compressed with it, if any
+        except (OSError, ValueError) as e:
+            self.sock.close()
+            raise ConnectionError(f"HELLO to {peer.get('peer_id')} failed: {e}")
+        _observe(peer, rtt=time.monotonic() - started)
+        self.filename = peer.get("filename")
+
+    def get_range(self, offset, length, sink):
+        """Fetch [offset, offset+length) and stream it to sink(position, chunk)."""
+        send_json(self.sock, build_message("GET_FILE", {
+            "filename": self.filename,
+            "offset": offset,
+            "length": length
+        }))
+        position = [offset]
+
+        def write(chunk):
+            sink(position[0], chunk)
+            position[0] += len(chunk)
+
+        msg, _ = receive_message(self.sock, sink=write, on_frame=self._received)
+        msg_type, data = parse_message(msg)
+        if msg_type == "BUSY":
+            raise SourceBusy(self.peer.get("peer_id"), float(data.get("retry_after") or 1))
+        if msg_type != "FILE_DATA":
+            raise DownloadError(f"{self.peer.get('peer_id')}: {msg_type}")
+        if data.get("length") != length:
+            raise DownloadError(f"{self.peer.get('peer_id')}: short range")
+        return data
+
+    def _received(self, size):
+        DOWNLOAD_BYTES.inc(str(self.peer.get("peer_id")), value=size)
+
+    def close(self):
+        self.sock.close()
+
+
+class PartialFile:
+    """A download in progress in the staging area.
+
+    Data lives in <staging>/<checksum>.part next to a <checksum>.json sidecar
+    holding the size, chunk size and a bitmap of completed chunks, so an
+    interrupted download resumes from any peer holding the same checksum.
+    Nothing appears in SHARED_FILES_DIR until commit().
+    """
+
+    def __init__(self, checksum, size, filename, staging_dir=STAGING_DIR, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        os.makedirs(staging_dir, exist_ok=True)
+        base = os.path.join(staging_dir, os.path.basename(checksum))
+        self.data_path = base + ".part"
+        self.state_path = base + ".json"
+        self.checksum = checksum
+        self.size = size
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.num_chunks = (size + chunk_size - 1) // chunk_size
+        self.done = self._load()
+
+    def _load(self):
+        empty = [False] * self.num_chunks
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if (state.get("size") != self.size or state.get("chunk_size") != self.chunk_size
+                or not os.path.exists(self.data_path)):
+            return empty
+        bits = bytes.fromhex(state["bitmap"])
+        return [bool(bits[i >> 3] & (1 << (i & 7))) for i in range(self.num_chunks)]
+
+    def save(self, done):
+        self.done = list(done)
+        bits = bytearray((self.num_chunks + 7) // 8)
+        for i, flag in enumerate(done):
+            if flag:
+                bits[i >> 3] |= 1 << (i & 7)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"filename": self.filename, "checksum": self.checksum, "size": self.size,
+                       "chunk_size": self.chunk_size, "bitmap": bits.hex()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def completed_bytes(self):
+        return sum(min(self.chunk_size, self.size - i * self.chunk_size) for i, d in enumerate(self.done) if d)
+
+    def commit(self, dest_path):
+        """Atomically move the verified file into place and drop the sidecar."""
+        os.replace(self.data_path, dest_path)
+        self._remove(self.state_path)
+
+    def discard(self):
+        self._remove(self.data_path)
+        self._remove(self.state_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class SwarmDownload:
+    """Download one file from every peer holding the same checksum at once.
+
+    The file is split into fixed-size chunks. Each source pulls a span of
+    chunks sized from its observed throughput (fast peers take more per
+    request), bytes are written with pwrite into a preallocated file, and the
+    SHA-256 is computed over the contiguous completed prefix while the
+    transfer is still running. When the queue runs dry, idle sources re-fetch
+    chunks still in flight on slower peers (endgame mode). Completed chunks
+    are checkpointed to the PartialFile bitmap after an fdatasync. A source
+    answering BUSY hands its chunks back to the others and is asked again
+    after its retry_after hint, for up to DOWNLOAD_BUSY_WAIT_MAX seconds.
+    """
+
+    def __init__(self, sources, partial):
+        self.sources = sources
+        self.partial = partial
+        self.checksum = partial.checksum
+        self.size = partial.size
+        self.path = partial.data_path
+        self.chunk_size = partial.chunk_size
+        self.num_chunks = partial.num_chunks
+        self.done = list(partial.done)
+        self.pending = deque(i for i in range(self.num_chunks) if not self.done[i])
+        self.in_flight = {}  # chunk -> number of sources fetching it
+        self.remaining = len(self.pending)
+        self.lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.last_checkpoint = time.monotonic()
+        self.sha256 = hashlib.sha256()
+        self.hashed = 0  # chunks already fed to sha256
+        self.hash_lock = threading.Lock()
+        self.fd = None
+        self.finished = threading.Event()  # set when the last chunk lands, to wake sources waiting out a BUSY
+        self.stats = {}  # peer_id -> {"bytes": n, "seconds": s}
+        self.errors = []
+
+    def _chunk_range(self, index):
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def _take_span(self, throughput):
+        """Pick the next chunks for a source, proportional to its throughput."""
+        span = 1
+        if throughput:
+            span = int(throughput * DOWNLOAD_TARGET_REQUEST_SECONDS / self.chunk_size)
+            span = max(1, min(DOWNLOAD_MAX_SPAN, span))
+        with self.lock:
+            if self.pending:
+                chunks = [self.pending.popleft()]
+                while len(chunks) < span and self.pending and self.pending[0] == chunks[-1] + 1:
+                    chunks.append(self.pending.popleft())
+            else:
+                # Endgame: duplicate the least-covered chunk still in flight
+                candidates = [c for c, n in self.in_flight.items() if not self.done[c]]
+                if not candidates:
+                    return []
+                chunks = [min(candidates, key=lambda c: self.in_flight[c])]
+            for c in chunks:
+                self.in_flight[c] = self.in_flight.get(c, 0) + 1
+            return chunks
+
+    def _release(self, chunks, completed):
+        with self.lock:
+            for c in chunks:
+                self.in_flight[c] -= 1
+                if completed and not self.done[c]:
+                    self.done[c] = True
+                    self.remaining -= 1
+                    if not self.remaining:
+                        self.finished.set()
+                if not self.in_flight[c]:
+                    del self.in_flight[c]
+                    if not self.done[c]:
+                        self.pending.appendleft(c)
+        if completed:
+            self._advance_hash()
+            if time.monotonic() - self.last_checkpoint >= DOWNLOAD_CHECKPOINT_INTERVAL:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        """Persist the bitmap of chunks whose data is durably on disk."""
+        if not self.checkpoint_lock.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                done = list(self.done)
+            os.fdatasync(self.fd)
+            self.partial.save(done)
+            self.last_checkpoint = time.monotonic()
+        finally:
+            self.checkpoint_lock.release()
+
+    def _advance_hash(self):
+        """Feed sha256 with every newly contiguous completed chunk."""
+        if not self.hash_lock.acquire(blocking=False):
+            return  # another thread is hashing and will pick these up
+        try:
+            while self.hashed < self.num_chunks and self.done[self.hashed]:
+                offset, length = self._chunk_range(self.hashed)
+                self.sha256.update(os.pread(self.fd, length, offset))
+                self.hashed += 1
+        finally:
+            self.hash_lock.release()
+
+    def _write(self, position, chunk):
+        os.pwrite(self.fd, chunk, position)
+
+    def _worker(self, peer):
+        peer_id = peer.get("peer_id")
+        stats = self.stats.setdefault(peer_id, {"bytes": 0, "seconds": 0.0})
+        busy_since = None
+        try:
+            while True:
+                received = stats["bytes"]
+                try:
+                    self._fetch(peer, stats)
+                    return
+                except SourceBusy as e:
+                    now = time.monotonic()
+                    if busy_since is None or stats["bytes"] > received:
+                        busy_since = now  # counts from the first BUSY since the source last sent data
+                    if now - busy_since + e.retry_after > DOWNLOAD_BUSY_WAIT_MAX:
+                        self.errors.append(str(e))
+                        return
+                    # The other sources take our chunks meanwhile
+                    if self.finished.wait(e.retry_after):
+                        return
+                except Exception as e:
+                    self.errors.append(f"{peer_id}: {e}")
+                    return
+        finally:
+            if stats["seconds"]:
+                _observe(peer, throughput=stats["bytes"] / stats["seconds"])
+
+    def _fetch(self, peer, stats):
+        """Pull spans from one source until nothing is left; raises on errors, chunks handed back."""
+        source = SourceConnection(peer)
+        try:
+            while True:
+                throughput = stats["bytes"] / stats["seconds"] if stats["seconds"] else 0
+                chunks = self._take_span(throughput)
+                if not chunks:
+                    return
+                offset = self._chunk_range(chunks[0])[0]
+                length = sum(self._chunk_range(c)[1] for c in chunks)
+                started = time.monotonic()
+                try:
+                    source.get_range(offset, length, self._write)
+                except Exception:
+                    self._release(chunks, completed=False)
+                    raise
+                stats["bytes"] += length
+                stats["seconds"] += time.monotonic() - started
+                self._release(chunks, completed=True)
+        finally:
+            source.close()
+
+    def run(self):
+        """Download into self.path. Raises DownloadError if it cannot complete or verify."""
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if hasattr(os, "posix_fallocate") and self.size:
+                os.posix_fallocate(self.fd, 0, self.size)
+            os.ftruncate(self.fd, self.size)
+            workers = [threading.Thread(target=self._worker, args=(peer,), daemon=True) for peer in self.sources]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            self._checkpoint()
+            if self.remaining:
+                raise DownloadError(f"{self.remaining} chunk(s) missing: {'; '.join(self.errors)}")
+            self._advance_hash()
+            digest = self.sha256.hexdigest()
+            if self.checksum and digest != self.checksum:
+                raise ChecksumMismatch(f"Checksum mismatch: expected {self.checksum}, got {digest}")
+            return digest
+        finally:
+            os.close(self.fd)
+
+
+def probe_size(peers):
+    """Ask the holders for the file size (a zero-length range) until one answers."""
+    for peer in peers:
+        try:
+            source = SourceConnection(peer)
+        except OSError:
+            continue
+        try:
+            return source.get_range(0, 0, lambda position, chunk: None)["size"]
+        except Exception:
+            continue
+        finally:
+            source.close()
+    raise DownloadError("No holder answered")
+
+
+def pick_sources(peers, checksum=None):
+    """Group FIND_FILE holders by checksum and keep the largest group (or `checksum`)."""
+    groups = {}
+    for peer in peers:
+        groups.setdefault(peer.get("checksum"), []).append(peer)
+    if checksum is not None:
+        return checksum, groups.get(checksum, [])
+    best = max(groups, key=lambda c: len(groups[c]))
+    return best, groups[best]
+
+
+def download(peers, dest_path, checksum=None):
+    """Download a file found via FIND_FILE from its holders. Returns the checksum.
+
+    Holders are ranked with rank_sources() and used DOWNLOAD_MAX_SOURCES at a
+    time, least loaded first; if a batch cannot finish, the next one picks
+    up the chunks it left. Resumes a previous partial download of the same
+    checksum. The file is renamed to `dest_path` only after the full
+    checksum verifies; on a mismatch the staged data is discarded.
+    """
+    checksum, sources = pick_sources(peers, checksum)
+    if not sources:
+        raise DownloadError("No peer holds this checksum")
+    sources = rank_sources(sources)
+    size = probe_size(sources)
+    partial = PartialFile(checksum, size, os.path.basename(dest_path))
+    resumed = partial.completed_bytes()
+    if resumed:
+        print(f"[+] Resuming download: {resumed}/{size} bytes already staged")
+    for start in range(0, len(sources), DOWNLOAD_MAX_SOURCES):
+        try:
+            SwarmDownload(sources[start:start + DOWNLOAD_MAX_SOURCES], partial).run()
+            break
+        except ChecksumMismatch:
+            partial.discard()
+            raise
+        except DownloadError:
+            if start + DOWNLOAD_MAX_SOURCES >= len(sources):
+                raise
+            print(f"[!] Download incomplete, trying the next {DOWNLOAD_MAX_SOURCES} holders")
+    partial.commit(dest_path)
+    return checksum
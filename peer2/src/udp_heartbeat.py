@@ -0,0 +1,72 @@
+import socket
+import threading
+from protocol import pack_heartbeat, HEARTBEAT_NAK_MAGIC
+
+# Larger beats (many running tasks) go over the TCP session instead
+MAX_DATAGRAM = 1400
+
+
+class UdpHeartbeat:
+    """Liveness beats to the edge as single UDP datagrams instead of session requests.
+
+    The edge offers them in its REGISTERED reply ({"token", "port"}); pass
+    that to configure() with the edge's host. Each beat carries the token
+    and a sequence number, so the edge drops replayed or reordered ones. The
+    edge answers only when it cannot apply a beat, with a NAK read back by
+    nak(): NAK_REGISTER (it does not know the token any more) or NAK_RESYNC
+    (our file list version differs).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sock = None
+        self.addr = None
+        self.token = None
+        self.seq = 0
+
+    @property
+    def active(self):
+        return self.token is not None
+
+    def configure(self, host, offer):
+        """Use the edge's offer from REGISTERED; None (an edge without UDP heartbeats) turns them off."""
+        with self.lock:
+            if not offer or not offer.get("port"):
+                self.token = None
+                return
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.setblocking(False)
+            self._drain()  # NAKs for the previous token
+            self.addr = (host, offer["port"])
+            self.token = bytes.fromhex(offer["token"])
+            self.seq = 0
+
+    def send(self, files_version=0, free_slots=-1, tasks=(), load=None):
+        """Send one beat. False if UDP is off or the beat is too large: send a TCP HEARTBEAT then."""
+        with self.lock:
+            if self.token is None:
+                return False
+            packet = pack_heartbeat(self.token, self.seq + 1, files_version, free_slots, tasks, load)
+            if len(packet) > MAX_DATAGRAM:
+                return False
+            self.seq += 1
+            self.sock.sendto(packet, self.addr)
+            return True
+
+    def nak(self):
+        """Reason of the latest NAK received since the last call, or None."""
+        with self.lock:
+            return self._drain() if self.sock is not None else None
+
+    def _drain(self):
+        reason = None
+        while True:
+            try:
+                packet = self.sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                return reason
+            except OSError:
+                continue  # ICMP error from an earlier beat (edge down): nothing to act on
+            if packet[:2] == HEARTBEAT_NAK_MAGIC:
+                reason = packet[2:3]
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class UploadSlots:
+    """Número fixo de envios simultâneos, com fila justa entre clientes.
+
+    Quem chega com todos os slots ocupados espera numa fila própria do seu
+    cliente; cada slot liberado vai para o próximo cliente da rodada
+    (round-robin), então um cliente com muitos pedidos não atrasa os outros.
+    Pedidos além de `queue_max` na fila, ou que esperam mais que o timeout,
+    recebem BUSY com retry_after(): uma estimativa de quando tentar de novo.
+    """
+
+    def __init__(self, slots, queue_max):
+        self.slots = slots
+        self.queue_max = queue_max
+        self.free = slots
+        self.queues = OrderedDict()  # cliente -> deque de _Ticket, na ordem da rodada
+        self.waiting = 0
+        self.avg_seconds = 0.1  # média móvel da duração de um envio
+        self.busy_replies = 0
+        self.sent_bytes = 0
+        self._rate_since = time.monotonic()
+        self._rate_bytes = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, client, timeout):
+        """Ocupa um slot; False se a fila estiver cheia ou a espera passar de `timeout` segundos."""
+        with self.cond:
+            if self.free and not self.waiting:
+                self.free -= 1
+                return True
+            if self.waiting >= self.queue_max:
+                self.busy_replies += 1
+                return False
+            ticket = _Ticket()
+            self.queues.setdefault(client, deque()).append(ticket)
+            self.waiting += 1
+            deadline = time.monotonic() + timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue = self.queues[client]
+                    queue.remove(ticket)
+                    if not queue:
+                        del self.queues[client]
+                    self.waiting -= 1
+                    self.busy_replies += 1
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def release(self, seconds, sent=0):
+        """Libera o slot de um envio de `sent` bytes que levou `seconds`, passando-o ao próximo cliente da rodada."""
+        with self.cond:
+            self.avg_seconds += (seconds - self.avg_seconds) * 0.2
+            self.sent_bytes += sent
+            if not self.queues:
+                self.free += 1
+                return
+            client, queue = next(iter(self.queues.items()))
+            queue.popleft().granted = True
+            self.waiting -= 1
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.cond.notify_all()
+
+    def retry_after(self):
+        """Segundos até a fila andar o bastante para mais um pedido."""
+        with self.cond:
+            return round(max(0.05, self.avg_seconds * (self.waiting + 1) / self.slots), 3)
+
+    def load(self):
+        """Carga para os heartbeats: slots, envios ativos e na fila, bytes/s enviados desde a última chamada."""
+        with self.cond:
+            now = time.monotonic()
+            elapsed = now - self._rate_since
+            rate = (self.sent_bytes - self._rate_bytes) / elapsed if elapsed > 0 else 0
+            self._rate_since, self._rate_bytes = now, self.sent_bytes
+            return {"slots": self.slots, "active": self.slots - self.free, "queued": self.waiting, "rate": int(rate)}
+
+    def in_use(self):
+        with self.cond:
+            return self.slots - self.free
+
+
+class TokenBucket:
+    """Limita uma conexão a `rate` bytes/s, com rajadas de até `burst` bytes."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def consume(self, n):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
@@ -0,0 +1,154 @@
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# Constantes de <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct("iIII")
+# Sem IN_CREATE: um arquivo escrito no lugar só é anunciado depois de fechado
+# (IN_CLOSE_WRITE), então nunca se publica o checksum de um arquivo pela metade.
+_WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DirectoryWatcher:
+    """Observa um diretório e publica eventos de arquivo assim que acontecem.
+
+    `callback(kind, name)` recebe kind em "added", "changed", "deleted", ou
+    "rescan" (name=None) quando eventos foram perdidos e é preciso varrer tudo.
+    Usa inotify no Linux e, nos demais casos, compara (inode, tamanho,
+    mtime_ns) das entradas a cada `poll_interval` segundos.
+    """
+
+    def __init__(self, directory, callback, poll_interval=1.0, use_inotify=True):
+        self.directory = directory
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self._libc = _load_inotify() if use_inotify else None
+        self._stop = threading.Event()
+        self._wake = None  # write end of a pipe that interrupts the inotify read
+        self._thread = None
+
+    @property
+    def backend(self):
+        return "inotify" if self._libc is not None else "polling"
+
+    def start(self):
+        target = self._run_inotify if self._libc is not None else self._run_polling
+        self._thread = threading.Thread(target=target, daemon=True, name="shared-files-watcher")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        wake = self._wake
+        if wake is not None:
+            try:
+                os.write(wake, b"x")
+            except OSError:
+                pass
+
+    def _emit(self, kind, name):
+        try:
+            self.callback(kind, name)
+        except Exception as e:
+            print(f"[WATCHER] Erro no callback ({kind} {name}): {e}")
+
+    def _run_inotify(self):
+        fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0 or self._libc.inotify_add_watch(fd, os.fsencode(self.directory), _WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            print(f"[WATCHER] inotify indisponível ({os.strerror(err)}), usando polling.")
+            if fd >= 0:
+                os.close(fd)
+            self._libc = None
+            return self._run_polling()
+        wake_r, self._wake = os.pipe()
+        try:
+            while not self._stop.is_set():
+                try:
+                    ready, _, _ = select.select([fd, wake_r], [], [])
+                    if fd not in ready:
+                        continue  # stop() woke us
+                    buf = os.read(fd, 64 * 1024)
+                except InterruptedError:
+                    continue
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                self._dispatch(buf)
+        finally:
+            wake_w, self._wake = self._wake, None
+            for f in (fd, wake_r, wake_w):
+                os.close(f)
+
+    def _dispatch(self, buf):
+        offset = 0
+        while offset + _EVENT.size <= len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, offset)
+            raw_name = buf[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self._emit("rescan", None)
+                continue
+            if mask & IN_ISDIR or not raw_name:
+                continue
+            name = os.fsdecode(raw_name)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._emit("deleted", name)
+            elif mask & IN_MOVED_TO:
+                self._emit("added", name)
+            elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+                self._emit("changed", name)
+
+    def _snapshot(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        snapshot[entry.name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError as e:
+            print(f"[WATCHER] Erro ao listar {self.directory}: {e}")
+        return snapshot
+
+    def _run_polling(self):
+        previous = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            for name, key in current.items():
+                old = previous.get(name)
+                if old is None:
+                    self._emit("added", name)
+                elif old != key:
+                    self._emit("changed", name)
+            for name in previous:
+                if name not in current:
+                    self._emit("deleted", name)
+            previous = current